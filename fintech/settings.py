@@ -42,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'issuer.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -79,9 +80,22 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': int(os.getenv('ISSUER_CONN_MAX_AGE', '60')),
     }
 }
 
+# Read-only copy of default database for history, balance
+# and report reads, e.g. SQLite file copied from primary
+if os.getenv('ISSUER_REPLICA_DB'):
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.getenv('ISSUER_REPLICA_DB'),
+        'CONN_MAX_AGE': int(os.getenv('ISSUER_CONN_MAX_AGE', '60')),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['issuer.routers.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.11/ref/settings/#auth-password-validators
@@ -122,6 +136,98 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# Requests slower than this number of milliseconds are logged
+# together with their SQL, None - do not log slow requests
+ISSUER_SLOW_REQUEST_MS = None
+
+# Maximal number of transactions in one batch request
+ISSUER_MAX_BATCH_SIZE = 10000
+
+# SQLite file of asynchronous ingest journal and number of its partitions,
+# 'ingest_worker' can run at most ISSUER_INGEST_PARTITIONS workers
+ISSUER_INGEST_JOURNAL = os.path.join(BASE_DIR, 'ingest.sqlite3')
+ISSUER_INGEST_PARTITIONS = 16
+
+# Default and maximal page size of transaction history
+ISSUER_PAGE_SIZE = 100
+ISSUER_MAX_PAGE_SIZE = 1000
+
+# Cache of current account balances, BACKEND is
+# issuer.cache.DjangoCacheBackend (OPTIONS: alias of django cache
+# and key_prefix), which is shared by processes with shared CACHES
+# backend (memcached, database) and caches nothing with default
+# per-process CACHES, or issuer.cache.LocMemBackend, which is
+# invalidated only by own process - single process only
+ISSUER_BALANCE_CACHE = {
+    'BACKEND': 'issuer.cache.DjangoCacheBackend',
+    'TIMEOUT': 5,
+    'MAX_ENTRIES': 10000,
+}
+
+# Number of transactions on account between balance checkpoints
+# taken by 'checkpoint_balances --new', which should run periodically
+ISSUER_CHECKPOINT_INTERVAL = 1000
+
+# Days to keep balance checkpoints older than the latest one of account,
+# None - keep all of them
+ISSUER_CHECKPOINT_RETENTION = 90
+
+# Add every saved transaction to volume rollups, otherwise
+# rollups are updated by 'rollup_transactions' command
+ISSUER_ROLLUP_ON_SAVE = False
+
+# Seconds 'rollup_transactions' lags behind, longer
+# than any transaction writing to issuer stays open
+ISSUER_ROLLUP_LAG = 60
+
+# Seconds after which unsettled part of authorisation is released
+# from hold by 'expire_holds' command
+ISSUER_HOLD_LIFETIME = 7 * 24 * 3600
+
+# Seconds for which processes cache cutoff of transaction archive,
+# 'archive_transactions' waits as long before moving transactions
+ISSUER_ARCHIVE_CUTOFF_TTL = 5
+
+# Alias of replica database, None - read everything from default
+ISSUER_REPLICA_DATABASE = 'replica' if 'replica' in DATABASES else None
+
+# Seconds for which reads of just written card go to default database,
+# writes are noted in default cache, which should be shared by processes
+# (memcached, database) when ISSUER_REPLICA_DATABASE is set
+ISSUER_READ_YOUR_WRITES = 5
+
+# Use write-ahead log of SQLite databases, so reads do not wait for writes
+ISSUER_SQLITE_WAL = True
+
+# In-memory authorisation engine, None - authorise in database.
+# Authorisations are logged to LOG file and saved in batches of FLUSH_SIZE
+# every FLUSH_INTERVAL seconds. Engine runs in one process only (log
+# is locked), so application should be served by one worker process
+# with threads, the second process fails to start. Ingest queue is
+# disabled with engine, e.g.
+# {'LOG': os.path.join(BASE_DIR, 'engine.log'), 'FLUSH_SIZE': 500, 'FLUSH_INTERVAL': 0.5}
+ISSUER_AUTH_ENGINE = None
+
+# Limits of number and amount of authorisations per card in "minute",
+# "hour" and "day" windows, None - no limits. Windows are counted in memory
+# of every process, at most MAX_CARDS recently active cards, e.g.
+# {'LIMITS': {'minute': {'COUNT': 5}, 'day': {'COUNT': 100, 'AMOUNT': '5000.00'}}, 'MAX_CARDS': 100000}
+ISSUER_VELOCITY = None
+
+# Keys of saved transactions kept in memory to answer repeated
+# transactions without queries, RETENTION is in seconds
+ISSUER_IDEMPOTENCY = {
+    'MAX_ENTRIES': 100000,
+    'RETENTION': 3600,
+}
+
+# Maximal number of points of balance history in one request
+ISSUER_MAX_BALANCE_POINTS = 1000
+
+# Maximal number of cards in one bulk balance request,
+# they are looked up with one "IN (...)" query
+ISSUER_MAX_BULK_BALANCES = 500
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -132,29 +238,49 @@ LOGGING = {
         'simple': {
             'format': '%(levelname)s %(message)s'
         },
+        'json': {
+            '()': 'issuer.logs.JsonFormatter'
+        },
+    },
+    'filters': {
+        # Part of INFO and DEBUG records of high-volume loggers which is written
+        'sample': {
+            '()': 'issuer.logs.SamplingFilter',
+            'rate': os.getenv('ISSUER_LOG_SAMPLE_RATE', '1.0'),
+        },
     },
     'handlers': {
         'console': {
             'level': 'INFO',
-            'class': 'logging.StreamHandler',
-            'formatter': 'simple'
+            'class': 'issuer.logs.BackgroundHandler',
+            'formatter': 'simple',
+            'target': 'logging.StreamHandler',
+            'queue_size': 10000,
         },
         'file': {
             'level': 'DEBUG',
-            'class': 'logging.FileHandler',
-            'formatter': 'verbose',
-            'filename': 'django.log'
+            'class': 'issuer.logs.BackgroundHandler',
+            'formatter': os.getenv('ISSUER_LOG_FORMAT', 'verbose'),
+            'target': 'logging.FileHandler',
+            'options': {'filename': 'django.log', 'delay': True},
+            'queue_size': 10000,
         }
     },
     'loggers': {
         'django': {
             'handlers': ['console', 'file'],
-            'level': os.getenv('DJANGO_LOG_LEVEL', 'DEBUG'),
+            'level': os.getenv('DJANGO_LOG_LEVEL', 'INFO'),
             'propagate': True,
         },
         'fintech.issuer': {
             'handlers': ['console', 'file'],
-            'level': os.getenv('DJANGO_LOG_LEVEL', 'DEBUG')
-        }
+            'level': os.getenv('DJANGO_LOG_LEVEL', 'INFO')
+        },
+        'fintech.issuer.views': {
+            'filters': ['sample'],
+        },
+        'fintech.issuer.batch': {
+            'filters': ['sample'],
+        },
     }
 }
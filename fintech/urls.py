@@ -4,8 +4,14 @@ from rest_framework.documentation import include_docs_urls
 from issuer import views
 
 urlpatterns = [
+    url(r'^accounts/balances$', views.AccountBalances.as_view()),
     url(r'^accounts/(?P<name>[a-zA-Z0-9]+)/transactions', views.AccountTransactions.as_view()),
+    url(r'^accounts/(?P<name>[a-zA-Z0-9]+)/balance/history$', views.AccountBalanceHistory.as_view()),
     url(r'^accounts/(?P<name>[a-zA-Z0-9]+)/balance', views.AccountBalance.as_view()),
+    url(r'^reports/volumes$', views.VolumeReport.as_view()),
+    url(r'^metrics$', views.metrics),
+    url(r'^queue/(?P<pk>[0-9]+)$', views.IngestStatus.as_view()),
+    url(r'^queue/?$', views.IngestQueueHandler.as_view()),
     url(r'', views.TransactionHandler.as_view()),
     url(r'^docs/', include_docs_urls(title='Card issuer API'))
 ]
@@ -14,3 +14,11 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fintech.settings")
 
 application = get_wsgi_application()
+
+# Velocity windows are rebuilt and authorisation engine is loaded
+# before the first request, second process of engine and replica
+# without shared cache fail here
+from issuer import engine, routers, velocity  # noqa: E402
+velocity.get_checker()
+engine.get_engine()
+routers.recent_writes()
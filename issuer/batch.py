@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import logging
+import random
+from collections import OrderedDict
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Value, When
+from rest_framework import status
+from issuer import idempotency, velocity
+from issuer.models import Account, AccountStripe, Transaction, Transfer, VolumeRollup, AUTHORISATION
+from issuer.serializers import BatchTransactionSerializer
+
+logger = logging.getLogger('fintech.issuer.batch')
+
+# Keeps "IN (...)" lists below SQLite limit of query variables
+CHUNK_SIZE = 500
+
+# Updates with "CASE WHEN id THEN value" and "IN (...)" take
+# three variables per id, chunks of them are smaller
+CASE_CHUNK_SIZE = CHUNK_SIZE // 3
+
+# Updates of balance and on_hold take five variables per row
+FUNDS_CHUNK_SIZE = CHUNK_SIZE // 5
+
+
+def chunks(values, size=CHUNK_SIZE):
+    """Split list of values into lists of at most 'size' items"""
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def accepted(item):
+    return {"transaction_id": item.get("transaction_id"), "status": status.HTTP_200_OK}
+
+
+def rejected(item, errors):
+    if not isinstance(item, dict):
+        item = {}
+    return {
+        "transaction_id": item.get("transaction_id"),
+        "status": status.HTTP_403_FORBIDDEN,
+        "errors": errors
+    }
+
+
+def ingest(items):
+    """
+    Validate and save batch of transactions.
+    Returns list of results in the same order as 'items'.
+    """
+    results = []
+    rows = []
+    for item in items:
+        serializer = BatchTransactionSerializer(data=item)
+        if serializer.is_valid():
+            rows.append((len(results), serializer.validated_data))
+            results.append(accepted(serializer.validated_data))
+        else:
+            results.append(rejected(item, serializer.errors))
+    if rows:
+        reservations = []
+        try:
+            with transaction.atomic():
+                apply(rows, results, reservations)
+        except Exception:
+            for reservation in reservations:
+                velocity.release(reservation)
+            raise
+        repeats = idempotency.get_filter()
+        for index, data in rows:
+            if results[index]["status"] == status.HTTP_200_OK:
+                repeats.remember((data["transaction_id"], data.get("type", AUTHORISATION),
+                    data["card_id"], data.get("sequence", 0)))
+    logger.info("Handled batch of %s transactions", len(results))
+    return results
+
+
+def ingest_journal(journal, partitions, limit):
+    """
+    Apply next entries of ingest journal partitions as one batch.
+    Entry recovered after stopped worker may be already saved,
+    then it is accepted as repeated transaction.
+    Returns number of handled entries.
+    """
+    entries = journal.claim(partitions, limit)
+    if not entries:
+        return 0
+    results = ingest([item for _, item, _ in entries])
+    journal.complete([(pk, result) for (pk, _, _), result in zip(entries, results)])
+    return len(entries)
+
+
+def apply(rows, results, reservations):
+    """
+    Check validated rows against one prefetch of accounts,
+    authorisations and existing transactions, then write
+    accepted rows with bulk inserts and grouped updates of accounts
+    and stripes. Authorisation of striped account is held on a stripe,
+    starting from random one, or on account row like 'Account.authorize'
+    does, presentment is settled on the stripe of its authorisation.
+    Velocity limits are checked and reserved per authorisation,
+    reservations are added to 'reservations' to release on failure.
+    Repeated transaction is not applied again and stays accepted
+    like saved one. Results of rejected rows are replaced in 'results'.
+    """
+    card_ids = set(data["card_id"] for _, data in rows)
+    transaction_ids = set(data["transaction_id"] for _, data in rows)
+
+    # Authorisations are locked before accounts like presentment
+    # and expiry of single authorisation do, so their expiry is seen
+    existing = set()
+    authorisations = {}
+    for ids in chunks(transaction_ids):
+        for tr in Transaction.objects.select_for_update().filter(transaction_id__in=ids):
+            existing.add((tr.transaction_id, tr.type, tr.card_id_id, tr.sequence))
+            if tr.type == AUTHORISATION:
+                authorisations[(tr.transaction_id, tr.card_id_id)] = tr
+    accounts = {}
+    for ids in chunks(card_ids):
+        accounts.update(Account.objects.select_for_update().in_bulk(ids))
+
+    # Funds of (card_id, stripe number), None of account row
+    funds = dict(((card_id, None), [acc.balance, acc.on_hold]) for card_id, acc in accounts.items())
+    stripes = {}
+    striped = [card_id for card_id, acc in accounts.items() if acc.stripe_count]
+    for ids in chunks(striped):
+        for stripe in AccountStripe.objects.select_for_update().filter(account__in=ids):
+            funds[(stripe.account_id, stripe.number)] = [stripe.balance, stripe.on_hold]
+            stripes[(stripe.account_id, stripe.number)] = stripe.pk
+    deltas = OrderedDict()
+    new_authorisations = []
+    presentments = []
+    transfers = []
+    for index, data in rows:
+        card_id = data["card_id"]
+        tr_type = data.get("type", AUTHORISATION)
+        key = (data["transaction_id"], tr_type, card_id, data.get("sequence", 0))
+        amount = Decimal(data["billing_amount"])
+        auth = authorisations.get((data["transaction_id"], card_id))
+        error = None
+        if card_id not in accounts:
+            error = "Account does not exist"
+        elif key in existing:
+            logger.info("Repeated transaction %s", key)
+            continue
+        elif tr_type == AUTHORISATION:
+            target = get_holder(funds, card_id, accounts[card_id].stripe_count, amount)
+            if target is None:
+                error = "No sufficient funds"
+            else:
+                try:
+                    reservations.append(velocity.check(card_id, amount))
+                except velocity.VelocityLimitExceeded as exc:
+                    error = "{}".format(exc)
+                hold, debit = amount, 0
+        elif auth is None:
+            error = "Not performed autorization for this transaction!"
+        else:
+            target = (card_id, auth.stripe) if (card_id, auth.stripe) in funds else (card_id, None)
+            hold, debit = -auth.unsettled(amount), amount
+        if error:
+            results[index] = rejected(data, {"non_field_errors": [error]})
+            continue
+
+        existing.add(key)
+        funds[target][0] -= debit
+        funds[target][1] += hold
+        delta = deltas.setdefault(target, [Decimal(0), Decimal(0)])
+        delta[0] -= debit
+        delta[1] += hold
+        fields = dict(data)
+        fields["card_id"] = accounts[card_id]
+        tr = Transaction(**fields)
+        if tr_type == AUTHORISATION:
+            tr.settled_amount = Decimal(0)
+            tr.stripe = target[1]
+            authorisations[(data["transaction_id"], card_id)] = tr
+            new_authorisations.append(tr)
+        else:
+            auth.settled_amount += amount
+            tr.stripe = auth.stripe
+            presentments.append((tr, auth))
+            transfers.append(Transfer(
+                credit=data.get("settlement_amount", 0),
+                debit=amount,
+                currency=data["billing_currency"]
+            ))
+
+    Transaction.objects.bulk_create(new_authorisations)
+    link_presentments(presentments, new_authorisations)
+    Transaction.objects.bulk_create([tr for tr, _ in presentments])
+    Transfer.objects.bulk_create(transfers)
+    if settings.ISSUER_ROLLUP_ON_SAVE:
+        VolumeRollup.objects.add(new_authorisations + [tr for tr, _ in presentments])
+    add_funds(Account, dict((card_id, delta) for (card_id, stripe), delta in deltas.items() if stripe is None))
+    add_funds(AccountStripe, dict((stripes[target], delta) for target, delta in deltas.items()
+        if target[1] is not None))
+    for card_id in set(card_id for card_id, _ in deltas):
+        Account.objects.invalidate_balance(card_id)
+
+
+def get_holder(funds, card_id, stripe_count, amount):
+    """
+    (card_id, stripe number) of the first stripe, starting from random one,
+    or (card_id, None) of account row with enough avaliable funds for amount,
+    None if none of them has
+    """
+    start = random.randrange(stripe_count) if stripe_count else 0
+    targets = [(card_id, (start + i) % stripe_count) for i in range(stripe_count)] + [(card_id, None)]
+    for target in targets:
+        if target in funds and funds[target][0] - funds[target][1] >= amount:
+            return target
+    return None
+
+
+def add_funds(model, deltas):
+    """
+    Add (balance, on_hold) deltas to rows of model by primary key,
+    with one update per chunk of rows
+    """
+    for ids in chunks(deltas, FUNDS_CHUNK_SIZE):
+        model.objects.filter(pk__in=ids).update(
+            balance=F("balance") + Case(
+                *[When(pk=pk, then=Value(deltas[pk][0])) for pk in ids],
+                output_field=DecimalField()
+            ),
+            on_hold=F("on_hold") + Case(
+                *[When(pk=pk, then=Value(deltas[pk][1])) for pk in ids],
+                output_field=DecimalField()
+            )
+        )
+
+
+def link_presentments(presentments, new_authorisations):
+    """
+    Set authorisation of presentments and save settled amount
+    of authorisations written before this batch, the settled amount
+    of 'new_authorisations' is inserted with them.
+    Ids of new authorisations are looked up with one query
+    where bulk inserts do not return them.
+    """
+    inserted = dict(((auth.transaction_id, auth.card_id_id), auth) for auth in new_authorisations)
+    missing = set(auth.transaction_id for _, auth in presentments
+        if auth.pk is None and (auth.transaction_id, auth.card_id_id) in inserted)
+    for ids in chunks(missing):
+        for tr_id, card_id, pk in Transaction.objects.\
+                filter(transaction_id__in=ids, type=AUTHORISATION).\
+                values_list("transaction_id", "card_id", "id"):
+            if (tr_id, card_id) in inserted:
+                inserted[(tr_id, card_id)].pk = pk
+    settled = {}
+    for tr, auth in presentments:
+        tr.authorisation_id = auth.pk
+        if (auth.transaction_id, auth.card_id_id) not in inserted:
+            settled[auth.pk] = settled.get(auth.pk, 0) + tr.billing_amount
+    for ids in chunks(settled, CASE_CHUNK_SIZE):
+        Transaction.objects.filter(pk__in=ids).update(
+            settled_amount=F("settled_amount") + Case(
+                *[When(pk=pk, then=Value(settled[pk])) for pk in ids],
+                output_field=DecimalField()
+            )
+        )
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+import math
+import random
+import time
+from collections import OrderedDict
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+FUND = "fund"
+
+
+class TrafficGenerator(object):
+    """
+    Synthetic traffic of card scheme and customer apps:
+    funding of accounts, authorisations followed by presentments,
+    retries of already sent transactions, history and balance reads
+    """
+
+    def __init__(self, accounts=10, presentment_ratio=0.8, duplicate_ratio=0.05,
+                 read_ratio=0.2, amount="1000.00", seed=None):
+        self.cards = ["{:04d}BENCH".format(i) for i in range(accounts)]
+        self.presentment_ratio = presentment_ratio
+        self.duplicate_ratio = duplicate_ratio
+        self.read_ratio = read_ratio
+        self.amount = amount
+        self.random = random.Random(seed)
+
+    def funding(self):
+        for card_id in self.cards:
+            yield {"method": FUND, "card_id": card_id, "amount": self.amount, "currency": "EUR"}
+
+    def transaction(self, tr_type, card_id, transaction_id, amount):
+        data = {"type": tr_type,
+            "card_id": card_id,
+            "transaction_id": transaction_id,
+            "billing_amount": amount,
+            "billing_currency": "EUR",
+            "transaction_amount": amount,
+            "transaction_currency": "EUR"}
+        if tr_type == "presentment":
+            data["settlement_amount"] = amount
+            data["settlement_currency"] = "EUR"
+        return {"method": "post", "path": "/", "data": data}
+
+    def read(self, card_id):
+        path = self.random.choice(["/accounts/{}/transactions", "/accounts/{}/balance"])
+        return {"method": "get", "path": path.format(card_id), "data": {}}
+
+    def requests(self, count):
+        """
+        Generate 'count' requests after funding of accounts
+        """
+        for request in self.funding():
+            yield request
+        sent = []
+        authorised = []
+        for number in range(count):
+            choice = self.random.random()
+            card_id = self.random.choice(self.cards)
+            if choice < self.read_ratio:
+                yield self.read(card_id)
+            elif sent and choice < self.read_ratio + self.duplicate_ratio:
+                yield self.random.choice(sent)
+            elif authorised and self.random.random() < self.presentment_ratio / (1 + self.presentment_ratio):
+                auth = authorised.pop(self.random.randrange(len(authorised)))["data"]
+                request = self.transaction("presentment", auth["card_id"],
+                    auth["transaction_id"], auth["billing_amount"])
+                sent.append(request)
+                yield request
+            else:
+                amount = "{:.2f}".format(self.random.randint(1, 5000) / 100.0)
+                request = self.transaction("authorisation", card_id, "BENCH{}".format(number), amount)
+                sent.append(request)
+                authorised.append(request)
+                yield request
+
+
+def classify(request):
+    """Name of endpoint for report"""
+    if request["path"].endswith("/transactions"):
+        return "AccountTransactions"
+    if request["path"].endswith("/balance"):
+        return "AccountBalance"
+    return "TransactionHandler"
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return 0
+    return values[max(int(math.ceil(percent / 100.0 * len(values))) - 1, 0)]
+
+
+class ClientTransport(object):
+    """Sends requests through django test client and counts queries"""
+    counts_queries = True
+
+    def __init__(self):
+        self.client = Client()
+
+    def send(self, request):
+        with CaptureQueriesContext(connection) as queries:
+            if request["method"] == "post":
+                response = self.client.post(request["path"],
+                    data=json.dumps(request["data"]), content_type="application/json")
+            else:
+                response = self.client.get(request["path"], data=request["data"])
+        return response.status_code, len(queries)
+
+
+class HttpTransport(object):
+    """Sends requests to running server"""
+    counts_queries = False
+
+    def __init__(self, url):
+        import requests
+        self.session = requests.Session()
+        self.url = url.rstrip("/")
+
+    def send(self, request):
+        if request["method"] == "post":
+            response = self.session.post(self.url + request["path"], json=request["data"])
+        else:
+            response = self.session.get(self.url + request["path"], params=request["data"])
+        return response.status_code, None
+
+
+class Benchmark(object):
+    """Sends requests and collects latency, status and query statistics"""
+
+    def __init__(self, transport, fund):
+        self.transport = transport
+        self.fund = fund
+        self.stats = OrderedDict()
+        self.elapsed = 0
+
+    def run(self, requests):
+        started = time.time()
+        for request in requests:
+            if request["method"] == FUND:
+                self.fund(request)
+                continue
+            before = time.time()
+            code, queries = self.transport.send(request)
+            latency = time.time() - before
+            endpoint = self.stats.setdefault(classify(request),
+                {"latency": [], "queries": 0, "statuses": {}})
+            endpoint["latency"].append(latency)
+            endpoint["queries"] += queries or 0
+            endpoint["statuses"][code] = endpoint["statuses"].get(code, 0) + 1
+        self.elapsed = time.time() - started
+        return self.report()
+
+    def report(self):
+        """
+        List of per endpoint statistics, latency in milliseconds
+        """
+        rows = []
+        for name, endpoint in self.stats.items():
+            latency = sorted(endpoint["latency"])
+            count = len(latency)
+            rows.append(OrderedDict([
+                ("endpoint", name),
+                ("requests", count),
+                ("throughput", count / self.elapsed if self.elapsed else 0),
+                ("p50", percentile(latency, 50) * 1000),
+                ("p95", percentile(latency, 95) * 1000),
+                ("p99", percentile(latency, 99) * 1000),
+                ("queries", float(endpoint["queries"]) / count
+                    if self.transport.counts_queries else None),
+                ("statuses", endpoint["statuses"]),
+            ]))
+        return rows
+
+
+def record(requests, stream):
+    """Write requests into JSONL stream, returns number of lines"""
+    count = 0
+    for request in requests:
+        stream.write(json.dumps(request) + "\n")
+        count += 1
+    return count
+
+
+def replay(stream):
+    """Read requests from JSONL stream written by 'record'"""
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
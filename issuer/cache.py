@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.signals import setting_changed
+from django.utils.module_loading import import_string
+
+
+class LocMemBackend(object):
+    """
+    Least recently used entries in memory of process,
+    entries expire after 'timeout' seconds
+    """
+
+    def __init__(self, timeout, max_entries, **options):
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            try:
+                expires, value = self.entries.pop(key)
+            except KeyError:
+                return None
+            if expires < time.time():
+                return None
+            self.entries[key] = (expires, value)
+            return value
+
+    def get_many(self, keys):
+        return dict((key, value) for key, value in ((key, self.get(key)) for key in keys)
+            if value is not None)
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time() + self.timeout, value)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class DjangoCacheBackend(object):
+    """
+    Entries in one of django CACHES, shared by processes
+    if that cache is not local to process (locmem, dummy)
+    """
+
+    def __init__(self, timeout, max_entries, alias="default", key_prefix="issuer:balance:", **options):
+        self.timeout = timeout
+        self.cache = caches[alias]
+        self.shared = not isinstance(self.cache, (LocMemCache, DummyCache))
+        self.key_prefix = key_prefix
+
+    def get(self, key):
+        return self.cache.get(self.key_prefix + key)
+
+    def get_many(self, keys):
+        values = self.cache.get_many([self.key_prefix + key for key in keys])
+        return dict((key[len(self.key_prefix):], value) for key, value in values.items())
+
+    def set(self, key, value):
+        self.cache.set(self.key_prefix + key, value, self.timeout)
+
+    def delete(self, key):
+        self.cache.delete(self.key_prefix + key)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class BalanceCache(object):
+    """
+    Read-through cache of current account balances.
+    Balance is cached with generation of account read before
+    it was loaded, invalidation replaces generation with new one,
+    so balance loaded before concurrent invalidation is not used.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, card_id, load):
+        """
+        Get cached balance of account or call 'load' and cache its result.
+        Missing accounts ('load' returns None) are not cached,
+        nothing is cached by backend with zero timeout.
+        """
+        if not self.backend.timeout:
+            self.misses += 1
+            return load()
+        key = "generation:" + card_id
+        entries = self.backend.get_many([card_id, key])
+        generation = entries.get(key)
+        if generation is not None and card_id in entries and entries[card_id][0] == generation:
+            self.hits += 1
+            return entries[card_id][1]
+        self.misses += 1
+        if generation is None:
+            generation = uuid.uuid4().hex
+            self.backend.set(key, generation)
+        value = load()
+        if value is not None:
+            self.backend.set(card_id, (generation, value))
+        return value
+
+    def invalidate(self, card_id):
+        if self.backend.timeout:
+            self.backend.set("generation:" + card_id, uuid.uuid4().hex)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+_balances = None
+
+
+def balances():
+    """
+    Get balance cache configured by ISSUER_BALANCE_CACHE setting,
+    django cache local to process is not used, as other processes
+    could not invalidate balances in it
+    """
+    global _balances
+    if _balances is None:
+        config = settings.ISSUER_BALANCE_CACHE
+        backend = import_string(config["BACKEND"])(
+            timeout=config.get("TIMEOUT", 5),
+            max_entries=config.get("MAX_ENTRIES", 10000),
+            **config.get("OPTIONS", {})
+        )
+        if isinstance(backend, DjangoCacheBackend) and not backend.shared:
+            backend.timeout = 0
+        _balances = BalanceCache(backend)
+    return _balances
+
+
+def reset(**kwargs):
+    global _balances
+    if kwargs.get("setting", "ISSUER_BALANCE_CACHE") in ("ISSUER_BALANCE_CACHE", "CACHES"):
+        _balances = None
+
+
+setting_changed.connect(reset)
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import logging
+from django.db import transaction
+from django.db.models import Count, Max, Q
+from issuer.batch import CASE_CHUNK_SIZE, CHUNK_SIZE, chunks
+from issuer.models import Account, BalanceCheckpoint, RollupCursor, Transaction
+
+logger = logging.getLogger('fintech.issuer.checkpoints')
+
+
+def get_pending(card_ids):
+    """
+    Number of transactions after the latest checkpoint
+    of every account with such transactions, at most
+    CASE_CHUNK_SIZE accounts
+    """
+    last = dict(BalanceCheckpoint.objects.filter(account__in=card_ids).\
+        values_list("account").annotate(Max("last_transaction")).order_by())
+    condition = Q()
+    for card_id in card_ids:
+        condition |= Q(card_id=card_id, id__gt=last.get(card_id, 0))
+    return dict(Transaction.objects.filter(condition).\
+        values_list("card_id").annotate(Count("id")).order_by())
+
+
+def take_due(card_ids, interval):
+    """
+    Take checkpoints of accounts among 'card_ids' with at least
+    'interval' transactions after their latest checkpoint.
+    Returns number of taken checkpoints.
+    """
+    taken = 0
+    for ids in chunks(card_ids, CASE_CHUNK_SIZE):
+        for card_id, pending in get_pending(ids).items():
+            if pending >= interval:
+                BalanceCheckpoint.objects.take(Account(card_id=card_id))
+                taken += 1
+    return taken
+
+
+def take_new(interval, name="checkpoints"):
+    """
+    Take checkpoints of accounts with transactions since
+    the previous call which are due by 'interval',
+    cursor keeps id of the last seen transaction
+    """
+    cursor, _ = RollupCursor.objects.get_or_create(name=name)
+    until = Transaction.objects.aggregate(last=Max("id"))["last"] or 0
+    card_ids = Transaction.objects.filter(id__gt=cursor.last_transaction, id__lte=until).\
+        values_list("card_id", flat=True).distinct()
+    taken = take_due(card_ids.iterator(), interval)
+    RollupCursor.objects.filter(pk=cursor.pk).update(last_transaction=until)
+    return taken
+
+
+def prune(before, chunk_size=CHUNK_SIZE):
+    """
+    Delete checkpoints taken before 'before' of accounts
+    which have newer checkpoints, returns their number
+    """
+    old = BalanceCheckpoint.objects.filter(
+        date__lt=before,
+        account__in=BalanceCheckpoint.objects.filter(date__gte=before).values("account")
+    )
+    deleted = 0
+    while True:
+        ids = list(old.order_by("id").values_list("id", flat=True)[:chunk_size])
+        if not ids:
+            break
+        with transaction.atomic():
+            BalanceCheckpoint.objects.filter(id__in=ids).delete()
+        deleted += len(ids)
+    logger.info("Deleted %s checkpoints taken before %s", deleted, before)
+    return deleted
@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import fcntl
+import io
+import json
+import logging
+import os
+import threading
+from array import array
+from decimal import Decimal
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from issuer import idempotency
+from issuer.batch import chunks
+from issuer.models import Account, EngineCheckpoint, InsufficientFunds, Transaction, VolumeRollup, \
+    AUTHORISATION
+
+logger = logging.getLogger('fintech.issuer.engine')
+
+# Fields of authorisation kept in log
+FIELDS = ("transaction_id", "card_id", "billing_amount", "billing_currency",
+    "transaction_amount", "transaction_currency", "settlement_amount", "settlement_currency")
+
+CENT = Decimal("0.01")
+
+
+def to_cents(amount):
+    return int(Decimal(amount) / CENT)
+
+
+def read_funds(card_ids=None):
+    """
+    Total funds of accounts and their stripes in cents
+    as {card_id: [balance, on_hold]}
+    """
+    accounts = Account.objects.all()
+    if card_ids is not None:
+        accounts = accounts.filter(card_id__in=card_ids)
+    funds = {}
+    striped = []
+    for card_id, balance, on_hold, stripe_count in \
+            accounts.values_list("card_id", "balance", "on_hold", "stripe_count").iterator():
+        funds[card_id] = [to_cents(balance), to_cents(on_hold)]
+        if stripe_count:
+            striped.append(card_id)
+    for ids in chunks(striped):
+        for card_id, (balance, on_hold) in Account.objects.stripe_funds(ids).items():
+            funds[card_id][0] += to_cents(balance)
+            funds[card_id][1] += to_cents(on_hold)
+    return funds
+
+
+def get_key(data):
+    return (data["transaction_id"], AUTHORISATION, data["card_id"], 0)
+
+
+class AuthorisationEngine(object):
+    """
+    Funds of accounts in memory of process. Authorisations are decided
+    in memory and appended to fsync'd log before they are acknowledged,
+    'flush' saves them to database in batches. Entries of log which
+    were not saved before restart are saved by 'load'.
+    Decisions are right only while engine is the only writer
+    of authorisations, so one process holds lock of log and ingest
+    queue is disabled. Funds added by others (loads, expired holds)
+    are read again before declining authorisation.
+    Concurrent authorisations share one fsync of log.
+    """
+
+    def __init__(self, path, flush_size=500, name="default"):
+        self.path = path
+        self.flush_size = flush_size
+        self.name = name
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.slots = {}
+        self.balance = array(str("l"))
+        self.on_hold = array(str("l"))
+        self.pending = []
+        self.keys = set()
+        self.sequence = 0
+        self.synced = 0
+        self.log = None
+        self.lock_file = None
+
+    @property
+    def flushing_path(self):
+        return self.path + ".flushing"
+
+    @property
+    def lock_path(self):
+        return self.path + ".lock"
+
+    def set_funds(self, card_id, balance, on_hold):
+        """Set funds of card in cents, returns its slot"""
+        slot = self.slots.get(card_id)
+        if slot is None:
+            slot = self.slots[card_id] = len(self.balance)
+            self.balance.append(balance)
+            self.on_hold.append(on_hold)
+        else:
+            self.balance[slot] = balance
+            self.on_hold[slot] = on_hold
+        return slot
+
+    def load(self):
+        """
+        Lock log for this process, read funds of all accounts
+        and save authorisations logged before restart
+        """
+        self.lock_file = io.open(self.lock_path, "ab")
+        try:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            self.lock_file.close()
+            raise ImproperlyConfigured("ISSUER_AUTH_ENGINE runs in one process only, "
+                "log {} is locked by another process".format(self.path))
+        with self.flush_lock:
+            with self.lock:
+                for card_id, (balance, on_hold) in read_funds().items():
+                    self.set_funds(card_id, balance, on_hold)
+                checkpoint, _ = EngineCheckpoint.objects.get_or_create(name=self.name)
+                self.sequence = checkpoint.sequence
+                for entry in self.read_log():
+                    if entry["seq"] > checkpoint.sequence:
+                        self.hold(entry)
+                        self.sequence = entry["seq"]
+                entries, self.pending = self.pending, []
+                self.synced = self.sequence
+            if entries:
+                logger.warning("Recovering %s authorisations from log", len(entries))
+                self.save(entries)
+            for path in (self.flushing_path, self.path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.log = io.open(self.path, "ab")
+        return self
+
+    def read_log(self):
+        """
+        Entries of log files, write of the last entry may be
+        interrupted, then it was not acknowledged and is skipped
+        """
+        for path in (self.flushing_path, self.path):
+            if not os.path.exists(path):
+                continue
+            with io.open(path, "rb") as log:
+                for line in log:
+                    try:
+                        yield json.loads(line.decode("utf-8"))
+                    except ValueError:
+                        break
+
+    def hold(self, entry):
+        data = entry["data"]
+        slot = self.slots.get(data["card_id"])
+        if slot is None:
+            slot = self.set_funds(data["card_id"], 0, 0)
+        self.on_hold[slot] += to_cents(data["billing_amount"])
+        self.pending.append(entry)
+        self.keys.add(get_key(data))
+
+    def append(self, data):
+        """Write authorisation to log, it is durable after 'sync', returns its entry"""
+        self.sequence += 1
+        entry = {"seq": self.sequence, "data": dict(
+            (name, "{}".format(data[name])) for name in FIELDS if data.get(name) is not None)}
+        self.log.write(json.dumps(entry).encode("utf-8") + b"\n")
+        self.log.flush()
+        return entry
+
+    def sync(self, sequence):
+        """
+        Wait until log is fsync'd up to entry 'sequence', one fsync
+        covers all entries written before it, rotated logs are fsync'd
+        """
+        with self.sync_lock:
+            if self.synced >= sequence:
+                return
+            with self.lock:
+                target = self.sequence
+                fileno = os.dup(self.log.fileno())
+            try:
+                os.fsync(fileno)
+            finally:
+                os.close(fileno)
+            self.synced = target
+
+    def authorize(self, data):
+        """
+        Decide authorisation and log it before returning.
+        Returns False for repeated authorisation, which is not logged again.
+        Raises InsufficientFunds or Account.DoesNotExist.
+        """
+        key = get_key(data)
+        amount = to_cents(data["billing_amount"])
+        for attempt in range(2):
+            entry = None
+            with self.lock:
+                if key in self.keys or idempotency.get_filter().seen(key):
+                    return False
+                slot = self.slots.get(data["card_id"])
+                if slot is not None and self.balance[slot] - self.on_hold[slot] >= amount:
+                    entry = self.append(data)
+                    self.hold(entry)
+                    if len(self.pending) >= self.flush_size:
+                        self.wakeup.set()
+            if entry is not None:
+                self.sync(entry["seq"])
+                return True
+            if attempt == 0:
+                self.refresh([data["card_id"]])
+        if data["card_id"] not in self.slots:
+            raise Account.DoesNotExist("No account {}".format(data["card_id"]))
+        raise InsufficientFunds("No sufficient funds on {}".format(data["card_id"]))
+
+    def refresh(self, card_ids):
+        """
+        Read funds of accounts changed by other writers,
+        authorisations not saved yet are added to them
+        """
+        with self.flush_lock:
+            self.reload(card_ids)
+
+    def reload(self, card_ids):
+        """Same as 'refresh', caller holds flush lock"""
+        with self.lock:
+            funds = read_funds(card_ids)
+            for entry in self.pending:
+                data = entry["data"]
+                if data["card_id"] in funds:
+                    funds[data["card_id"]][1] += to_cents(data["billing_amount"])
+            for card_id, (balance, on_hold) in funds.items():
+                self.set_funds(card_id, balance, on_hold)
+
+    def flush(self):
+        """
+        Save logged authorisations to database, returns their number.
+        Log is moved aside while they are saved and removed after commit.
+        """
+        with self.flush_lock:
+            with self.lock:
+                entries, self.pending = self.pending, []
+                if entries:
+                    self.rotate()
+            if not entries:
+                return 0
+            try:
+                self.save(entries)
+            except Exception:
+                with self.lock:
+                    self.pending = entries + self.pending
+                raise
+            os.remove(self.flushing_path)
+        return len(entries)
+
+    def rotate(self):
+        """Move current log to 'flushing' file and start new one"""
+        os.fsync(self.log.fileno())
+        self.log.close()
+        if os.path.exists(self.flushing_path):
+            with io.open(self.path, "rb") as log, io.open(self.flushing_path, "ab") as flushing:
+                flushing.write(log.read())
+                flushing.flush()
+                os.fsync(flushing.fileno())
+            os.remove(self.path)
+        else:
+            os.rename(self.path, self.flushing_path)
+        self.log = io.open(self.path, "ab")
+
+    def save(self, entries):
+        """
+        Insert authorisations and add their amounts to holds of accounts
+        together with sequence of the last entry. Authorisations which are
+        already saved or have no account are dropped and funds of their
+        accounts are read again.
+        """
+        cards = set(entry["data"]["card_id"] for entry in entries)
+        existing = set()
+        for ids in chunks(set(entry["data"]["transaction_id"] for entry in entries)):
+            existing.update(Transaction.objects.filter(transaction_id__in=ids, type=AUTHORISATION).\
+                values_list("transaction_id", "card_id"))
+        accounts = set()
+        for ids in chunks(cards):
+            accounts.update(Account.objects.filter(card_id__in=ids).values_list("card_id", flat=True))
+        rows = []
+        dropped = []
+        holds = {}
+        for entry in entries:
+            data = entry["data"]
+            if (data["transaction_id"], data["card_id"]) in existing or data["card_id"] not in accounts:
+                dropped.append(entry)
+                continue
+            existing.add((data["transaction_id"], data["card_id"]))
+            fields = dict((name, value) for name, value in data.items() if name != "card_id")
+            rows.append(Transaction(type=AUTHORISATION, card_id_id=data["card_id"],
+                settled_amount=Decimal(0), **fields))
+            holds[data["card_id"]] = holds.get(data["card_id"], 0) + Decimal(data["billing_amount"])
+        with transaction.atomic():
+            Transaction.objects.bulk_create(rows)
+            for card_id, amount in holds.items():
+                Account.objects.filter(card_id=card_id).update(on_hold=F("on_hold") + amount)
+                Account.objects.invalidate_balance(card_id)
+            if settings.ISSUER_ROLLUP_ON_SAVE:
+                VolumeRollup.objects.add(rows)
+            EngineCheckpoint.objects.filter(name=self.name).update(sequence=entries[-1]["seq"])
+        with self.lock:
+            for entry in dropped:
+                data = entry["data"]
+                self.on_hold[self.slots[data["card_id"]]] -= to_cents(data["billing_amount"])
+            repeats = idempotency.get_filter()
+            for entry in entries:
+                key = get_key(entry["data"])
+                self.keys.discard(key)
+                repeats.remember(key)
+        if dropped:
+            self.reload(set(entry["data"]["card_id"] for entry in dropped))
+            logger.warning("Dropped %s repeated authorisations", len(dropped))
+        logger.info("Saved %s authorisations", len(rows))
+
+    def close(self):
+        """Close log and let other process use it"""
+        if self.log is not None:
+            self.log.close()
+        if self.lock_file is not None:
+            self.lock_file.close()
+
+    def start(self, interval):
+        """
+        Start thread which flushes log every 'interval' seconds
+        or when 'flush_size' authorisations are pending
+        """
+        def run():
+            while True:
+                self.wakeup.wait(interval)
+                self.wakeup.clear()
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception("Flush of authorisation engine failed")
+                finally:
+                    close_old_connections()
+        thread = threading.Thread(target=run, name="engine-flusher")
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """
+    Get authorisation engine configured by ISSUER_AUTH_ENGINE setting,
+    None if engine is not enabled. WSGI application loads it at startup
+    (see fintech.wsgi), so the second process fails to start.
+    """
+    global _engine
+    config = settings.ISSUER_AUTH_ENGINE
+    if not config:
+        return None
+    with _engine_lock:
+        if _engine is None:
+            engine = AuthorisationEngine(config["LOG"], config.get("FLUSH_SIZE", 500)).load()
+            if config.get("FLUSH_INTERVAL") is not None:
+                engine.start(config["FLUSH_INTERVAL"])
+            _engine = engine
+    return _engine
+
+
+def reset(**kwargs):
+    global _engine
+    if kwargs.get("setting", "ISSUER_AUTH_ENGINE") == "ISSUER_AUTH_ENGINE":
+        if _engine is not None:
+            _engine.close()
+        _engine = None
+
+
+setting_changed.connect(reset)
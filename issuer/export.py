@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import shutil
+from datetime import datetime, time, timedelta
+from multiprocessing import Pool
+from django.db import connections
+from django.db.models import Q
+from django.utils import six, timezone
+from django.utils.six.moves.urllib.parse import quote
+from issuer import routers
+from issuer.models import Transaction, Transfer
+
+logger = logging.getLogger('fintech.issuer.export')
+
+TABLES = {
+    "transactions": (Transaction, ("id", "transaction_id", "type", "card_id", "billing_amount",
+        "billing_currency", "transaction_amount", "transaction_currency", "settlement_amount",
+        "settlement_currency", "date", "authorisation", "settled_amount", "stripe", "expired", "sequence")),
+    "transfers": (Transfer, ("id", "credit", "debit", "date", "fulfilled", "currency", "settlement")),
+}
+
+
+def makedirs(path):
+    """Create directory unless it exists, also made by other workers"""
+    try:
+        os.makedirs(path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+
+
+def to_text(value):
+    if value is None:
+        return ""
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return "{}".format(value)
+
+
+class CsvWriter(object):
+    """Gzipped CSV file with header"""
+    extension = ".csv.gz"
+
+    def __init__(self, path, fields):
+        self.path = path + self.extension
+        self.stream = gzip.open(self.path + ".partial", "wb")
+        if six.PY2:
+            self.writer = csv.writer(self.stream)
+        else:
+            self.stream = io.TextIOWrapper(self.stream, encoding="utf-8", newline="")
+            self.writer = csv.writer(self.stream)
+        self.write(fields)
+
+    def write(self, row):
+        values = [to_text(value) for value in row]
+        if six.PY2:
+            values = [value.encode("utf-8") for value in values]
+        self.writer.writerow(values)
+
+    def close(self):
+        self.stream.close()
+        os.rename(self.path + ".partial", self.path)
+
+
+class JsonlWriter(object):
+    """Gzipped file of JSON objects, one per line"""
+    extension = ".jsonl.gz"
+
+    def __init__(self, path, fields):
+        self.path = path + self.extension
+        self.fields = fields
+        self.stream = gzip.open(self.path + ".partial", "wb")
+
+    def write(self, row):
+        self.stream.write(json.dumps(dict(zip(self.fields, row)), default=to_text).encode("utf-8") + b"\n")
+
+    def close(self):
+        self.stream.close()
+        os.rename(self.path + ".partial", self.path)
+
+
+class ColumnsWriter(object):
+    """
+    Directory with gzipped file of JSON values per column,
+    so one column is read without the others
+    """
+    extension = ""
+
+    def __init__(self, path, fields):
+        self.path = path
+        if os.path.exists(self.path + ".partial"):
+            shutil.rmtree(self.path + ".partial")
+        makedirs(self.path + ".partial")
+        self.streams = [gzip.open(os.path.join(self.path + ".partial", field + ".jsonl.gz"), "wb")
+            for field in fields]
+
+    def write(self, row):
+        for stream, value in zip(self.streams, row):
+            stream.write(json.dumps(value, default=to_text).encode("utf-8") + b"\n")
+
+    def close(self):
+        for stream in self.streams:
+            stream.close()
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.rename(self.path + ".partial", self.path)
+
+
+WRITERS = {"csv": CsvWriter, "jsonl": JsonlWriter, "columns": ColumnsWriter}
+
+
+def after(fields, values):
+    """Keyset condition of rows after 'values' in order of 'fields'"""
+    condition = Q()
+    for i, field in enumerate(fields):
+        condition |= Q(**dict(zip(fields[:i], values[:i]), **{field + "__gt": values[i]}))
+    return condition
+
+
+def get_days(start, end):
+    """
+    Split timeframe into (start, end, last) of UTC days,
+    ends of all but last day are exclusive, naive bounds
+    are in current time zone
+    """
+    if timezone.is_naive(start):
+        start = timezone.make_aware(start)
+    if timezone.is_naive(end):
+        end = timezone.make_aware(end)
+    day = datetime.combine(start.astimezone(timezone.utc).date(), time.min).replace(tzinfo=timezone.utc)
+    days = []
+    while day <= end:
+        following = day + timedelta(days=1)
+        days.append((max(day, start), min(following, end), following > end))
+        day = following
+    return days
+
+
+def export_day(task):
+    """
+    Write rows of 'table' saved during day into '<output>/<table>/date=<day>'
+    in chunks ordered by date or by card and date with 'card' partition.
+    Unfinished files keep '.partial' suffix. Returns number of written rows.
+    """
+    table, file_format, partition, output, (start, end, last), chunk_size = task
+    model, fields = TABLES[table]
+    rows = model.objects.get_in_timeframe(start, end if last else None)
+    if not last:
+        rows = rows.filter(date__lt=end)
+    ordering = ("card_id", "date", "id") if partition == "card" else ("date", "id")
+    rows = rows.order_by(*ordering)
+    positions = [fields.index(field) for field in ordering]
+    folder = os.path.join(output, table)
+    name = os.path.join(folder, "date={}".format(start.astimezone(timezone.utc).date().isoformat()))
+    writer = None
+    card_id = None
+    number = 0
+    last_key = None
+    with routers.use_replica():
+        while True:
+            chunk = rows.filter(after(ordering, last_key)) if last_key is not None else rows
+            chunk = list(chunk.values_list(*fields)[:chunk_size])
+            for row in chunk:
+                if partition == "card" and row[fields.index("card_id")] != card_id:
+                    if writer is not None:
+                        writer.close()
+                    card_id = row[fields.index("card_id")]
+                    makedirs(name)
+                    writer = WRITERS[file_format](
+                        os.path.join(name, "card_id={}".format(quote(card_id.encode("utf-8"), safe=""))),
+                        fields)
+                elif writer is None:
+                    makedirs(folder)
+                    writer = WRITERS[file_format](name, fields)
+                writer.write(row)
+            number += len(chunk)
+            if len(chunk) < chunk_size:
+                break
+            last_key = [chunk[-1][position] for position in positions]
+    if writer is not None:
+        writer.close()
+    logger.info("Exported %s %s of %s", number, table, name)
+    return number
+
+
+def export(table, file_format, start, end, output, partition="day", processes=1, chunk_size=10000):
+    """
+    Export rows of 'table' saved from 'start' till 'end' by day,
+    days are written in parallel by pool of 'processes'.
+    Returns number of written rows.
+    """
+    if partition == "card" and table != "transactions":
+        raise ValueError("Only transactions are partitioned by card")
+    tasks = [(table, file_format, partition, output, day, chunk_size) for day in get_days(start, end)]
+    if processes == 1:
+        return sum(export_day(task) for task in tasks)
+    # Forked workers open own connections
+    connections.close_all()
+    pool = Pool(processes)
+    try:
+        return sum(pool.imap_unordered(export_day, tasks))
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import csv
+import io
+import json
+import logging
+from collections import OrderedDict
+from decimal import Decimal, InvalidOperation
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Value, When
+from django.utils import six
+from issuer.batch import CASE_CHUNK_SIZE, CHUNK_SIZE, chunks
+from issuer.models import Account
+
+logger = logging.getLogger('fintech.issuer.funding')
+
+FIELDS = ("card_id", "amount", "currency")
+
+
+def read_csv(stream, fields=FIELDS):
+    """
+    Records of CSV stream with 'fields' columns, by default
+    'card_id,amount,currency', as (line number, record), header line is skipped
+    """
+    lines = stream
+    if six.PY2:
+        lines = (line.encode("utf-8") for line in stream)
+    reader = csv.reader(lines)
+    for row in reader:
+        if six.PY2:
+            row = [value.decode("utf-8") for value in row]
+        if not row or (reader.line_num == 1 and row[0].strip() == fields[0]):
+            continue
+        yield reader.line_num, dict(zip(fields, row)) if len(row) == len(fields) else row
+
+
+def read_jsonl(stream, fields=None):
+    """
+    Records of JSON lines stream as (line number, record),
+    'fields' are named in records themselves
+    """
+    for number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            yield number, line
+
+
+READERS = {"csv": read_csv, "jsonl": read_jsonl}
+
+
+def clean(record):
+    """
+    Validated (card_id, amount, currency) of record,
+    raises ValueError with reason of rejection
+    """
+    if not isinstance(record, dict) or any(field not in record for field in FIELDS):
+        raise ValueError("Expected fields: {}".format(", ".join(FIELDS)))
+    card_id = "{}".format(record["card_id"]).strip()
+    currency = "{}".format(record["currency"]).strip()
+    if not card_id or len(card_id) > 100:
+        raise ValueError("Invalid card id")
+    if len(currency) != 3:
+        raise ValueError("Invalid currency")
+    try:
+        amount = Decimal("{}".format(record["amount"]).strip())
+    except InvalidOperation:
+        raise ValueError("Invalid amount")
+    if not amount.is_finite() or amount <= 0 or amount != amount.quantize(Decimal("0.01")):
+        raise ValueError("Invalid amount")
+    return card_id, amount, currency
+
+
+class Funding(object):
+    """
+    Adds amounts of records to accounts in chunks: one prefetch
+    of accounts, one bulk insert of new accounts and one update
+    of existing accounts per chunk, every chunk in own transaction.
+    Rejected records are passed to 'report' callable as they happen.
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE, report=None):
+        self.chunk_size = chunk_size
+        self.report = report
+        self.rows = 0
+        self.created = 0
+        self.funded = set()
+        self.totals = OrderedDict()
+        self.rejected = 0
+
+    def load(self, records):
+        """
+        Fund accounts from (line number, record) pairs
+        """
+        chunk = []
+        for number, record in records:
+            self.rows += 1
+            try:
+                chunk.append((number, record, clean(record)))
+            except ValueError as error:
+                self.reject(number, record, error)
+            if len(chunk) >= self.chunk_size:
+                self.apply(chunk)
+                chunk = []
+        if chunk:
+            self.apply(chunk)
+        return self
+
+    def reject(self, number, record, error):
+        self.rejected += 1
+        if self.report is not None:
+            self.report({"line": number, "record": record, "error": "{}".format(error)})
+
+    def apply(self, chunk):
+        with transaction.atomic():
+            accounts = {}
+            for ids in chunks(set(card_id for _, _, (card_id, _, _) in chunk)):
+                accounts.update(Account.objects.select_for_update().in_bulk(ids))
+            currencies = dict((card_id, account.currency) for card_id, account in accounts.items())
+            amounts = OrderedDict()
+            for number, record, (card_id, amount, currency) in chunk:
+                expected = currencies.setdefault(card_id, currency)
+                if currency != expected:
+                    self.reject(number, record, "Account currency is {}, not {}".format(expected, currency))
+                    continue
+                amounts[card_id] = amounts.get(card_id, 0) + amount
+                self.totals[currency] = self.totals.get(currency, 0) + amount
+
+            new = [Account(card_id=card_id, currency=currencies[card_id], balance=amount)
+                for card_id, amount in amounts.items() if card_id not in accounts]
+            Account.objects.bulk_create(new)
+            existing = [card_id for card_id in amounts if card_id in accounts]
+            for ids in chunks(existing, CASE_CHUNK_SIZE):
+                Account.objects.filter(card_id__in=ids).update(
+                    balance=F("balance") + Case(
+                        *[When(card_id=card_id, then=Value(amounts[card_id])) for card_id in ids],
+                        output_field=DecimalField()
+                    )
+                )
+            for card_id in amounts:
+                Account.objects.invalidate_balance(card_id)
+        self.created += len(new)
+        self.funded.update(amounts)
+        logger.info("Funded %s accounts, created %s", len(amounts), len(new))
+
+
+class RejectFile(object):
+    """Writes rejected records into 'path' as JSON lines, file is created by the first one"""
+
+    def __init__(self, path):
+        self.path = path
+        self.stream = None
+
+    def __call__(self, reject):
+        if self.stream is None:
+            self.stream = io.open(self.path, "w", encoding="utf-8")
+        self.stream.write("{}\n".format(json.dumps(reject)))
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.utils import six
+from issuer.cache import LocMemBackend
+from issuer.models import Transaction, AUTHORISATION
+
+
+def get_key(data):
+    """
+    Unique (transaction_id, type, card_id, sequence) of transaction data,
+    None if some of them is missing or invalid
+    """
+    key = (data.get("transaction_id"), data.get("type") or AUTHORISATION, data.get("card_id"))
+    sequence = "{}".format(data.get("sequence") or 0)
+    if all(isinstance(value, six.string_types) and value for value in key) and sequence.isdigit():
+        return key + (int(sequence),)
+    return None
+
+
+class IdempotencyFilter(object):
+    """
+    Recognises repeated transactions. Keys of saved transactions
+    are kept in memory for 'retention' seconds, at most 'max_entries'
+    of them, others are looked up by unique index of transactions.
+    """
+
+    def __init__(self, max_entries, retention):
+        self.saved = LocMemBackend(timeout=retention, max_entries=max_entries)
+        self.hits = 0
+        self.index_hits = 0
+        self.misses = 0
+
+    def seen(self, key):
+        """
+        Check if transaction is known to be saved without queries
+        """
+        if self.saved.get(key):
+            self.hits += 1
+            return True
+        return False
+
+    def exists(self, key):
+        """
+        Check if transaction is saved by unique index lookup
+        """
+        transaction_id, tr_type, card_id, sequence = key
+        if Transaction.objects.filter(transaction_id=transaction_id, type=tr_type,
+                card_id=card_id, sequence=sequence).exists():
+            self.index_hits += 1
+            self.remember(key)
+            return True
+        self.misses += 1
+        return False
+
+    def remember(self, key):
+        """
+        Keep key of saved transaction once it is committed
+        """
+        transaction.on_commit(lambda: self.saved.set(key, True))
+
+    def stats(self):
+        return {"hits": self.hits, "index_hits": self.index_hits, "misses": self.misses}
+
+
+_filter = None
+
+
+def get_filter():
+    """Get idempotency filter configured by ISSUER_IDEMPOTENCY setting"""
+    global _filter
+    if _filter is None:
+        config = settings.ISSUER_IDEMPOTENCY
+        _filter = IdempotencyFilter(
+            max_entries=config.get("MAX_ENTRIES", 100000),
+            retention=config.get("RETENTION", 3600)
+        )
+    return _filter
+
+
+def reset(**kwargs):
+    global _filter
+    if kwargs.get("setting", "ISSUER_IDEMPOTENCY") == "ISSUER_IDEMPOTENCY":
+        _filter = None
+
+
+setting_changed.connect(reset)
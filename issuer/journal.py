@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from django.conf import settings
+from django.core.signals import setting_changed
+
+PENDING = "pending"
+PROCESSING = "processing"
+DONE = "done"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    card_id TEXT NOT NULL,
+    partition INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    created REAL NOT NULL,
+    handled REAL
+);
+CREATE INDEX IF NOT EXISTS entries_partition_status ON entries (partition, status, id);
+"""
+
+
+def get_partition(card_id, partitions):
+    """Partition of card, all transactions of card go to one partition"""
+    return zlib.crc32(card_id.encode("utf-8")) % partitions
+
+
+class IngestJournal(object):
+    """
+    Durable queue of received transactions in SQLite file.
+    Entries are split by card into 'partitions', every partition
+    is drained by one worker in order of entries.
+    """
+
+    def __init__(self, path, partitions):
+        self.path = path
+        self.partitions = partitions
+        self.local = threading.local()
+        self.connection.executescript(SCHEMA)
+
+    @property
+    def connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=FULL")
+            self.local.connection = connection
+        return connection
+
+    def append(self, items):
+        """
+        Save transactions in one write, returns their ids
+        """
+        ids = []
+        now = time.time()
+        with self.transaction() as cursor:
+            for item in items:
+                cursor.execute(
+                    "INSERT INTO entries (card_id, partition, payload, status, created) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (item["card_id"], get_partition(item["card_id"], self.partitions),
+                     json.dumps(item), PENDING, now)
+                )
+                ids.append(cursor.lastrowid)
+        return ids
+
+    def claim(self, partitions, limit):
+        """
+        Get the oldest not handled entries of partitions as
+        list of (id, transaction, recovered) and mark them as processing.
+        Entries left in processing by a stopped worker are 'recovered'.
+        """
+        marks = ",".join("?" * len(partitions))
+        with self.transaction() as cursor:
+            rows = cursor.execute(
+                "SELECT id, payload, status FROM entries "
+                "WHERE partition IN ({}) AND status IN (?, ?) "
+                "ORDER BY id LIMIT ?".format(marks),
+                list(partitions) + [PENDING, PROCESSING, limit]
+            ).fetchall()
+            cursor.executemany(
+                "UPDATE entries SET status = ? WHERE id = ?",
+                [(PROCESSING, row[0]) for row in rows]
+            )
+        return [(pk, json.loads(payload), status == PROCESSING) for pk, payload, status in rows]
+
+    def complete(self, results):
+        """
+        Save results of handled entries, 'results' is list of (id, result)
+        """
+        now = time.time()
+        with self.transaction() as cursor:
+            cursor.executemany(
+                "UPDATE entries SET status = ?, result = ?, handled = ? WHERE id = ?",
+                [(DONE, json.dumps(result), now, pk) for pk, result in results]
+            )
+
+    def get(self, pk):
+        """
+        Get status and result of entry, None if there is no such entry
+        """
+        row = self.connection.execute(
+            "SELECT status, result FROM entries WHERE id = ?", (pk,)).fetchone()
+        if row is None:
+            return None
+        return {"id": pk, "status": row[0], "result": json.loads(row[1]) if row[1] else None}
+
+    def transaction(self):
+        return Transaction(self.connection)
+
+
+class Transaction(object):
+    """Context manager of write transaction on journal"""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection.cursor()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.connection.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+_journal = None
+
+
+def get_journal():
+    """Get ingest journal configured by ISSUER_INGEST_JOURNAL setting"""
+    global _journal
+    if _journal is None:
+        _journal = IngestJournal(
+            settings.ISSUER_INGEST_JOURNAL,
+            settings.ISSUER_INGEST_PARTITIONS
+        )
+    return _journal
+
+
+def reset(**kwargs):
+    global _journal
+    if kwargs.get("setting", "ISSUER_INGEST_JOURNAL") in ("ISSUER_INGEST_JOURNAL", "ISSUER_INGEST_PARTITIONS"):
+        _journal = None
+
+
+setting_changed.connect(reset)
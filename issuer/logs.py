@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import datetime
+import json
+import logging
+import os
+import random
+import threading
+from django.utils.module_loading import import_string
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# Attributes of every LogRecord, the rest are 'extra' fields
+RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | set(["message", "asctime"])
+
+
+class Lazy(object):
+    """
+    Argument of log message computed only if message is emitted:
+    logger.info("Saved %s", Lazy(lambda: serializer.data))
+    """
+
+    def __init__(self, func):
+        self.func = func
+
+    def __str__(self):
+        return str(self.func())
+
+    def __unicode__(self):
+        return "{}".format(self.func())
+
+
+class BackgroundHandler(logging.Handler):
+    """
+    Passes records to 'target' handler through bounded queue
+    and separate thread, so logging thread never waits for disk.
+    Records are formatted, Lazy arguments included, by that thread.
+    Records which do not fit in the queue are dropped and counted.
+    """
+
+    def __init__(self, target, options=None, queue_size=10000):
+        logging.Handler.__init__(self)
+        self.target = import_string(target)(**dict(options or {}))
+        self.queue = queue.Queue(queue_size)
+        self.dropped = 0
+        self.start()
+
+    def start(self):
+        """
+        Start writer thread, also in child process after fork
+        """
+        self.pid = os.getpid()
+        self.thread = threading.Thread(target=self.run, name="log-writer")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def setFormatter(self, fmt):
+        logging.Handler.setFormatter(self, fmt)
+        self.target.setFormatter(fmt)
+
+    def emit(self, record):
+        if self.pid != os.getpid():
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            self.target.handle(record)
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.target.close()
+        logging.Handler.close(self)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Passes only part ('rate') of records with level below 'max_level',
+    more important records always pass
+    """
+
+    def __init__(self, rate=1.0, max_level="INFO"):
+        logging.Filter.__init__(self)
+        self.rate = float(rate)
+        self.max_level = logging.getLevelName(max_level)
+
+    def filter(self, record):
+        if record.levelno > self.max_level:
+            return True
+        return random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats record as one line json object with 'extra' fields"""
+
+    def format(self, record):
+        data = {
+            "time": datetime.datetime.utcfromtimestamp(record.created).isoformat() + "Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "process": record.process,
+            "thread": record.thread,
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRS:
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc_info"] = record.exc_text
+        return json.dumps(data, default=str)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import DateTimeField, F, Q
+from django.utils import timezone
+from issuer.models import Account, ArchiveRun, BalanceCheckpoint, Transaction, Transfer, \
+    AUTHORISATION, PRESENTMENT
+
+class Command(BaseCommand):
+    help = "Move transactions and fulfilled transfers older than cutoff into archive"
+
+    def add_arguments(self, parser):
+        """
+        Argument parser method
+        """
+        parser.add_argument("--before", type=str,
+            help="Cutoff date, transactions before it are archived")
+        parser.add_argument("--older-than-days", type=int, default=365,
+            help="Cutoff as number of days before now, if --before is not given")
+        parser.add_argument("--chunk-size", type=int, default=1000,
+            help="Number of rows moved in one transaction")
+
+    def handle(self, *args, **options):
+        """
+        Register archive run with cutoff, wait until every process sees it,
+        then move presentments, settled or expired authorisations without live
+        presentments and fulfilled transfers in chunks.
+        Accounts with archived transactions get balance checkpoint.
+        """
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size should be positive")
+        if options["before"]:
+            cutoff = DateTimeField().to_python(options["before"])
+        else:
+            cutoff = timezone.now() - timedelta(days=options["older_than_days"])
+        try:
+            run = ArchiveRun.objects.start(cutoff)
+        except ValueError as error:
+            raise CommandError(error)
+        time.sleep(settings.ISSUER_ARCHIVE_CUTOFF_TTL)
+
+        old = Transaction.objects.filter(date__lt=cutoff)
+        accounts = set(old.values_list("card_id", flat=True).distinct())
+        presentments = old.filter(type=PRESENTMENT)
+        authorisations = old.filter(
+            Q(settled_amount__gte=F("billing_amount")) | Q(expired__isnull=False),
+            type=AUTHORISATION,
+            presentments__isnull=True
+        )
+        transfers = Transfer.objects.filter(date__lt=cutoff, fulfilled=True)
+        for queryset, archive in [
+            (presentments, run.archive_transactions),
+            (authorisations, run.archive_transactions),
+            (transfers, run.archive_transfers),
+        ]:
+            last = 0
+            while True:
+                ids = list(queryset.filter(id__gt=last).order_by("id").\
+                    values_list("id", flat=True)[:options["chunk_size"]])
+                if not ids:
+                    break
+                archive(ids)
+                last = ids[-1]
+        for card_id in accounts:
+            BalanceCheckpoint.objects.take(Account(card_id=card_id))
+        run.refresh_from_db()
+        run.finished = timezone.now()
+        run.save(update_fields=["finished"])
+        self.stdout.write(self.style.SUCCESS("Archived {} transactions and {} transfers before {}".\
+            format(run.transactions, run.transfers, cutoff)))
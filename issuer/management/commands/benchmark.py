@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import io
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils.six import StringIO
+from issuer.bench import Benchmark, ClientTransport, HttpTransport, TrafficGenerator, record, replay
+
+class Command(BaseCommand):
+    help = "Run synthetic or recorded traffic against issuer API and report latency"
+
+    def add_arguments(self, parser):
+        """
+        Argument parser method
+        """
+        parser.add_argument("--requests", type=int, default=1000,
+            help="Number of generated requests")
+        parser.add_argument("--accounts", type=int, default=10,
+            help="Number of funded accounts")
+        parser.add_argument("--presentment-ratio", type=float, default=0.8,
+            help="Number of presentments per authorisation")
+        parser.add_argument("--duplicate-ratio", type=float, default=0.05,
+            help="Part of requests which are retries of sent transactions")
+        parser.add_argument("--read-ratio", type=float, default=0.2,
+            help="Part of requests which are history and balance reads")
+        parser.add_argument("--seed", type=int, default=None,
+            help="Seed of traffic generator")
+        parser.add_argument("--record", help="Write generated requests into JSONL file and exit")
+        parser.add_argument("--replay", help="Send requests from JSONL file")
+        parser.add_argument("--url", help="Send requests to running server instead of test client")
+        parser.add_argument("--use-current-db", action="store_true",
+            help="Run test client against configured database instead of temporary one")
+
+    def handle(self, *args, **options):
+        """
+        Generate or replay requests, send them and print statistics per endpoint.
+        Accounts are funded with 'load_money', so server given by --url
+        should use the same database.
+        """
+        generator = TrafficGenerator(
+            accounts=options["accounts"],
+            presentment_ratio=options["presentment_ratio"],
+            duplicate_ratio=options["duplicate_ratio"],
+            read_ratio=options["read_ratio"],
+            seed=options["seed"]
+        )
+        if options["record"]:
+            with io.open(options["record"], "w", encoding="utf-8") as stream:
+                count = record(generator.requests(options["requests"]), stream)
+            self.stdout.write(self.style.SUCCESS("Recorded {} requests".format(count)))
+            return
+        if options["url"]:
+            transport = HttpTransport(options["url"])
+        else:
+            hosts = override_settings(ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ["testserver"])
+            hosts.enable()
+            transport = ClientTransport()
+        test_db = None
+        if not (options["url"] or options["use_current_db"]):
+            test_db = connection.settings_dict["NAME"]
+            connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            benchmark = Benchmark(transport, self.fund)
+            if options["replay"]:
+                with io.open(options["replay"], encoding="utf-8") as stream:
+                    rows = benchmark.run(replay(stream))
+            else:
+                rows = benchmark.run(generator.requests(options["requests"]))
+        finally:
+            if test_db:
+                connection.creation.destroy_test_db(test_db, verbosity=0)
+            if not options["url"]:
+                hosts.disable()
+        self.print_report(rows, benchmark.elapsed)
+
+    def fund(self, request):
+        call_command("load_money", request["card_id"], request["amount"],
+            request["currency"], stdout=StringIO())
+
+    def print_report(self, rows, elapsed):
+        self.stdout.write("{:<20} {:>8} {:>10} {:>9} {:>9} {:>9} {:>8}  {}".format(
+            "endpoint", "requests", "req/s", "p50 ms", "p95 ms", "p99 ms", "queries", "statuses"))
+        total = 0
+        for row in rows:
+            total += row["requests"]
+            self.stdout.write("{:<20} {:>8} {:>10.1f} {:>9.2f} {:>9.2f} {:>9.2f} {:>8}  {}".format(
+                row["endpoint"], row["requests"], row["throughput"],
+                row["p50"], row["p95"], row["p99"],
+                "-" if row["queries"] is None else "{:.1f}".format(row["queries"]),
+                " ".join("{}:{}".format(k, v) for k, v in sorted(row["statuses"].items()))
+            ))
+        self.stdout.write("Total {} requests in {:.2f} s, {:.1f} req/s".format(
+            total, elapsed, total / elapsed if elapsed else 0))
@@ -1,18 +1,34 @@
 # -*- coding: utf-8 -*-
 from django.core.management.base import BaseCommand, CommandError
 from decimal import Decimal
-from issuer.models import Transfer
+from issuer.models import SettlementBatch
 
 class Command(BaseCommand):
     help = "Calculate dept to Scheme and Revenue"
 
+    def add_arguments(self, parser):
+        """
+        Argument parser method
+        """
+        parser.add_argument("--chunk-size", type=int, default=10000,
+            help="Number of transfer ids settled in one database transaction")
+
     def handle(self, *args, **options):
-        total_credit, total_debit = 0, 0
-        transfer = Transfer.objects.get_unhandled()
-        total_credit = sum([x.credit for x in transfer])
-        total_debit = sum([x.debit for x in transfer])
-        transfer.update(fulfilled=True)
-        self.stdout.write(" dept = {}\n revenue = {}\n".format(
-            total_credit,
-            total_debit - total_credit
-        ))
\ No newline at end of file
+        """
+        Settle unhandled transfers in chunks, resuming
+        not finished settlement if there is one.
+        """
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size should be positive")
+        batch = SettlementBatch.objects.get_or_start()
+        if batch is None:
+            self.stdout.write(" dept = 0\n revenue = 0\n")
+            return
+        while batch.finished is None:
+            batch.settle_chunk(options["chunk_size"])
+        for total in batch.totals.order_by("currency"):
+            self.stdout.write("{}\n dept = {}\n revenue = {}\n".format(
+                total.currency,
+                total.credit,
+                total.revenue()
+            ))
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from issuer import checkpoints
+from issuer.models import Account
+
+class Command(BaseCommand):
+    help = "Take balance checkpoints of accounts with new transactions"
+
+    def add_arguments(self, parser):
+        """
+        Argument parser method
+        """
+        parser.add_argument("--min-transactions", type=int,
+            help="Minimal number of transactions since the last checkpoint, "
+                "ISSUER_CHECKPOINT_INTERVAL with --new, 1 otherwise")
+        parser.add_argument("--new", action="store_true",
+            help="Check only accounts with transactions since the previous run with --new")
+
+    def handle(self, *args, **options):
+        """
+        Take checkpoint of every account which has at least 'min-transactions'
+        transactions after its latest checkpoint, then delete checkpoints
+        older than ISSUER_CHECKPOINT_RETENTION days of accounts with newer ones.
+        """
+        interval = options["min_transactions"]
+        if interval is None:
+            interval = settings.ISSUER_CHECKPOINT_INTERVAL if options["new"] else 1
+        if interval < 1:
+            raise CommandError("--min-transactions should be positive")
+        if options["new"]:
+            taken = checkpoints.take_new(interval)
+        else:
+            taken = checkpoints.take_due(Account.objects.values_list("card_id", flat=True).iterator(), interval)
+        self.stdout.write(self.style.SUCCESS("Taken {} checkpoints".format(taken)))
+        if settings.ISSUER_CHECKPOINT_RETENTION is not None:
+            pruned = checkpoints.prune(timezone.now() - timedelta(days=settings.ISSUER_CHECKPOINT_RETENTION))
+            self.stdout.write(self.style.SUCCESS("Deleted {} old checkpoints".format(pruned)))
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import DateTimeField, F, Q
+from django.utils import timezone
+from issuer.batch import CASE_CHUNK_SIZE, chunks
+from issuer.models import Transaction, AUTHORISATION
+
+class Command(BaseCommand):
+    help = "Release holds of authorisations older than ISSUER_HOLD_LIFETIME"
+
+    def add_arguments(self, parser):
+        """
+        Argument parser method
+        """
+        parser.add_argument("--before", type=str,
+            help="Expire authorisations made before this time instead of hold lifetime")
+        parser.add_argument("--chunk-size", type=int, default=1000,
+            help="Number of authorisations expired in one transaction")
+
+    def handle(self, *args, **options):
+        """
+        Walk (type, date) index over unsettled authorisations before
+        cutoff in chunks, every part of chunk small enough for one grouped
+        update is expired in own transaction
+        """
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size should be positive")
+        if options["before"]:
+            cutoff = DateTimeField().to_python(options["before"])
+        else:
+            cutoff = timezone.now() - timedelta(seconds=settings.ISSUER_HOLD_LIFETIME)
+        stale = Transaction.objects.filter(
+            type=AUTHORISATION,
+            date__lt=cutoff,
+            expired__isnull=True,
+            settled_amount__lt=F("billing_amount")
+        ).order_by("date", "id")
+        expired = 0
+        released = {}
+        last = None
+        while True:
+            chunk = stale
+            if last is not None:
+                chunk = chunk.filter(Q(date__gt=last[0]) | Q(date=last[0], id__gt=last[1]))
+            rows = list(chunk.values_list("date", "id")[:options["chunk_size"]])
+            if not rows:
+                break
+            for ids in chunks([pk for _, pk in rows], CASE_CHUNK_SIZE):
+                for card_id, amount in Transaction.objects.expire_holds(ids).items():
+                    released[card_id] = released.get(card_id, 0) + amount
+            expired += len(rows)
+            last = rows[-1]
+        self.stdout.write(self.style.SUCCESS("Expired {} authorisations, released holds on {} accounts".\
+            format(expired, len(released))))
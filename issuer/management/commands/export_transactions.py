@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import DateTimeField
+from django.utils import timezone
+from issuer.export import TABLES, WRITERS, export
+
+class Command(BaseCommand):
+    help = "Export transactions or transfers of timeframe into compressed files by day"
+
+    def add_arguments(self, parser):
+        """
+        Argument parser method
+        """
+        parser.add_argument("output", type=str, help="Directory of exported files")
+        parser.add_argument("--start", type=str, required=True, help="Export rows saved from this time")
+        parser.add_argument("--end", type=str, help="Export rows saved till this time, now by default")
+        parser.add_argument("--table", choices=sorted(TABLES), default="transactions",
+            help="Rows to export")
+        parser.add_argument("--format", choices=sorted(WRITERS), default="csv",
+            help="Format of files, 'columns' writes file per column")
+        parser.add_argument("--partition", choices=["day", "card"], default="day",
+            help="File per day or per card in directory of day")
+        parser.add_argument("--processes", type=int, default=1,
+            help="Number of days exported in parallel")
+        parser.add_argument("--chunk-size", type=int, default=10000,
+            help="Number of rows read in one query")
+
+    def handle(self, *args, **options):
+        """
+        Export every day of timeframe into '<output>/<table>/date=<day>',
+        files are written with '.partial' suffix until day is complete
+        """
+        if options["chunk_size"] < 1 or options["processes"] < 1:
+            raise CommandError("--chunk-size and --processes should be positive")
+        start = self.parse_time(options["start"])
+        end = self.parse_time(options["end"]) if options["end"] else timezone.now()
+        if start > end:
+            raise CommandError("--start should be before --end")
+        try:
+            number = export(options["table"], options["format"], start, end, options["output"],
+                options["partition"], options["processes"], options["chunk_size"])
+        except ValueError as error:
+            raise CommandError(error)
+        self.stdout.write(self.style.SUCCESS("Exported {} {} to {}".format(
+            number, options["table"], options["output"])))
+
+    def parse_time(self, value):
+        """Date or time of option, naive one is in current time zone"""
+        value = DateTimeField().to_python(value)
+        if timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        return value
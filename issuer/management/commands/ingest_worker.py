@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from issuer import journal
+from issuer.batch import ingest_journal
+
+class Command(BaseCommand):
+    help = "Apply transactions from ingest journal"
+
+    def add_arguments(self, parser):
+        """
+        Argument parser method
+        """
+        parser.add_argument("--workers", type=int, default=1,
+            help="Number of worker processes")
+        parser.add_argument("--batch-size", type=int, default=500,
+            help="Maximal number of transactions applied at once")
+        parser.add_argument("--poll", type=float, default=0.5,
+            help="Seconds to wait when journal is empty")
+        parser.add_argument("--once", action="store_true",
+            help="Exit when journal is empty")
+
+    def handle(self, *args, **options):
+        """
+        Start workers, each of them drains its own partitions of journal,
+        so transactions of one card are applied in order of receiving.
+        """
+        if settings.ISSUER_AUTH_ENGINE:
+            raise CommandError("Authorisations of ingest journal would bypass authorisation engine, "
+                "disable ISSUER_AUTH_ENGINE")
+        workers = options["workers"]
+        if workers < 1 or workers > settings.ISSUER_INGEST_PARTITIONS:
+            raise CommandError("--workers should be from 1 to {}".\
+                format(settings.ISSUER_INGEST_PARTITIONS))
+        partitions = range(settings.ISSUER_INGEST_PARTITIONS)
+        if workers == 1:
+            self.run(list(partitions), options)
+            return
+        connections.close_all()
+        processes = [
+            multiprocessing.Process(
+                target=self.run,
+                args=([p for p in partitions if p % workers == i], options)
+            ) for i in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+    def run(self, partitions, options):
+        journal.reset()
+        handled = 0
+        while True:
+            count = ingest_journal(journal.get_journal(), partitions, options["batch_size"])
+            handled += count
+            if count:
+                continue
+            if options["once"]:
+                break
+            time.sleep(options["poll"])
+        self.stdout.write(self.style.SUCCESS(
+            "Handled {} transactions of partitions {}".format(handled, partitions)))
@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
+import io
 from django.core.management.base import BaseCommand, CommandError
 from django.db.models import F
+from issuer.batch import CHUNK_SIZE
+from issuer.funding import Funding, READERS, RejectFile
 from issuer.models import Account
 
 class Command(BaseCommand):
@@ -10,22 +13,33 @@ class Command(BaseCommand):
         """
         Argument parser method
         """
-        parser.add_argument("cardholder", type=str, help="Card id")
-        parser.add_argument("amount", type=str, help="Amount to add on account")
-        parser.add_argument("currency", type=str, help="Currecny of amount")
+        parser.add_argument("cardholder", type=str, nargs="?", help="Card id")
+        parser.add_argument("amount", type=str, nargs="?", help="Amount to add on account")
+        parser.add_argument("currency", type=str, nargs="?", help="Currecny of amount")
+        parser.add_argument("--file", action="append", default=[],
+            help="CSV or JSONL file of card_id, amount, currency records, can be repeated")
+        parser.add_argument("--format", choices=sorted(READERS),
+            help="Format of files, by default guessed from extension")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+            help="Number of records funded in one transaction")
 
     def handle(self, *args, **options):
         """
         Add amount to balance value of account of it exists, or create it.
         Throw exception if case of different currency.
         """
+        if options["file"]:
+            return self.load_files(options)
+        if not (options["cardholder"] and options["amount"] and options["currency"]):
+            raise CommandError("Specify cardholder, amount and currency or --file")
         try:
             account = Account.objects.get(card_id=options["cardholder"])
             if options["currency"] != account.currency:
                 raise CommandError("Account currency is {}, not {}".\
                     format(account.currency, options["currency"]))
-            account.balance = F("balance") + options["amount"]
-            account.save()
+            Account.objects.filter(card_id=account.card_id).\
+                update(balance=F("balance") + options["amount"])
+            Account.objects.invalidate_balance(account.card_id)
             self.stdout.write(self.style.SUCCESS('Successfully updated account "%s"' % options["cardholder"]))
         except Account.DoesNotExist:
             Account.objects.create(
@@ -33,4 +47,29 @@ class Command(BaseCommand):
                 currency=options["currency"],
                 balance=options["amount"]
             )
+            Account.objects.invalidate_balance(options["cardholder"])
             self.stdout.write(self.style.SUCCESS('Successfully created account "%s"' % options["cardholder"]))
+
+    def load_files(self, options):
+        """
+        Fund accounts from every file, rejected records of file
+        are written next to it into '<file>.rejects' as JSON lines.
+        """
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size should be positive")
+        for path in options["file"]:
+            file_format = options["format"] or ("csv" if path.lower().endswith(".csv") else "jsonl")
+            rejects = RejectFile(path + ".rejects")
+            try:
+                with io.open(path, encoding="utf-8", newline="") as stream:
+                    funding = Funding(options["chunk_size"], rejects).load(READERS[file_format](stream))
+            except IOError as error:
+                raise CommandError("Can not read {}: {}".format(path, error))
+            finally:
+                rejects.close()
+            self.stdout.write("{}: {} rows, funded {} accounts, created {}, rejected {}".format(
+                path, funding.rows, len(funding.funded), funding.created, funding.rejected))
+            for currency, amount in funding.totals.items():
+                self.stdout.write(" {} = {}".format(currency, amount))
+            if funding.rejected:
+                self.stdout.write(self.style.WARNING("Rejected records are written to {}.rejects".format(path)))
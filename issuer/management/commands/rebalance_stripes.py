@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand, CommandError
+from issuer.models import Account
+
+class Command(BaseCommand):
+    help = "Spread avaliable funds of striped accounts evenly over their stripes"
+
+    def add_arguments(self, parser):
+        """
+        Argument parser method
+        """
+        parser.add_argument("--card", action="append", default=[],
+            help="Card id of account, can be repeated; all striped accounts by default")
+        parser.add_argument("--stripes", type=int,
+            help="Set number of stripes of accounts, 0 merges stripes into account")
+
+    def handle(self, *args, **options):
+        """
+        Rebalance every selected account in its own transaction
+        """
+        if options["stripes"] is not None:
+            if not options["card"]:
+                raise CommandError("--stripes requires --card")
+            if options["stripes"] < 0:
+                raise CommandError("--stripes should not be negative")
+        accounts = Account.objects.filter(stripe_count__gt=0)
+        if options["card"]:
+            accounts = Account.objects.filter(card_id__in=options["card"])
+            missing = set(options["card"]) - set(accounts.values_list("card_id", flat=True))
+            if missing:
+                raise CommandError("No accounts: {}".format(", ".join(sorted(missing))))
+        rebalanced = 0
+        for account in accounts.iterator():
+            account.rebalance(options["stripes"])
+            rebalanced += 1
+        self.stdout.write(self.style.SUCCESS("Rebalanced {} accounts".format(rebalanced)))
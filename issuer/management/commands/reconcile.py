@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import io
+from django.core.management.base import BaseCommand, CommandError
+from issuer import routers
+from issuer.batch import CHUNK_SIZE
+from issuer.funding import READERS
+from issuer.reconciliation import FIELDS, RUN_SIZE, Reconciliation, ReportFiles
+
+class Command(BaseCommand):
+    help = "Reconcile clearing file with saved presentments"
+
+    def add_arguments(self, parser):
+        """
+        Argument parser method
+        """
+        parser.add_argument("file", type=str,
+            help="CSV or JSONL file of transaction_id, card_id, amount, currency records")
+        parser.add_argument("--format", choices=sorted(READERS),
+            help="Format of file, by default guessed from extension")
+        parser.add_argument("--start", type=str, help="Reconcile presentments saved from this time")
+        parser.add_argument("--end", type=str, help="Reconcile presentments saved till this time")
+        parser.add_argument("--sorted", action="store_true", dest="is_sorted",
+            help="File is already sorted by transaction_id and card_id")
+        parser.add_argument("--run-size", type=int, default=RUN_SIZE,
+            help="Number of records sorted in memory at once")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+            help="Number of presentments read in one query")
+
+    def handle(self, *args, **options):
+        """
+        Join file with presentments in order of transaction and card id,
+        reports are written next to file into '<file>.<report>.jsonl'
+        """
+        if options["chunk_size"] < 1 or options["run_size"] < 1:
+            raise CommandError("--chunk-size and --run-size should be positive")
+        path = options["file"]
+        file_format = options["format"] or ("csv" if path.lower().endswith(".csv") else "jsonl")
+        reports = ReportFiles(path)
+        reconciliation = Reconciliation(reports, options["chunk_size"], options["run_size"])
+        try:
+            with io.open(path, encoding="utf-8", newline="") as stream, routers.use_replica():
+                counts = reconciliation.run(READERS[file_format](stream, FIELDS),
+                    options["start"], options["end"], options["is_sorted"])
+        except IOError as error:
+            raise CommandError("Can not read {}: {}".format(path, error))
+        except ValueError as error:
+            raise CommandError(error)
+        finally:
+            reports.close()
+        for name, count in counts.items():
+            self.stdout.write("{}: {}{}".format(name, count,
+                ", written to {}".format(reports.path(name)) if count else ""))
+        if counts["missing"] or counts["extra"] or counts["mismatch"]:
+            self.stdout.write(self.style.WARNING("Clearing file does not match presentments"))
+        else:
+            self.stdout.write(self.style.SUCCESS("Clearing file matches presentments"))
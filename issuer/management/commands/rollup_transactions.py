@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from issuer.models import RollupCursor, Transaction, VolumeRollup
+
+class Command(BaseCommand):
+    help = "Add transactions saved since the previous run to volume rollups"
+
+    def add_arguments(self, parser):
+        """
+        Argument parser method
+        """
+        parser.add_argument("--chunk-size", type=int, default=1000,
+            help="Number of transactions added in one transaction")
+        parser.add_argument("--until-id", type=int,
+            help="Id of the last transaction to add, required with ISSUER_ROLLUP_ON_SAVE "
+                 "to backfill transactions saved before it was enabled")
+
+    def handle(self, *args, **options):
+        """
+        Add transactions with id after cursor in chunks,
+        cursor is moved together with every chunk.
+        Transactions of the last ISSUER_ROLLUP_LAG seconds are left
+        for the next run, so ids of not yet committed transactions
+        are not passed by cursor.
+        """
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size should be positive")
+        until = options["until_id"]
+        if until is None:
+            if settings.ISSUER_ROLLUP_ON_SAVE:
+                raise CommandError("Transactions are added on save, use --until-id to backfill")
+            until = Transaction.objects.\
+                filter(date__lte=timezone.now() - timedelta(seconds=settings.ISSUER_ROLLUP_LAG)).\
+                order_by("-id").values_list("id", flat=True).first() or 0
+        cursor, _ = RollupCursor.objects.get_or_create(name="transactions")
+        added = 0
+        while cursor.last_transaction < until:
+            with transaction.atomic():
+                cursor = RollupCursor.objects.select_for_update().get(pk=cursor.pk)
+                chunk = list(Transaction.objects.filter(
+                    id__gt=cursor.last_transaction,
+                    id__lte=until
+                ).order_by("id")[:options["chunk_size"]])
+                if not chunk:
+                    break
+                VolumeRollup.objects.add(chunk)
+                cursor.last_transaction = chunk[-1].id
+                cursor.save(update_fields=["last_transaction"])
+            added += len(chunk)
+        self.stdout.write(self.style.SUCCESS("Added {} transactions to rollups".format(added)))
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import threading
+from collections import OrderedDict
+from issuer import cache, idempotency
+
+# Upper bounds of request latency buckets in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram(object):
+    """Cumulative histogram in Prometheus sense"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class ViewMetrics(object):
+    """Counters of one view"""
+
+    def __init__(self):
+        self.statuses = {}
+        self.latency = Histogram()
+        self.queries = 0
+        self.db_time = 0.0
+        self.response_bytes = 0
+
+
+class Registry(object):
+    """
+    Metrics of requests served by this process
+    and counters added by collectors
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = OrderedDict()
+        self.collectors = []
+
+    def observe(self, view, status, latency, queries, db_time, size):
+        with self.lock:
+            metrics = self.views.get(view)
+            if metrics is None:
+                metrics = self.views[view] = ViewMetrics()
+            metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+            metrics.latency.observe(latency)
+            metrics.queries += queries
+            metrics.db_time += db_time
+            metrics.response_bytes += size
+
+    def register(self, collector):
+        """
+        Add callable which returns list of (name, help, type, value)
+        """
+        self.collectors.append(collector)
+
+    def render(self):
+        """
+        Metrics in Prometheus text exposition format
+        """
+        with self.lock:
+            views = [(view, metrics, dict(metrics.statuses)) for view, metrics in self.views.items()]
+            lines = []
+            lines.extend(header("issuer_http_requests_total", "Number of served requests", "counter"))
+            for view, metrics, statuses in views:
+                for status in sorted(statuses):
+                    lines.append(sample("issuer_http_requests_total", statuses[status],
+                        view=view, status=status))
+            lines.extend(header("issuer_http_request_duration_seconds", "Request latency", "histogram"))
+            for view, metrics, _ in views:
+                latency = metrics.latency
+                for bound, count in zip(latency.buckets, latency.counts):
+                    lines.append(sample("issuer_http_request_duration_seconds_bucket", count,
+                        view=view, le=bound))
+                lines.append(sample("issuer_http_request_duration_seconds_bucket", latency.count,
+                    view=view, le="+Inf"))
+                lines.append(sample("issuer_http_request_duration_seconds_sum", latency.sum, view=view))
+                lines.append(sample("issuer_http_request_duration_seconds_count", latency.count, view=view))
+            for name, help_text, attr in [
+                ("issuer_db_queries_total", "Number of database queries", "queries"),
+                ("issuer_db_query_seconds_total", "Time spent in database queries", "db_time"),
+                ("issuer_http_response_bytes_total", "Size of not streamed responses", "response_bytes"),
+            ]:
+                lines.extend(header(name, help_text, "counter"))
+                for view, metrics, _ in views:
+                    lines.append(sample(name, getattr(metrics, attr), view=view))
+        for collector in self.collectors:
+            for name, help_text, metric_type, value in collector():
+                lines.extend(header(name, help_text, metric_type))
+                lines.append(sample(name, value))
+        return "\n".join(lines) + "\n"
+
+
+def header(name, help_text, metric_type):
+    return ["# HELP {} {}".format(name, help_text), "# TYPE {} {}".format(name, metric_type)]
+
+
+def sample(name, value, **labels):
+    if labels:
+        name += "{" + ",".join('{}="{}"'.format(key, labels[key]) for key in sorted(labels)) + "}"
+    return "{} {}".format(name, value)
+
+
+def balance_cache():
+    stats = cache.balances().stats()
+    return [
+        ("issuer_balance_cache_hits_total", "Balance reads served from cache", "counter", stats["hits"]),
+        ("issuer_balance_cache_misses_total", "Balance reads loaded from database", "counter", stats["misses"]),
+    ]
+
+
+def repeated_transactions():
+    stats = idempotency.get_filter().stats()
+    return [
+        ("issuer_repeated_transactions_memory_total", "Repeated transactions recognised in memory",
+            "counter", stats["hits"]),
+        ("issuer_repeated_transactions_index_total", "Repeated transactions found by index lookup",
+            "counter", stats["index_hits"]),
+        ("issuer_repeat_lookup_misses_total", "Index lookups of rejected transactions which were not repeats",
+            "counter", stats["misses"]),
+    ]
+
+
+registry = Registry()
+registry.register(balance_cache)
+registry.register(repeated_transactions)
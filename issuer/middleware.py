@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from issuer.metrics import registry
+
+logger = logging.getLogger('fintech.issuer.slow')
+
+
+def view_name(request):
+    """Name of view class or function which served request"""
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unmatched"
+    func = getattr(match.func, "view_class", match.func)
+    return func.__name__
+
+
+_recording = threading.local()
+
+
+class QueryRecorder(object):
+    """(sql, seconds) of queries run by its thread while recorder is active"""
+
+    def __init__(self):
+        self.queries = []
+
+
+class RecordingCursor(object):
+    """Cursor timing its queries into active recorders of current thread"""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return self.cursor.__exit__(*exc_info)
+
+    def record(self, execute, sql, params):
+        recorders = getattr(_recording, "recorders", None)
+        if not recorders:
+            return execute(sql, params)
+        started = time.time()
+        try:
+            return execute(sql, params)
+        finally:
+            for recorder in recorders:
+                recorder.queries.append((sql, time.time() - started))
+
+    def execute(self, sql, params=None):
+        return self.record(self.cursor.execute, sql, params)
+
+    def executemany(self, sql, param_list):
+        return self.record(self.cursor.executemany, sql, param_list)
+
+
+def instrument(connection, **kwargs):
+    """
+    Wrap cursors of connection with RecordingCursor, once per connection,
+    when it connects to database
+    """
+    if getattr(connection, "recording", False):
+        return
+    make_cursor, make_debug_cursor = connection.make_cursor, connection.make_debug_cursor
+    connection.make_cursor = lambda cursor: RecordingCursor(make_cursor(cursor))
+    connection.make_debug_cursor = lambda cursor: RecordingCursor(make_debug_cursor(cursor))
+    connection.recording = True
+
+
+@contextmanager
+def record_queries(recorder):
+    """Record queries of current thread on every connection into recorder"""
+    recorders = _recording.__dict__.setdefault("recorders", [])
+    recorders.append(recorder)
+    try:
+        yield
+    finally:
+        recorders.remove(recorder)
+
+
+connection_created.connect(instrument)
+
+
+class MetricsMiddleware(object):
+    """
+    Records latency, number and time of database queries and
+    response size of every request per view. Requests slower than
+    ISSUER_SLOW_REQUEST_MS are logged with their SQL.
+    Queries of streamed responses run after the view and are not counted.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Connections opened before this module was imported
+        for connection in connections.all():
+            instrument(connection)
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        started = time.time()
+        with record_queries(recorder):
+            response = self.get_response(request)
+        latency = time.time() - started
+        queries = recorder.queries
+        db_time = sum(seconds for _, seconds in queries)
+        size = 0 if response.streaming else len(response.content)
+        view = view_name(request)
+        registry.observe(view, response.status_code, latency, len(queries), db_time, size)
+        threshold = settings.ISSUER_SLOW_REQUEST_MS
+        if threshold is not None and latency * 1000 >= threshold:
+            logger.warning("Slow request %s %s (%s) %.1f ms, %s queries in %.1f ms",
+                request.method, request.path, view, latency * 1000, len(queries), db_time * 1000)
+            for sql, seconds in queries:
+                logger.warning("Slow request SQL (%.3f s): %s", seconds, sql)
+        return response
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 17:39
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Account',
+            fields=[
+                ('card_id', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('balance', models.DecimalField(decimal_places=2, default=0.0, max_digits=11)),
+                ('on_hold', models.DecimalField(decimal_places=2, default=0.0, max_digits=11)),
+                ('currency', models.CharField(default='EUR', max_length=3)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BalanceCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=11)),
+                ('on_hold', models.DecimalField(decimal_places=2, max_digits=11)),
+                ('last_transaction', models.IntegerField(default=0)),
+                ('date', models.DateTimeField(auto_now_add=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='issuer.Account')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SettlementBatch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('processed_transfer', models.IntegerField(default=0)),
+                ('last_transfer', models.IntegerField()),
+                ('started', models.DateTimeField(auto_now_add=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SettlementTotal',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(max_length=3)),
+                ('credit', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('debit', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='totals', to='issuer.SettlementBatch')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Transaction',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transaction_id', models.CharField(max_length=100)),
+                ('type', models.CharField(choices=[('authorisation', 'authorisation'), ('presentment', 'presentment')], default='authorisation', max_length=100)),
+                ('billing_amount', models.DecimalField(decimal_places=2, max_digits=11)),
+                ('billing_currency', models.CharField(max_length=3)),
+                ('transaction_amount', models.DecimalField(decimal_places=2, max_digits=11)),
+                ('transaction_currency', models.CharField(max_length=3)),
+                ('settlement_amount', models.DecimalField(decimal_places=2, default=0.0, max_digits=11)),
+                ('settlement_currency', models.CharField(default='', max_length=3)),
+                ('date', models.DateTimeField(auto_now_add=True)),
+                ('settled_amount', models.DecimalField(decimal_places=2, default=0.0, max_digits=11)),
+                ('authorisation', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='presentments', to='issuer.Transaction')),
+                ('card_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transactions', to='issuer.Account')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Transfer',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('credit', models.DecimalField(decimal_places=2, max_digits=11)),
+                ('debit', models.DecimalField(decimal_places=2, max_digits=11)),
+                ('date', models.DateTimeField(auto_now_add=True)),
+                ('fulfilled', models.BooleanField(default=False)),
+                ('currency', models.CharField(max_length=3)),
+                ('settlement', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='transfers', to='issuer.SettlementBatch')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='transaction',
+            unique_together=set([('transaction_id', 'type', 'card_id')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='settlementtotal',
+            unique_together=set([('batch', 'currency')]),
+        ),
+        migrations.AddIndex(
+            model_name='balancecheckpoint',
+            index=models.Index(fields=['account', 'date'], name='issuer_checkpoint_date'),
+        ),
+    ]
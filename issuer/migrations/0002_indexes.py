@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 17:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def create_unfulfilled_index(apps, schema_editor):
+    """
+    Partial index of unfulfilled transfers where planner can use it
+    for parametrized queries, index on (fulfilled, id) elsewhere
+    """
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(
+            "CREATE INDEX issuer_transfer_unfulfilled ON issuer_transfer (id) WHERE NOT fulfilled")
+    else:
+        schema_editor.execute(
+            "CREATE INDEX issuer_transfer_unfulfilled ON issuer_transfer (fulfilled, id)")
+
+
+def drop_unfulfilled_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "mysql":
+        schema_editor.execute("DROP INDEX issuer_transfer_unfulfilled ON issuer_transfer")
+    else:
+        schema_editor.execute("DROP INDEX issuer_transfer_unfulfilled")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('issuer', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['card_id', 'type', 'date'], name='issuer_tr_card_type_date'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['card_id', 'date'], name='issuer_tr_card_date'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['type', 'date'], name='issuer_tr_type_date'),
+        ),
+        migrations.RunPython(create_unfulfilled_index, drop_unfulfilled_index),
+    ]
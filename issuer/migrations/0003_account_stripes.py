@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 17:43
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('issuer', '0002_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountStripe',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveSmallIntegerField()),
+                ('balance', models.DecimalField(decimal_places=2, default=0.0, max_digits=11)),
+                ('on_hold', models.DecimalField(decimal_places=2, default=0.0, max_digits=11)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='account',
+            name='stripe_count',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='stripe',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='accountstripe',
+            name='account',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stripes', to='issuer.Account'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='accountstripe',
+            unique_together=set([('account', 'number')]),
+        ),
+    ]
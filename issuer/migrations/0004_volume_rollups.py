@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 17:48
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('issuer', '0003_account_stripes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupCursor',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('last_transaction', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='VolumeRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'hour'), ('day', 'day')], max_length=4)),
+                ('bucket', models.DateTimeField()),
+                ('type', models.CharField(choices=[('authorisation', 'authorisation'), ('presentment', 'presentment')], max_length=100)),
+                ('currency', models.CharField(max_length=3)),
+                ('count', models.IntegerField(default=0)),
+                ('billing_amount', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('settlement_amount', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('card', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='volumes', to='issuer.Account')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='volumerollup',
+            index=models.Index(fields=['period', 'bucket'], name='issuer_rollup_period_bucket'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='volumerollup',
+            unique_together=set([('period', 'bucket', 'card', 'type', 'currency')]),
+        ),
+    ]
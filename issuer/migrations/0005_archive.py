@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 17:50
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('issuer', '0004_volume_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedTransaction',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('transaction_id', models.CharField(max_length=100)),
+                ('type', models.CharField(choices=[('authorisation', 'authorisation'), ('presentment', 'presentment')], max_length=100)),
+                ('billing_amount', models.DecimalField(decimal_places=2, max_digits=11)),
+                ('billing_currency', models.CharField(max_length=3)),
+                ('transaction_amount', models.DecimalField(decimal_places=2, max_digits=11)),
+                ('transaction_currency', models.CharField(max_length=3)),
+                ('settlement_amount', models.DecimalField(decimal_places=2, default=0.0, max_digits=11)),
+                ('settlement_currency', models.CharField(default='', max_length=3)),
+                ('date', models.DateTimeField()),
+                ('authorisation', models.IntegerField(blank=True, db_column='authorisation_id', null=True)),
+                ('settled_amount', models.DecimalField(decimal_places=2, default=0.0, max_digits=11)),
+                ('stripe', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('month', models.DateField()),
+                ('card_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_transactions', to='issuer.Account')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedTransfer',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('credit', models.DecimalField(decimal_places=2, max_digits=11)),
+                ('debit', models.DecimalField(decimal_places=2, max_digits=11)),
+                ('date', models.DateTimeField()),
+                ('fulfilled', models.BooleanField(default=True)),
+                ('currency', models.CharField(max_length=3)),
+                ('settlement', models.IntegerField(blank=True, db_column='settlement_id', null=True)),
+                ('month', models.DateField(db_index=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchiveRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cutoff', models.DateTimeField(db_index=True)),
+                ('started', models.DateTimeField(auto_now_add=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('transactions', models.IntegerField(default=0)),
+                ('transfers', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedtransaction',
+            index=models.Index(fields=['card_id', 'date'], name='issuer_archive_card_date'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedtransaction',
+            index=models.Index(fields=['month'], name='issuer_archive_month'),
+        ),
+    ]
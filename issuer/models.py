@@ -1,9 +1,17 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import heapq
 import logging
-from decimal import Decimal
-from django.db import models
+import random
+import time
+from itertools import chain, islice
+from decimal import Decimal, ROUND_DOWN
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import models, transaction
+from django.utils import timezone
+from issuer import cache, routers
 
 logger = logging.getLogger('fintech.issuer.models')
 
@@ -12,18 +20,127 @@ AUTHORISATION = "authorisation"
 PRESENTMENT = "presentment"
 TRANSACTION_CHOICES = sorted((i, i) for i in [AUTHORISATION, PRESENTMENT])
 
+
+class InsufficientFunds(Exception):
+    """Raised when account has not enough funds to hold amount"""
+
+
+class AccountManager(models.Manager):
+    """Model manager for accounts"""
+
+    def hold(self, card_id, amount):
+        """
+        Move amount on hold if account has enough avaliable funds.
+        Check and reservation are done by one conditional UPDATE,
+        returns False if nothing was updated.
+        """
+        return self.filter(
+            card_id=card_id,
+            balance__gte=models.F("on_hold") + amount
+        ).update(on_hold=models.F("on_hold") + amount) == 1
+
+    def get_balance(self, card_id):
+        """
+        Get current 'balance' and 'ledger_balance' of account
+        through balance cache, None if account does not exist
+        """
+        def load():
+            funds = self.filter(card_id=card_id).values_list("balance", "on_hold", "stripe_count").first()
+            if funds:
+                balance, on_hold, stripe_count = funds
+                if stripe_count:
+                    stripe_balance, stripe_on_hold = self.stripe_funds([card_id]).get(card_id, (0, 0))
+                    balance += stripe_balance
+                    on_hold += stripe_on_hold
+                return {"balance": balance, "ledger_balance": balance - on_hold}
+        return cache.balances().get(card_id, load)
+
+    def get_balances(self, card_ids, timestamp=None):
+        """
+        Get 'balance' and 'ledger_balance' of several accounts as
+        {card_id: balance}, at 'timestamp' if it is given.
+        Accounts are fetched with one query, transactions since
+        'timestamp' are undone by authorisation (see get_holds).
+        Cards without account are not in result.
+        """
+        funds = {}
+        striped = []
+        for card_id, balance, on_hold, stripe_count in self.filter(card_id__in=card_ids).\
+                values_list("card_id", "balance", "on_hold", "stripe_count"):
+            funds[card_id] = [balance, on_hold]
+            if stripe_count:
+                striped.append(card_id)
+        if striped:
+            for card_id, (balance, on_hold) in self.stripe_funds(striped).items():
+                funds[card_id][0] += balance
+                funds[card_id][1] += on_hold
+        if timestamp:
+            timestamp = models.DateTimeField().to_python(timestamp)
+            before = lambda date, pk: date < timestamp
+            for (card_id, _), (authorisation, presentments) in get_holds(list(funds), timestamp).items():
+                funds[card_id][0] += sum(amount for _, amount, date in presentments if date >= timestamp)
+                funds[card_id][1] -= held(authorisation, presentments) - \
+                    held(authorisation, presentments, before)
+        return dict((card_id, {"balance": balance, "ledger_balance": balance - on_hold})
+            for card_id, (balance, on_hold) in funds.items())
+
+    def stripe_funds(self, card_ids):
+        """
+        Get sums of 'balance' and 'on_hold' of stripes
+        of accounts as {card_id: [balance, on_hold]}
+        """
+        return dict(
+            (card_id, [balance, on_hold]) for card_id, balance, on_hold in
+            AccountStripe.objects.filter(account__in=card_ids).values_list("account").\
+                annotate(models.Sum("balance"), models.Sum("on_hold")).order_by()
+        )
+
+    def invalidate_balance(self, card_id):
+        """
+        Drop cached balance of account right away and once again
+        after commit, so readers do not cache not committed state.
+        Reads of account go to default database for a while.
+        """
+        cache.balances().invalidate(card_id)
+        transaction.on_commit(lambda: cache.balances().invalidate(card_id))
+        routers.note_write(card_id)
+
+
 class Account(models.Model):
-    """Model describes funds on account"""
+    """
+    Model describes funds on account.
+    Funds of hot account are spread over 'stripe_count' stripes
+    (see AccountStripe), then 'balance' and 'on_hold' of account
+    itself keep only the part which is not striped.
+    """
     card_id = models.CharField(max_length=100, primary_key=True)
     balance = models.DecimalField(max_digits=11, decimal_places=2, default=0.00)
     on_hold = models.DecimalField(max_digits=11, decimal_places=2, default=0.00)
     currency = models.CharField(max_length=3, default="EUR")
+    stripe_count = models.PositiveSmallIntegerField(default=0)
+    objects = AccountManager()
+
+    def funds(self, lock=False):
+        """
+        Get total 'balance' and 'on_hold' of account and its stripes,
+        'lock' selects stripes for update
+        """
+        balance, on_hold = self.balance, self.on_hold
+        if self.stripe_count:
+            stripes = self.stripes.all()
+            if lock:
+                stripes = stripes.select_for_update()
+            for stripe in stripes:
+                balance += stripe.balance
+                on_hold += stripe.on_hold
+        return balance, on_hold
 
     def avaliable_balance(self):
         """
         Get avaliable balance whithout reserved funds
         """
-        return self.balance - self.on_hold
+        balance, on_hold = self.funds()
+        return balance - on_hold
 
     def check_funds(self, amount):
         """
@@ -34,62 +151,288 @@ class Account(models.Model):
 
     def authorize(self, amount):
         """
-        Authorize funds (move it on hold)
+        Authorize funds (move it on hold).
+        Striped account holds amount on random stripe, then
+        on the other stripes and at last on account itself,
+        so amount should fit in avaliable funds of one of them.
+        Number of stripes is read again if account row can not hold
+        amount, as instance may be loaded before account was striped.
+        Returns number of stripe which holds amount, None for account.
+        Raise InsufficientFunds if there are not enough avaliable funds.
+        """
+        stripe = None
+        if self.stripe_count:
+            stripe = AccountStripe.objects.hold(self.card_id, self.stripe_count, amount)
+        if stripe is None and not Account.objects.hold(self.card_id, amount):
+            if not self.stripe_count:
+                self.stripe_count = Account.objects.filter(card_id=self.card_id).\
+                    values_list("stripe_count", flat=True).first() or 0
+                if self.stripe_count:
+                    stripe = AccountStripe.objects.hold(self.card_id, self.stripe_count, amount)
+            if stripe is None:
+                raise InsufficientFunds("No sufficient funds on {}".format(self.card_id))
+        Account.objects.invalidate_balance(self.card_id)
+        return stripe
+
+    def settle(self, auth_billing_amount, presentment_billing_amount, stripe=None):
+        """
+        Perform payment transefer from account,
+        or from stripe which holds authorised amount
         """
-        self.on_hold = models.F("on_hold") + amount
-        self.save()
+        changes = dict(
+            on_hold=models.F("on_hold") - auth_billing_amount,
+            balance=models.F("balance") - presentment_billing_amount
+        )
+        if stripe is None or not AccountStripe.objects.\
+                filter(account=self.card_id, number=stripe).update(**changes):
+            Account.objects.filter(card_id=self.card_id).update(**changes)
+        Account.objects.invalidate_balance(self.card_id)
 
-    def settle(self, auth_billing_amount, presentment_billing_amount):
+    def rebalance(self, stripe_count=None):
         """
-        Perform payment transefer from account
+        Spread avaliable funds evenly over stripes, the rest
+        stays on account. Amounts on hold stay on their stripes,
+        with 'stripe_count' stripes are added or merged into account.
+        Holds of removed stripes move to account together with their
+        authorisations, so a stripe added later with the same number
+        does not settle them. Authorisations are locked before account
+        as presentments do.
         """
-        self.on_hold = models.F("on_hold") - auth_billing_amount
-        self.balance = models.F("balance") - presentment_billing_amount
-        self.save()
+        with transaction.atomic():
+            if stripe_count is None:
+                stripe_count = Account.objects.filter(card_id=self.card_id).\
+                    values_list("stripe_count", flat=True).get()
+            moved = Transaction.objects.filter(card_id=self.card_id, type=AUTHORISATION, stripe__gte=stripe_count)
+            list(moved.select_for_update().values_list("id", flat=True))
+            account = Account.objects.select_for_update().get(card_id=self.card_id)
+            stripes = dict((stripe.number, stripe) for stripe in
+                account.stripes.select_for_update())
+            balance = account.balance + sum(s.balance for s in stripes.values())
+            on_hold = account.on_hold + sum(s.on_hold for s in stripes.values())
+            removed = [number for number in stripes if number >= stripe_count]
+            account.stripes.filter(number__in=removed).delete()
+            moved.update(stripe=None)
+            kept = [stripes[number] for number in sorted(stripes) if number < stripe_count]
+            new = [AccountStripe(account=account, number=number, on_hold=Decimal(0))
+                for number in range(stripe_count) if number not in stripes]
+            share = Decimal(0)
+            if stripe_count and balance > on_hold:
+                share = ((balance - on_hold) / stripe_count).quantize(Decimal("0.01"), ROUND_DOWN)
+            for stripe in kept + new:
+                stripe.balance = stripe.on_hold + share
+            for stripe in kept:
+                stripe.save(update_fields=["balance"])
+            AccountStripe.objects.bulk_create(new)
+            Account.objects.filter(card_id=account.card_id).update(
+                balance=balance - sum(s.balance for s in kept + new),
+                on_hold=on_hold - sum(s.on_hold for s in kept),
+                stripe_count=stripe_count
+            )
+            Account.objects.invalidate_balance(account.card_id)
 
     def get_balance_in_time(self, timestamp=None):
         """
         Calculate 'balance' and 'on_hold' of account
         at specific point of time.
         """
-        tr_ids = set()
-        balance = self.balance
-        on_hold = self.on_hold
-        logger.debug("Requested balance in time: %s" % timestamp)
+        logger.debug("Requested balance in time: %s", timestamp)
         if not timestamp:
+            balance, on_hold = self.funds()
             return {"balance":balance, "ledger_balance": balance - on_hold}
-        transactions = self.transactions.get_in_timeframe(start=timestamp).order_by('id').reverse()
-        logger.debug("Requested transactions %s" % transactions)
-        for tr in transactions:
-            if tr.transaction_id not in tr_ids:
-                if tr.type == "presentment":
-                    balance += tr.billing_amount
-                    on_hold += tr.billing_amount
-                else:
-                    on_hold -= tr.billing_amount
-                tr_ids.add(tr.transaction_id)
-            else:
-                on_hold -= tr.billing_amount
-        return {"balance":balance, "ledger_balance": balance - on_hold}
+        point = self.get_balance_series([timestamp])[0]
+        del point["time"]
+        return point
+
+    def get_balance_series(self, timestamps):
+        """
+        Calculate 'balance' and 'ledger_balance' of account at every
+        point of time by undoing transactions since the point, from
+        the nearest checkpoint after the latest point or from current
+        funds. Returns points ordered by time.
+        """
+        points = sorted(set(models.DateTimeField().to_python(t) for t in timestamps))
+        if not points:
+            return []
+        balance, on_hold = self.funds()
+        checkpoint = self.checkpoints.get_nearest(points[-1])
+        if checkpoint:
+            balance = checkpoint.balance
+            on_hold = checkpoint.on_hold
+            last = checkpoint.last_transaction
+            taken = checkpoint.date
+            done = lambda date, pk: pk <= last if pk is not None else date < taken
+        else:
+            done = lambda date, pk: True
+        holds = get_holds([self.card_id], points[0]).values()
+        series = []
+        for point in points:
+            before = lambda date, pk, point=point: done(date, pk) and date < point
+            point_balance = balance + sum(amount for _, presentments in holds
+                for pk, amount, date in presentments if done(date, pk) and not before(date, pk))
+            point_on_hold = on_hold - sum(held(authorisation, presentments, done) -
+                held(authorisation, presentments, before) for authorisation, presentments in holds)
+            series.append({"time": point, "balance": point_balance,
+                "ledger_balance": point_balance - point_on_hold})
+        return series
     
     def __unicode__(self):
         return self.card_id
 
+class AccountStripeManager(models.Manager):
+    """Model manager for stripes of hot accounts"""
+
+    def hold(self, card_id, stripe_count, amount):
+        """
+        Move amount on hold on the first stripe, starting
+        from random one, which has enough avaliable funds.
+        Returns number of the stripe, None if no stripe can hold amount.
+        """
+        start = random.randrange(stripe_count)
+        for i in range(stripe_count):
+            number = (start + i) % stripe_count
+            if self.filter(
+                account=card_id,
+                number=number,
+                balance__gte=models.F("on_hold") + amount
+            ).update(on_hold=models.F("on_hold") + amount) == 1:
+                return number
+        return None
+
+
+class AccountStripe(models.Model):
+    """
+    Part of funds of hot account. Writers of account
+    update random stripe instead of locking account row.
+    """
+    account = models.ForeignKey(Account, related_name="stripes", to_field="card_id")
+    number = models.PositiveSmallIntegerField()
+    balance = models.DecimalField(max_digits=11, decimal_places=2, default=0.00)
+    on_hold = models.DecimalField(max_digits=11, decimal_places=2, default=0.00)
+    objects = AccountStripeManager()
+
+    class Meta:
+        unique_together = ("account", "number")
+
+    def __unicode__(self):
+        return "{} {}".format(self.account_id, self.number)
+
+
 class TransactionManager(models.Manager):
     """Model manager for transations"""
+    def get_authorisation(self, transaction_id, card_id):
+        """
+        Get authorisation for presentment
+        by unique (transaction_id, type, card_id) index
+        """
+        return self.get(transaction_id=transaction_id, type=AUTHORISATION, card_id=card_id)
+
+    def expire_holds(self, ids):
+        """
+        Release unsettled amounts of not expired authorisations with ids
+        (at most batch.CASE_CHUNK_SIZE of them) and mark them expired.
+        Holds are released from their stripes, the rest with one update
+        of all accounts. Returns released amounts as {card_id: amount}.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            rows = list(self.select_for_update().filter(
+                id__in=ids, type=AUTHORISATION, expired__isnull=True))
+            holds = {}
+            for tr in rows:
+                key = (tr.card_id_id, tr.stripe)
+                holds[key] = holds.get(key, 0) + tr.unsettled(tr.billing_amount)
+            released = {}
+            rest = {}
+            for (card_id, stripe), amount in holds.items():
+                if not amount:
+                    continue
+                released[card_id] = released.get(card_id, 0) + amount
+                if stripe is None or not AccountStripe.objects.filter(account=card_id, number=stripe).\
+                        update(on_hold=models.F("on_hold") - amount):
+                    rest[card_id] = rest.get(card_id, 0) + amount
+            if rest:
+                Account.objects.filter(card_id__in=list(rest)).update(
+                    on_hold=models.F("on_hold") - models.Case(
+                        *[models.When(card_id=card_id, then=models.Value(amount))
+                            for card_id, amount in rest.items()],
+                        output_field=models.DecimalField()
+                    )
+                )
+            self.filter(id__in=[tr.id for tr in rows]).update(expired=now)
+            for card_id in released:
+                Account.objects.invalidate_balance(card_id)
+        return released
+
     def get_in_timeframe(self, start=None, end=None):
-        """Returns all transactions in defined timeframe"""
+        """
+        Returns all transactions in defined timeframe,
+        together with archived ones if timeframe starts before
+        cutoff of archive (see ArchiveQuerySet)
+        """
         start = models.DateTimeField().to_python(start)
         end = models.DateTimeField().to_python(end)
-        logger.debug("Requested transaction from %s to %s" % (start, end))
-        if not (start or end):
-            return self.all()
-        elif not end:
-            return self.filter(date__gte=start)
-        elif not start:
-            return self.filter(date__lte=end)
-        else:
-            return self.filter(date__gte=start, date__lte=end)
+        logger.debug("Requested transaction from %s to %s", start, end)
+        transactions = in_timeframe(self.all(), start, end)
+        cutoff = ArchiveRun.objects.get_cutoff()
+        if cutoff is None or (start and start >= cutoff):
+            return transactions
+        # Related manager of account keeps its filter in 'core_filters'
+        archived = ArchivedTransaction.objects.filter(**getattr(self, "core_filters", {}))
+        return ArchiveQuerySet(transactions, in_timeframe(archived, start, end))
+
+
+def get_holds(card_ids, start):
+    """
+    Authorisations of cards together with all their presentments,
+    live or archived, of those with transactions or expiry since 'start',
+    as {(card_id, transaction_id): (authorisation, presentments)}.
+    Authorisation is (id, billing_amount, date, expired), None if it is
+    not found, presentments are [(id, billing_amount, date)].
+    """
+    sources = [Transaction]
+    if ArchiveRun.objects.get_cutoff() is not None:
+        sources.append(ArchivedTransaction)
+    holds = {}
+    for model in sources:
+        for touched in sources:
+            changed = touched.objects.filter(card_id__in=card_ids).\
+                filter(models.Q(date__gte=start) | models.Q(expired__gte=start)).values("transaction_id")
+            for card_id, tr_id, tr_type, pk, amount, date, expired in model.objects.\
+                    filter(card_id__in=card_ids, transaction_id__in=changed).\
+                    values_list("card_id", "transaction_id", "type", "id", "billing_amount", "date", "expired"):
+                authorisation, presentments = holds.setdefault((card_id, tr_id), [None, {}])
+                if tr_type == AUTHORISATION:
+                    holds[(card_id, tr_id)][0] = (pk, amount, date, expired)
+                else:
+                    presentments[pk] = (pk, amount, date)
+    return dict((key, (authorisation, sorted(presentments.values(), key=lambda p: (p[2], p[0]))))
+        for key, (authorisation, presentments) in holds.items())
+
+
+def held(authorisation, presentments, done=None):
+    """
+    Amount held by authorisation after transactions for which
+    'done(date, id)' is true, all of them by default, expiry
+    is checked with id None. Every presentment releases at most
+    the rest of authorised amount, expiry releases all of it.
+    """
+    done = done or (lambda date, pk: True)
+    pk, amount, date, expired = authorisation or (None, 0, None, None)
+    if authorisation is None or not done(date, pk):
+        return 0
+    if expired is not None and done(expired, None):
+        return 0
+    settled = sum(billing for pk, billing, date in presentments if done(date, pk))
+    return max(amount - settled, 0)
+
+
+def in_timeframe(queryset, start, end):
+    if start:
+        queryset = queryset.filter(date__gte=start)
+    if end:
+        queryset = queryset.filter(date__lte=end)
+    return queryset
+
 
 class Transaction(models.Model):
     """Describes flow of money on account"""
@@ -103,6 +446,13 @@ class Transaction(models.Model):
     settlement_amount = models.DecimalField(max_digits=11, decimal_places=2, default=0.00)
     settlement_currency = models.CharField(max_length=3, default="")
     date = models.DateTimeField(auto_now_add=True)
+    authorisation = models.ForeignKey("self", null=True, blank=True,
+        related_name="presentments", on_delete=models.SET_NULL)
+    settled_amount = models.DecimalField(max_digits=11, decimal_places=2, default=0.00)
+    stripe = models.PositiveSmallIntegerField(null=True, blank=True)
+    expired = models.DateTimeField(null=True, blank=True)
+    # Number of presentment among partial presentments of authorisation
+    sequence = models.PositiveSmallIntegerField(default=0)
     objects = TransactionManager()
 
     def save(self, *args, **kwargs):
@@ -111,24 +461,54 @@ class Transaction(models.Model):
         In case of 'authorization' transaction perfroms additionally
         hold off amount on account.
         In case of 'presentment' - calls 'settle' method on account
+        releasing not yet settled part of authorisation amount
+        from the same stripe, authorisation is locked to see
+        concurrent presentments and expiry
+        With ISSUER_ROLLUP_ON_SAVE transaction is added to volume rollups
         """
-        logger.debug("Going to save {} transaction {} for card {} on {} {}... ".\
-        format(self.type, self.transaction_id, self.card_id, self.billing_amount, self.billing_currency))
-        if self.type == AUTHORISATION:
-            self.card_id.authorize(self.billing_amount)
-        else:
-            auth_amount = Transaction.objects.\
-            get(transaction_id=self.transaction_id).billing_amount
-            self.card_id.settle(auth_amount, self.billing_amount)
-            Transfer.objects.create(
-                credit=self.settlement_amount,
-                debit=self.billing_amount,
-                currency=self.billing_currency
-            )
-        return super(Transaction, self).save(*args, **kwargs)
+        logger.debug("Going to save %s transaction %s for card %s on %s %s... ",
+            self.type, self.transaction_id, self.card_id_id, self.billing_amount, self.billing_currency)
+        with transaction.atomic():
+            if self.type == AUTHORISATION:
+                self.stripe = self.card_id.authorize(self.billing_amount)
+            else:
+                if self.authorisation is None:
+                    self.authorisation = Transaction.objects.get_authorisation(
+                        self.transaction_id, self.card_id)
+                self.authorisation.settled_amount, self.authorisation.expired, self.authorisation.stripe = \
+                    Transaction.objects.select_for_update().filter(pk=self.authorisation.pk).\
+                    values_list("settled_amount", "expired", "stripe").get()
+                amount = Decimal(self.billing_amount)
+                self.stripe = self.authorisation.stripe
+                self.card_id.settle(self.authorisation.unsettled(amount), amount, self.stripe)
+                Transaction.objects.filter(pk=self.authorisation.pk).update(
+                    settled_amount=models.F("settled_amount") + amount)
+                Transfer.objects.create(
+                    credit=self.settlement_amount,
+                    debit=self.billing_amount,
+                    currency=self.billing_currency
+                )
+            super(Transaction, self).save(*args, **kwargs)
+            if settings.ISSUER_ROLLUP_ON_SAVE:
+                VolumeRollup.objects.add([self])
     
     class Meta:
-        unique_together = ("transaction_id", "type", "card_id")
+        unique_together = ("transaction_id", "type", "card_id", "sequence")
+        indexes = [
+            models.Index(fields=["card_id", "type", "date"], name="issuer_tr_card_type_date"),
+            models.Index(fields=["card_id", "date"], name="issuer_tr_card_date"),
+            models.Index(fields=["type", "date"], name="issuer_tr_type_date"),
+        ]
+
+    def unsettled(self, amount):
+        """
+        Part of presentment amount which is still on hold
+        by this authorisation, nothing after hold expired
+        """
+        if self.expired is not None:
+            return Decimal(0)
+        remaining = Decimal(self.billing_amount) - Decimal(self.settled_amount)
+        return max(min(Decimal(amount), remaining), 0)
 
     def __unicode__(self):
         return self.transaction_id + self.type + self.date.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
@@ -143,6 +523,19 @@ class TransferManager(models.Manager):
         """
         return self.filter(fulfilled=False)
 
+    def get_in_timeframe(self, start=None, end=None):
+        """
+        Returns all transfers in defined timeframe,
+        together with archived ones as for transactions
+        """
+        start = models.DateTimeField().to_python(start)
+        end = models.DateTimeField().to_python(end)
+        transfers = in_timeframe(self.all(), start, end)
+        cutoff = ArchiveRun.objects.get_cutoff()
+        if cutoff is None or (start and start >= cutoff):
+            return transfers
+        return ArchiveQuerySet(transfers, in_timeframe(ArchivedTransfer.objects.all(), start, end))
+
 
 class Transfer(models.Model):
     """Describes credit and debit on each transaction"""
@@ -152,9 +545,467 @@ class Transfer(models.Model):
     date = models.DateTimeField(auto_now_add=True)
     fulfilled = models.BooleanField(default=False)
     currency = models.CharField(max_length=3)
+    settlement = models.ForeignKey("SettlementBatch", null=True, blank=True,
+        related_name="transfers", on_delete=models.SET_NULL)
     objects = TransferManager()
 
     def __unicode__(self):
         return str(self.pk)
 
 
+class SettlementBatchManager(models.Manager):
+    """Manager to start or resume settlement of transfers"""
+
+    def get_or_start(self):
+        """
+        Get not finished settlement batch or start new one
+        for transfers unhandled at this moment.
+        Returns None if there is nothing to settle.
+        """
+        batch = self.filter(finished__isnull=True).order_by("id").first()
+        if batch:
+            return batch
+        bounds = Transfer.objects.get_unhandled().aggregate(
+            first=models.Min("id"), last=models.Max("id"))
+        if bounds["last"] is None:
+            return None
+        return self.create(
+            processed_transfer=bounds["first"] - 1,
+            last_transfer=bounds["last"]
+        )
+
+
+class SettlementBatch(models.Model):
+    """
+    Settlement of unhandled transfers with id up to 'last_transfer'.
+    Transfers are settled in chunks, 'processed_transfer' is the last
+    id of settled chunk.
+    """
+    processed_transfer = models.IntegerField(default=0)
+    last_transfer = models.IntegerField()
+    started = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    objects = SettlementBatchManager()
+
+    def settle_chunk(self, size):
+        """
+        Mark next chunk of transfers as fulfilled and add
+        their credit and debit to the totals of batch
+        """
+        end = min(self.processed_transfer + size, self.last_transfer)
+        with transaction.atomic():
+            Transfer.objects.get_unhandled().filter(
+                id__gt=self.processed_transfer,
+                id__lte=end
+            ).update(fulfilled=True, settlement=self)
+            sums = self.transfers.filter(id__gt=self.processed_transfer, id__lte=end).\
+                values("currency").\
+                annotate(credit=models.Sum("credit"), debit=models.Sum("debit")).\
+                order_by()
+            for row in sums:
+                total, _ = self.totals.get_or_create(currency=row["currency"])
+                self.totals.filter(pk=total.pk).update(
+                    credit=models.F("credit") + row["credit"],
+                    debit=models.F("debit") + row["debit"]
+                )
+            self.processed_transfer = end
+            if end == self.last_transfer:
+                self.finished = timezone.now()
+            self.save(update_fields=["processed_transfer", "finished"])
+
+    def __unicode__(self):
+        return str(self.pk)
+
+
+class SettlementTotal(models.Model):
+    """Sum of settled credit and debit in one currency"""
+    batch = models.ForeignKey(SettlementBatch, related_name="totals")
+    currency = models.CharField(max_length=3)
+    credit = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    debit = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ("batch", "currency")
+
+    def revenue(self):
+        return self.debit - self.credit
+
+    def __unicode__(self):
+        return "{} {}".format(self.batch_id, self.currency)
+
+
+class BalanceCheckpointManager(models.Manager):
+    """Manager to take and look up balance checkpoints"""
+
+    def take(self, account):
+        """
+        Save current 'balance' and 'on_hold' of account
+        together with id of the last transaction on it
+        """
+        with transaction.atomic():
+            account = Account.objects.select_for_update().get(card_id=account.card_id)
+            balance, on_hold = account.funds(lock=True)
+            last = account.transactions.aggregate(last=models.Max("id"))["last"]
+            return self.create(
+                account=account,
+                balance=balance,
+                on_hold=on_hold,
+                last_transaction=last or 0
+            )
+
+    def get_nearest(self, timestamp):
+        """
+        Get the earliest checkpoint taken at or after timestamp
+        """
+        timestamp = models.DateTimeField().to_python(timestamp)
+        return self.filter(date__gte=timestamp).order_by("date", "id").first()
+
+
+class BalanceCheckpoint(models.Model):
+    """
+    Snapshot of account funds after all transactions
+    with id up to 'last_transaction'
+    """
+    account = models.ForeignKey(Account, related_name="checkpoints", to_field="card_id")
+    balance = models.DecimalField(max_digits=11, decimal_places=2)
+    on_hold = models.DecimalField(max_digits=11, decimal_places=2)
+    last_transaction = models.IntegerField(default=0)
+    date = models.DateTimeField(auto_now_add=True)
+    objects = BalanceCheckpointManager()
+
+    class Meta:
+        indexes = [models.Index(fields=["account", "date"], name="issuer_checkpoint_date")]
+
+    def __unicode__(self):
+        return self.account_id + self.date.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+HOUR = "hour"
+DAY = "day"
+PERIOD_CHOICES = [(HOUR, HOUR), (DAY, DAY)]
+
+
+def get_bucket(date, period):
+    """Start of hourly or daily bucket of date"""
+    date = date.replace(minute=0, second=0, microsecond=0)
+    if period == DAY:
+        date = date.replace(hour=0)
+    return date
+
+
+class VolumeRollupManager(models.Manager):
+    """Manager to add transactions to rollups"""
+
+    def add(self, transactions):
+        """
+        Add volumes of transactions to their hourly and daily buckets
+        with one update (or insert) per bucket
+        """
+        volumes = {}
+        for tr in transactions:
+            for period in (HOUR, DAY):
+                key = (period, get_bucket(tr.date, period), tr.card_id_id, tr.type, tr.billing_currency)
+                volume = volumes.setdefault(key, [0, Decimal(0), Decimal(0)])
+                volume[0] += 1
+                volume[1] += Decimal(tr.billing_amount)
+                volume[2] += Decimal(tr.settlement_amount)
+        with transaction.atomic():
+            for (period, bucket, card_id, tr_type, currency), (count, billing, settlement) in volumes.items():
+                rollup, _ = self.get_or_create(period=period, bucket=bucket,
+                    card_id=card_id, type=tr_type, currency=currency)
+                self.filter(pk=rollup.pk).update(
+                    count=models.F("count") + count,
+                    billing_amount=models.F("billing_amount") + billing,
+                    settlement_amount=models.F("settlement_amount") + settlement
+                )
+
+
+class VolumeRollup(models.Model):
+    """
+    Number and amounts of transactions of card, type and
+    billing currency in hourly or daily bucket
+    """
+    period = models.CharField(choices=PERIOD_CHOICES, max_length=4)
+    bucket = models.DateTimeField()
+    card = models.ForeignKey(Account, related_name="volumes", to_field="card_id")
+    type = models.CharField(choices=TRANSACTION_CHOICES, max_length=100)
+    currency = models.CharField(max_length=3)
+    count = models.IntegerField(default=0)
+    billing_amount = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    settlement_amount = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    objects = VolumeRollupManager()
+
+    class Meta:
+        unique_together = ("period", "bucket", "card", "type", "currency")
+        indexes = [models.Index(fields=["period", "bucket"], name="issuer_rollup_period_bucket")]
+
+    def __unicode__(self):
+        return "{} {} {}".format(self.period, self.bucket, self.card_id)
+
+
+class RollupCursor(models.Model):
+    """
+    Id of the last transaction handled by cursor 'name',
+    added to rollups by 'rollup_transactions' or checked
+    for checkpoints by 'calculate'
+    """
+    name = models.CharField(max_length=100, unique=True)
+    last_transaction = models.IntegerField(default=0)
+
+    def __unicode__(self):
+        return self.name
+
+
+class Descending(object):
+    """Value which sorts in reverse order"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __ne__(self, other):
+        return self.value != other.value
+
+    def __lt__(self, other):
+        return self.value > other.value
+
+    def __gt__(self, other):
+        return self.value < other.value
+
+
+class ArchiveQuerySet(object):
+    """
+    Live and archived transactions read as one queryset.
+    Supports filtering, ordering, values_list, slicing and iteration,
+    ordered results of both querysets are merged on the fly.
+    """
+
+    def __init__(self, live, archived, ordering=(), fields=None, flat=False):
+        self.live = live
+        self.archived = archived
+        self.ordering = ordering
+        self.fields = fields
+        self.flat = flat
+
+    def _clone(self, live, archived, **kwargs):
+        options = dict(ordering=self.ordering, fields=self.fields, flat=self.flat)
+        options.update(kwargs)
+        return ArchiveQuerySet(live, archived, **options)
+
+    def filter(self, *args, **kwargs):
+        return self._clone(self.live.filter(*args, **kwargs), self.archived.filter(*args, **kwargs))
+
+    def exclude(self, *args, **kwargs):
+        return self._clone(self.live.exclude(*args, **kwargs), self.archived.exclude(*args, **kwargs))
+
+    def order_by(self, *fields):
+        return self._clone(self.live.order_by(*fields), self.archived.order_by(*fields), ordering=fields)
+
+    def values_list(self, *fields, **kwargs):
+        names = [name.lstrip("-") for name in self.ordering]
+        if any(name not in fields for name in names):
+            raise ValueError("Ordering fields should be selected: {}".format(", ".join(names)))
+        return self._clone(
+            self.live.values_list(*fields, **kwargs),
+            self.archived.values_list(*fields, **kwargs),
+            fields=fields,
+            flat=kwargs.get("flat", False)
+        )
+
+    def get_key(self, item):
+        key = []
+        for name in self.ordering:
+            field = name.lstrip("-")
+            if self.fields is None:
+                value = getattr(item, field)
+            elif self.flat:
+                value = item
+            else:
+                value = item[self.fields.index(field)]
+            key.append(Descending(value) if name.startswith("-") else value)
+        return tuple(key)
+
+    def merge(self, live, archived):
+        if not self.ordering:
+            return chain(archived, live)
+        sources = [
+            ((self.get_key(item), source, number, item) for number, item in enumerate(items))
+            for source, items in enumerate([archived, live])
+        ]
+        return (item for _, _, _, item in heapq.merge(*sources))
+
+    def iterator(self):
+        return self.merge(self.live.iterator(), self.archived.iterator())
+
+    def __iter__(self):
+        return self.merge(iter(self.live), iter(self.archived))
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        if index.step is not None:
+            raise ValueError("Step is not supported")
+        live, archived = self.live, self.archived
+        if index.stop is not None:
+            live, archived = live[:index.stop], archived[:index.stop]
+        return list(islice(self.merge(iter(live), iter(archived)), index.start, index.stop))
+
+    def count(self):
+        return self.live.count() + self.archived.count()
+
+    def __len__(self):
+        return self.count()
+
+    def exists(self):
+        return self.live.exists() or self.archived.exists()
+
+
+def get_month(date):
+    return date.date().replace(day=1)
+
+
+class ArchivedTransaction(models.Model):
+    """
+    Transaction moved out of live table by 'archive_transactions',
+    keeps its id and is partitioned by 'month' of its date
+    """
+    id = models.IntegerField(primary_key=True)
+    transaction_id = models.CharField(max_length=100)
+    type = models.CharField(choices=TRANSACTION_CHOICES, max_length=100)
+    card_id = models.ForeignKey(Account, related_name="archived_transactions", to_field="card_id")
+    billing_amount = models.DecimalField(max_digits=11, decimal_places=2)
+    billing_currency = models.CharField(max_length=3)
+    transaction_amount = models.DecimalField(max_digits=11, decimal_places=2)
+    transaction_currency = models.CharField(max_length=3)
+    settlement_amount = models.DecimalField(max_digits=11, decimal_places=2, default=0.00)
+    settlement_currency = models.CharField(max_length=3, default="")
+    date = models.DateTimeField()
+    authorisation = models.IntegerField(null=True, blank=True, db_column="authorisation_id")
+    settled_amount = models.DecimalField(max_digits=11, decimal_places=2, default=0.00)
+    stripe = models.PositiveSmallIntegerField(null=True, blank=True)
+    expired = models.DateTimeField(null=True, blank=True)
+    sequence = models.PositiveSmallIntegerField(default=0)
+    month = models.DateField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["card_id", "date"], name="issuer_archive_card_date"),
+            models.Index(fields=["month"], name="issuer_archive_month"),
+        ]
+
+    def __unicode__(self):
+        return self.transaction_id + self.type + self.date.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+class ArchivedTransfer(models.Model):
+    """Fulfilled transfer moved out of live table, partitioned by 'month'"""
+    id = models.IntegerField(primary_key=True)
+    credit = models.DecimalField(max_digits=11, decimal_places=2)
+    debit = models.DecimalField(max_digits=11, decimal_places=2)
+    date = models.DateTimeField()
+    fulfilled = models.BooleanField(default=True)
+    currency = models.CharField(max_length=3)
+    settlement = models.IntegerField(null=True, blank=True, db_column="settlement_id")
+    month = models.DateField(db_index=True)
+
+    def __unicode__(self):
+        return str(self.pk)
+
+
+# Cached cutoff of archive as [expires, cutoff]
+_cutoff = [0, None]
+
+
+class ArchiveRunManager(models.Manager):
+    """Manager to start archive runs and get cutoff of archive"""
+
+    def get_cutoff(self):
+        """
+        Get cutoff of the latest archive run, None if nothing is archived.
+        Cutoff is cached for ISSUER_ARCHIVE_CUTOFF_TTL seconds, archive run
+        waits as long before moving transactions.
+        """
+        now = time.time()
+        if _cutoff[0] <= now:
+            _cutoff[1] = self.aggregate(cutoff=models.Max("cutoff"))["cutoff"]
+            _cutoff[0] = now + settings.ISSUER_ARCHIVE_CUTOFF_TTL
+        return _cutoff[1]
+
+    def start(self, cutoff):
+        """
+        Start archive run, cutoff can not move back
+        """
+        previous = self.aggregate(cutoff=models.Max("cutoff"))["cutoff"]
+        if previous and cutoff < previous:
+            raise ValueError("Cutoff {} is earlier than archived {}".format(cutoff, previous))
+        run = self.create(cutoff=cutoff)
+        reset_cutoff()
+        return run
+
+
+class ArchiveRun(models.Model):
+    """
+    Move of transactions older than 'cutoff' and fulfilled transfers
+    into archive, with number of moved rows
+    """
+    cutoff = models.DateTimeField(db_index=True)
+    started = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    transactions = models.IntegerField(default=0)
+    transfers = models.IntegerField(default=0)
+    objects = ArchiveRunManager()
+
+    def archive_transactions(self, ids):
+        """
+        Move transactions with ids into archive, returns their number
+        """
+        with transaction.atomic():
+            rows = list(Transaction.objects.filter(id__in=ids))
+            ArchivedTransaction.objects.bulk_create([ArchivedTransaction(
+                month=get_month(tr.date),
+                authorisation=tr.authorisation_id,
+                **dict((field.attname, getattr(tr, field.attname))
+                    for field in Transaction._meta.concrete_fields if field.name != "authorisation")
+            ) for tr in rows])
+            Transaction.objects.filter(id__in=ids).delete()
+            ArchiveRun.objects.filter(pk=self.pk).update(transactions=models.F("transactions") + len(rows))
+        return len(rows)
+
+    def archive_transfers(self, ids):
+        """
+        Move transfers with ids into archive, returns their number
+        """
+        with transaction.atomic():
+            rows = list(Transfer.objects.filter(id__in=ids))
+            ArchivedTransfer.objects.bulk_create([ArchivedTransfer(
+                id=tr.id, credit=tr.credit, debit=tr.debit, date=tr.date, fulfilled=tr.fulfilled,
+                currency=tr.currency, settlement=tr.settlement_id, month=get_month(tr.date)
+            ) for tr in rows])
+            Transfer.objects.filter(id__in=ids).delete()
+            ArchiveRun.objects.filter(pk=self.pk).update(transfers=models.F("transfers") + len(rows))
+        return len(rows)
+
+    def __unicode__(self):
+        return "{} {}".format(self.pk, self.cutoff)
+
+
+def reset_cutoff(**kwargs):
+    if kwargs.get("setting", "ISSUER_ARCHIVE_CUTOFF_TTL") == "ISSUER_ARCHIVE_CUTOFF_TTL":
+        _cutoff[0] = 0
+
+
+setting_changed.connect(reset_cutoff)
+
+
+class EngineCheckpoint(models.Model):
+    """
+    Sequence number of the last entry of authorisation engine
+    log which is saved in database (see issuer.engine)
+    """
+    name = models.CharField(max_length=100, unique=True)
+    sequence = models.BigIntegerField(default=0)
+
+    def __unicode__(self):
+        return "{} {}".format(self.name, self.sequence)
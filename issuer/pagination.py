@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import base64
+import binascii
+from django.conf import settings
+from django.db.models import DateTimeField, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+
+
+def encode_cursor(date, pk):
+    """Make opaque cursor from (date, id) of the last item on page"""
+    position = "{}|{}".format(date.isoformat(), pk)
+    return base64.urlsafe_b64encode(position.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """Get (date, id) from cursor made by 'encode_cursor'"""
+    try:
+        position = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        date, pk = position.rsplit("|", 1)
+        date = DateTimeField().to_python(date)
+        pk = int(pk)
+    except (TypeError, ValueError, UnicodeError, binascii.Error):
+        raise NotFound("Invalid cursor")
+    if date is None:
+        raise NotFound("Invalid cursor")
+    return date, pk
+
+
+class KeysetPagination(object):
+    """
+    Cursor pagination on (date, id) of transactions.
+    Page is selected by index range instead of offset, so
+    any page costs the same regardless of its position.
+    """
+    page_size_query_param = "page_size"
+    cursor_query_param = "cursor"
+
+    def __init__(self):
+        self.page_size = settings.ISSUER_PAGE_SIZE
+        self.max_page_size = settings.ISSUER_MAX_PAGE_SIZE
+        self.next_cursor = None
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size < 1:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def paginate_queryset(self, queryset, request):
+        """
+        Returns list of transactions on requested page
+        """
+        page_size = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            date, pk = decode_cursor(cursor)
+            queryset = queryset.filter(Q(date__gt=date) | Q(date=date, id__gt=pk))
+        page = list(queryset.order_by("date", "id")[:page_size + 1])
+        if len(page) > page_size:
+            page = page[:page_size]
+            self.next_cursor = encode_cursor(page[-1].date, page[-1].pk)
+        return page
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.next_cursor, "results": data})
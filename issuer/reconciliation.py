@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import heapq
+import io
+import json
+import logging
+import tempfile
+from collections import OrderedDict
+from decimal import Decimal, InvalidOperation
+from itertools import groupby, islice
+from django.db.models import Q
+from issuer.batch import CHUNK_SIZE
+from issuer.models import Transaction, PRESENTMENT
+
+logger = logging.getLogger('fintech.issuer.reconciliation')
+
+# Fields of clearing file records, amount and currency are settlement ones
+FIELDS = ("transaction_id", "card_id", "amount", "currency")
+
+REPORTS = ("matched", "missing", "extra", "mismatch", "rejects")
+
+RUN_SIZE = 100000
+
+
+def clean(record):
+    """
+    Validated (transaction_id, card_id, amount, currency) of record,
+    raises ValueError with reason of rejection
+    """
+    if not isinstance(record, dict) or any(field not in record for field in FIELDS):
+        raise ValueError("Expected fields: {}".format(", ".join(FIELDS)))
+    transaction_id = "{}".format(record["transaction_id"]).strip()
+    card_id = "{}".format(record["card_id"]).strip()
+    if not transaction_id or not card_id:
+        raise ValueError("Invalid transaction or card id")
+    try:
+        amount = Decimal("{}".format(record["amount"]).strip())
+    except InvalidOperation:
+        raise ValueError("Invalid amount")
+    if not amount.is_finite():
+        raise ValueError("Invalid amount")
+    return transaction_id, card_id, amount, "{}".format(record["currency"]).strip()
+
+
+def read_run(run):
+    for line in run:
+        transaction_id, card_id, amount, currency = json.loads(line.decode("utf-8"))
+        yield transaction_id, card_id, Decimal(amount), currency
+
+
+def sort_records(records, run_size=RUN_SIZE, directory=None):
+    """
+    Sort cleaned records by (transaction_id, card_id) externally:
+    runs of 'run_size' records are sorted in memory and written
+    to temporary files, which are merged while read
+    """
+    runs = []
+    records = iter(records)
+    try:
+        while True:
+            run = sorted(islice(records, run_size))
+            if not run:
+                break
+            stream = tempfile.TemporaryFile(dir=directory)
+            for record in run:
+                stream.write(json.dumps([record[0], record[1], "{}".format(record[2]), record[3]]).
+                    encode("utf-8") + b"\n")
+            stream.seek(0)
+            runs.append(stream)
+        logger.info("Sorted clearing records in %s runs", len(runs))
+        for record in heapq.merge(*[read_run(stream) for stream in runs]):
+            yield record
+    finally:
+        for stream in runs:
+            stream.close()
+
+
+def check_order(records, name="Records"):
+    """
+    Pass through records which should be already sorted,
+    raises ValueError at the first one out of order
+    """
+    previous = None
+    for number, record in enumerate(records, 1):
+        if previous is not None and record[:2] < previous:
+            raise ValueError("{} are not sorted by transaction and card id at record {}".format(name, number))
+        previous = record[:2]
+        yield record
+
+
+class Reconciliation(object):
+    """
+    Merge-join of clearing records sorted by (transaction_id, card_id)
+    with presentments read in chunks of the same order, records
+    and partial presentments of one transaction and card are matched
+    in any order.
+    Every outcome is passed to 'report' callable as (name, record):
+    matched, missing (presentment is not in file), extra (record
+    without presentment), mismatch (settlement amount or currency
+    differ) and rejects (invalid records).
+    Ids are compared as strings, so database should order them
+    the same way (binary collation), otherwise run fails.
+    """
+
+    def __init__(self, report, chunk_size=CHUNK_SIZE, run_size=RUN_SIZE):
+        self.report = report
+        self.chunk_size = chunk_size
+        self.run_size = run_size
+        self.counts = OrderedDict((name, 0) for name in REPORTS)
+
+    def emit(self, name, record):
+        self.counts[name] += 1
+        self.report(name, record)
+
+    def clean(self, records):
+        for number, record in records:
+            try:
+                yield clean(record)
+            except ValueError as error:
+                self.emit("rejects", {"line": number, "record": record, "error": "{}".format(error)})
+
+    def presentments(self, start=None, end=None):
+        """
+        (transaction_id, card_id, settlement amount, currency) of presentments
+        in timeframe, read in chunks ordered by transaction and card id,
+        partial presentments of one authorisation by their sequence
+        """
+        presentments = Transaction.objects.get_in_timeframe(start, end).\
+            filter(type=PRESENTMENT).order_by("transaction_id", "card_id", "sequence")
+        last = None
+        while True:
+            chunk = presentments
+            if last is not None:
+                chunk = chunk.filter(Q(transaction_id__gt=last[0]) | Q(transaction_id=last[0], card_id__gt=last[1]) |
+                    Q(transaction_id=last[0], card_id=last[1], sequence__gt=last[4]))
+            rows = list(chunk.values_list("transaction_id", "card_id",
+                "settlement_amount", "settlement_currency", "sequence")[:self.chunk_size])
+            for row in rows:
+                yield row[:4]
+            if len(rows) < self.chunk_size:
+                return
+            last = rows[-1]
+
+    def run(self, records, start=None, end=None, is_sorted=False):
+        """
+        Reconcile (line number, record) pairs of clearing file
+        with presentments saved from 'start' till 'end'
+        """
+        records = self.clean(records)
+        records = check_order(records) if is_sorted else sort_records(records, self.run_size)
+        rows = check_order(self.presentments(start, end), "Presentments")
+        records = groupby(records, key=lambda record: record[:2])
+        rows = groupby(rows, key=lambda row: row[:2])
+        record = next(records, None)
+        row = next(rows, None)
+        while record is not None or row is not None:
+            if row is None or (record is not None and record[0] < row[0]):
+                for item in record[1]:
+                    self.emit("extra", self.describe(item, None))
+                record = next(records, None)
+            elif record is None or row[0] < record[0]:
+                for item in row[1]:
+                    self.emit("missing", self.describe(None, item))
+                row = next(rows, None)
+            else:
+                self.match(list(record[1]), list(row[1]))
+                record = next(records, None)
+                row = next(rows, None)
+        return self.counts
+
+    def match(self, records, rows):
+        """
+        Match records with presentments of one transaction and card
+        in any order, equal amount and currency first
+        """
+        unmatched = []
+        for record in records:
+            for index, row in enumerate(rows):
+                if record[2:] == row[2:]:
+                    self.emit("matched", self.describe(record, rows.pop(index)))
+                    break
+            else:
+                unmatched.append(record)
+        for record, row in zip(unmatched, rows):
+            self.emit("mismatch", self.describe(record, row))
+        for record in unmatched[len(rows):]:
+            self.emit("extra", self.describe(record, None))
+        for row in rows[len(unmatched):]:
+            self.emit("missing", self.describe(None, row))
+
+    def describe(self, record, row):
+        item = OrderedDict([("transaction_id", (record or row)[0]), ("card_id", (record or row)[1])])
+        if record is not None:
+            item["amount"] = "{}".format(record[2])
+            item["currency"] = record[3]
+        if row is not None:
+            item["settlement_amount"] = "{}".format(row[2])
+            item["settlement_currency"] = row[3]
+        return item
+
+
+class ReportFiles(object):
+    """Writes every report into '<prefix>.<name>.jsonl' file"""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.files = {}
+
+    def path(self, name):
+        return "{}.{}.jsonl".format(self.prefix, name)
+
+    def __call__(self, name, record):
+        if name not in self.files:
+            self.files[name] = io.open(self.path(name), "w", encoding="utf-8")
+        self.files[name].write("{}\n".format(json.dumps(record)))
+
+    def close(self):
+        for stream in self.files.values():
+            stream.close()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import threading
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from issuer.cache import DjangoCacheBackend
+
+_state = threading.local()
+_writes = None
+
+
+def recent_writes():
+    """
+    Cards written in the last ISSUER_READ_YOUR_WRITES seconds, kept in
+    default django cache to be seen by all processes sharing it.
+    Raises ImproperlyConfigured if replica is used with cache
+    local to process.
+    """
+    global _writes
+    if _writes is None:
+        writes = DjangoCacheBackend(timeout=settings.ISSUER_READ_YOUR_WRITES, max_entries=None,
+            key_prefix="issuer:write:")
+        if settings.ISSUER_REPLICA_DATABASE and not writes.shared:
+            raise ImproperlyConfigured("ISSUER_REPLICA_DATABASE needs default cache shared by processes")
+        _writes = writes
+    return _writes
+
+
+def note_write(card_id):
+    """
+    Send reads of card to primary database for a while,
+    the window starts again when write is committed
+    """
+    if not settings.ISSUER_REPLICA_DATABASE:
+        return
+    recent_writes().set(card_id, True)
+    transaction.on_commit(lambda: recent_writes().set(card_id, True))
+
+
+@contextmanager
+def use_replica(*card_ids):
+    """
+    Read from replica database inside the block, unless
+    one of 'card_ids' was written recently
+    """
+    previous = getattr(_state, "cards", None)
+    _state.cards = card_ids
+    try:
+        yield
+    finally:
+        _state.cards = previous
+
+
+def replica_iterator(iterable, *card_ids):
+    """
+    Iterate in 'use_replica' block, for streamed responses
+    which are read after view returned
+    """
+    with use_replica(*card_ids):
+        for item in iterable:
+            yield item
+
+
+class ReplicaRouter(object):
+    """
+    Sends reads inside 'use_replica' blocks to ISSUER_REPLICA_DATABASE,
+    everything else goes to default database
+    """
+
+    def db_for_read(self, model, **hints):
+        cards = getattr(_state, "cards", None)
+        alias = settings.ISSUER_REPLICA_DATABASE
+        if cards is None or not alias:
+            return None
+        if cards and recent_writes().get_many(cards):
+            return None
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != settings.ISSUER_REPLICA_DATABASE
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    Let readers work while SQLite database is written,
+    with ISSUER_SQLITE_WAL setting
+    """
+    if connection.vendor == "sqlite" and settings.ISSUER_SQLITE_WAL:
+        cursor = connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+
+
+def reset(**kwargs):
+    global _writes
+    if kwargs.get("setting", "ISSUER_READ_YOUR_WRITES") in \
+            ("ISSUER_READ_YOUR_WRITES", "ISSUER_REPLICA_DATABASE", "CACHES"):
+        _writes = None
+
+
+setting_changed.connect(reset)
+connection_created.connect(configure_sqlite)
@@ -1,36 +1,95 @@
+from django.conf import settings
 from rest_framework import serializers, fields
-from issuer.models import Transaction, Account, AUTHORISATION, PRESENTMENT
+from issuer import velocity
+from issuer.models import Transaction, AUTHORISATION, PRESENTMENT
 from decimal import Decimal
 
 
+def check_sequence(data):
+    """Only presentments are numbered, authorisation is one per transaction"""
+    if data.get("type", AUTHORISATION) == AUTHORISATION and data.get("sequence"):
+        raise serializers.ValidationError("Authorisation can not have sequence number")
+
+
 class TransactionSerializer(serializers.ModelSerializer):
+    # Velocity reservation of validated authorisation (see issuer.velocity)
+    reservation = None
+
     class Meta:
         model = Transaction
         fields = "__all__"
-        read_only_field = ("id",)
+        read_only_fields = ("id", "authorisation", "settled_amount", "stripe", "expired")
     
     def validate(self, data):
-        if data.get("type") == AUTHORISATION:
-            if not Account.objects.\
-            get(card_id=data.get("card_id")).\
-            check_funds(data.get("billing_amount")):
-                raise serializers.ValidationError("No sufficient funds")
-        else:
-            if not Transaction.objects.filter(
-                transaction_id=data.get("transaction_id"), 
-                type=AUTHORISATION, 
-                card_id=data.get("card_id")
-            ):
+        """
+        Funds of authorisation are checked when they are put on hold,
+        velocity limits are checked and reserved here, presentment
+        gets its authorisation resolved here
+        """
+        check_sequence(data)
+        if data.get("type") != AUTHORISATION:
+            try:
+                data["authorisation"] = Transaction.objects.get_authorisation(
+                    data.get("transaction_id"), data.get("card_id"))
+            except Transaction.DoesNotExist:
                 raise serializers.ValidationError("Not performed autorization for this transaction!")
+        else:
+            try:
+                self.reservation = velocity.check(data["card_id"].card_id, data["billing_amount"])
+            except velocity.VelocityLimitExceeded as error:
+                raise serializers.ValidationError("{}".format(error))
         return data
 
     def create(self, validated_data):
         return Transaction.objects.create(**validated_data)
 
 
+class BatchTransactionSerializer(TransactionSerializer):
+    """
+    Field-level validation of a transaction in batch.
+    Accounts, authorisations and duplicates are checked
+    for the whole batch at once (see issuer.batch)
+    """
+    card_id = serializers.CharField(max_length=100)
+
+    class Meta(TransactionSerializer.Meta):
+        validators = []
+
+    def validate(self, data):
+        check_sequence(data)
+        return data
+
+
 class BalanceSerializer(serializers.Serializer):
     """Simple serializer for balance requests"""
     ledger_balance = fields.DecimalField(11, 2)
     balance = fields.DecimalField(11, 2)
 
 
+class BalancePointSerializer(BalanceSerializer):
+    """Balance of account at point of time"""
+    time = fields.DateTimeField()
+
+
+class BalancesRequestSerializer(serializers.Serializer):
+    """Cards and optional point of time of bulk balance request"""
+    card_ids = fields.ListField(child=fields.CharField(max_length=100))
+    time = fields.DateTimeField(required=False)
+
+    def validate_card_ids(self, value):
+        if not value:
+            raise serializers.ValidationError("At least one card id is required")
+        if len(value) > settings.ISSUER_MAX_BULK_BALANCES:
+            raise serializers.ValidationError(
+                "At most {} card ids are allowed".format(settings.ISSUER_MAX_BULK_BALANCES))
+        return value
+
+
+class VolumeSerializer(serializers.Serializer):
+    """Volume of transactions of one type and currency, in bucket if it is given"""
+    bucket = fields.DateTimeField(required=False)
+    type = fields.CharField()
+    currency = fields.CharField()
+    count = fields.IntegerField()
+    billing_amount = fields.DecimalField(15, 2)
+    settlement_amount = fields.DecimalField(15, 2)
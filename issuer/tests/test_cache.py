@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import shutil
+import tempfile
+import time
+from rest_framework.test import APIClient
+from rest_framework import status
+from django.core.management import call_command
+from django.test import TestCase, SimpleTestCase, override_settings
+from issuer import cache
+from issuer.cache import DjangoCacheBackend, LocMemBackend
+from issuer.models import Account, Transaction
+
+
+class LocMemBackendTests(SimpleTestCase):
+    """Tests for in-memory cache backend"""
+
+    def test_lru(self):
+        backend = LocMemBackend(timeout=60, max_entries=2)
+        backend.set("a", 1)
+        backend.set("b", 2)
+        backend.get("a")
+        backend.set("c", 3)
+        self.assertEqual(backend.get("a"), 1)
+        self.assertIsNone(backend.get("b"))
+        self.assertEqual(backend.get("c"), 3)
+
+    def test_timeout(self):
+        backend = LocMemBackend(timeout=0.01, max_entries=2)
+        backend.set("a", 1)
+        time.sleep(0.02)
+        self.assertIsNone(backend.get("a"))
+
+
+@override_settings(ISSUER_BALANCE_CACHE={"BACKEND": "issuer.cache.LocMemBackend", "TIMEOUT": 5, "MAX_ENTRIES": 100})
+class BalanceCacheTests(TestCase):
+    """Tests for cached current balance"""
+    @classmethod
+    def setUpTestData(cls):
+        Account.objects.create(card_id="1234LOBO",
+            balance=100,
+            on_hold=0,
+            currency="EUR"
+        )
+
+    def setUp(self):
+        cache.reset()
+        cache.balances().backend.clear()
+        self.client = APIClient()
+
+    def test_balance(self):
+        r = self.client.get('/accounts/1234LOBO/balance')
+        self.assertEqual(r.data, {"balance": "100.00", "ledger_balance": "100.00"})
+        with self.assertNumQueries(0):
+            r = self.client.get('/accounts/1234LOBO/balance')
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        self.assertEqual(cache.balances().stats(), {"hits": 1, "misses": 1})
+        r = self.client.get('/accounts/4321LOBO/balance')
+        self.assertEqual(r.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_invalidation(self):
+        self.client.get('/accounts/1234LOBO/balance')
+        Transaction.objects.create(
+            type="authorisation",
+            card_id=Account.objects.get(card_id="1234LOBO"),
+            transaction_id="1237ZORRO",
+            billing_amount="9.00",
+            billing_currency="EUR",
+            transaction_amount="10.00",
+            transaction_currency="USD"
+        )
+        r = self.client.get('/accounts/1234LOBO/balance')
+        self.assertEqual(r.data, {"balance": "100.00", "ledger_balance": "91.00"})
+        call_command("load_money", "1234LOBO", "10", "EUR")
+        r = self.client.get('/accounts/1234LOBO/balance')
+        self.assertEqual(r.data, {"balance": "110.00", "ledger_balance": "101.00"})
+
+    def test_invalidation_during_load(self):
+        """Balance loaded before concurrent invalidation is not used"""
+        balances = cache.balances()
+
+        def load():
+            balances.invalidate("1234LOBO")
+            return {"balance": 0}
+        balances.get("1234LOBO", load)
+        self.assertEqual(balances.get("1234LOBO", lambda: {"balance": 1}), {"balance": 1})
+        self.assertEqual(balances.get("1234LOBO", lambda: {"balance": 2}), {"balance": 1})
+
+
+class DjangoCacheBackendTests(TestCase):
+    """Tests for balance cache in django CACHES"""
+    @classmethod
+    def setUpTestData(cls):
+        Account.objects.create(card_id="1234LOBO", balance=100, currency="EUR")
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_local_cache(self):
+        """Nothing is cached in cache of one process"""
+        with override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}):
+            self.client.get('/accounts/1234LOBO/balance')
+            with self.assertNumQueries(1):
+                r = self.client.get('/accounts/1234LOBO/balance')
+            self.assertEqual(r.data, {"balance": "100.00", "ledger_balance": "100.00"})
+
+    def test_shared_cache(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        with override_settings(CACHES={"default": {
+                "BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": folder}}):
+            self.client.get('/accounts/1234LOBO/balance')
+            with self.assertNumQueries(0):
+                self.client.get('/accounts/1234LOBO/balance')
+            other = DjangoCacheBackend(timeout=5, max_entries=None)
+            other.set("generation:1234LOBO", "other")
+            with self.assertNumQueries(1):
+                self.client.get('/accounts/1234LOBO/balance')
+
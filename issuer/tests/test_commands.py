@@ -1,10 +1,20 @@
 from datetime import datetime
 from decimal import Decimal
+from django.utils.six import StringIO
+import csv
+import gzip
+import json
+import os
+import shutil
+import tempfile
 import time
-from django.test import TestCase
-from django.core.management import call_command
-from issuer.models import Account, Transaction, Transfer
+from django.test import TestCase, override_settings
+from django.core.management import call_command, CommandError
+from django.utils.timezone import utc
+from issuer.models import Account, ArchivedTransaction, ArchivedTransfer, BalanceCheckpoint, SettlementBatch, \
+    Transaction, Transfer, VolumeRollup
 from issuer.management.commands import calculate, load_money
+from issuer.reconciliation import Reconciliation
 
 class CommandsTests(TestCase):
     """Tests for custom commands"""
@@ -71,4 +81,279 @@ class CommandsTests(TestCase):
             0
         )
 
+    def test_calculate_resume(self):
+        """Test that calculate command resumes not finished settlement"""
+        for credit, debit, currency in [(8, 9, "EUR"), (4, 5, "EUR"), (1, 2, "USD")]:
+            Transfer.objects.create(credit=credit, debit=debit, currency=currency)
+        batch = SettlementBatch.objects.get_or_start()
+        batch.settle_chunk(1)
+        late = Transfer.objects.create(credit=1, debit=1, currency="EUR")
+        call_command("calculate", "--chunk-size", "1")
+        batch.refresh_from_db()
+        self.assertIsNotNone(batch.finished)
+        self.assertEqual(
+            [(t.currency, t.credit, t.debit) for t in batch.totals.order_by("currency")],
+            [("EUR", Decimal("12"), Decimal("14")), ("USD", Decimal("1"), Decimal("2"))]
+        )
+        self.assertEqual(list(Transfer.objects.get_unhandled()), [late])
+
+    def test_checkpoint_balances(self):
+        """Test for checkpoint_balances command"""
+        Transaction.objects.create(**self.authorize_data)
+        call_command("checkpoint_balances", "--min-transactions", "2", stdout=StringIO())
+        self.assertEqual(BalanceCheckpoint.objects.count(), 0)
+        call_command("checkpoint_balances", stdout=StringIO())
+        call_command("checkpoint_balances", stdout=StringIO())
+        checkpoint = BalanceCheckpoint.objects.get()
+        self.assertEqual(checkpoint.last_transaction, Transaction.objects.get().id)
+        self.assertEqual(checkpoint.on_hold, Decimal("9.00"))
+
+    @override_settings(ISSUER_CHECKPOINT_INTERVAL=2, ISSUER_CHECKPOINT_RETENTION=1)
+    def test_checkpoint_balances_new(self):
+        """Test for checkpoints of new transactions taken every 2 transactions"""
+        Transaction.objects.create(**self.authorize_data)
+        call_command("checkpoint_balances", "--new", stdout=StringIO())
+        self.assertEqual(BalanceCheckpoint.objects.count(), 0)
+        Transaction.objects.create(**self.presentment_data)
+        call_command("calculate", stdout=StringIO())
+        self.assertEqual(BalanceCheckpoint.objects.count(), 0)
+        call_command("checkpoint_balances", "--new", stdout=StringIO())
+        checkpoint = BalanceCheckpoint.objects.get()
+        self.assertEqual(checkpoint.balance, Decimal("91.00"))
+        self.assertEqual(checkpoint.on_hold, Decimal("0.00"))
+        BalanceCheckpoint.objects.filter(pk=checkpoint.pk).update(date=datetime(2017, 1, 1, tzinfo=utc))
+        call_command("checkpoint_balances", "--new", stdout=StringIO())
+        self.assertEqual(BalanceCheckpoint.objects.count(), 1)
+        BalanceCheckpoint.objects.take(Account.objects.get(card_id="1234LOBO"))
+        out = StringIO()
+        call_command("checkpoint_balances", "--new", stdout=out)
+        self.assertIn("Deleted 1 old checkpoints", out.getvalue())
+        self.assertEqual(BalanceCheckpoint.objects.get().last_transaction, checkpoint.last_transaction)
+        self.assertNotEqual(BalanceCheckpoint.objects.get().pk, checkpoint.pk)
+
+    def test_benchmark(self):
+        """Test for benchmark command with recorded traffic"""
+        stream = os.path.join(tempfile.mkdtemp(), "traffic.jsonl")
+        self.addCleanup(shutil.rmtree, os.path.dirname(stream))
+        call_command("benchmark", "--requests", "40", "--accounts", "2",
+            "--seed", "1", "--record", stream, stdout=StringIO())
+        out = StringIO()
+        call_command("benchmark", "--replay", stream, "--use-current-db", stdout=out)
+        self.assertIn("TransactionHandler", out.getvalue())
+        self.assertIn("Total 40 requests", out.getvalue())
+        self.assertEqual(Account.objects.filter(card_id__endswith="BENCH").count(), 2)
+
+    def test_load_money_file(self):
+        """Test for load_money command with CSV and JSONL files"""
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        csv_file = os.path.join(folder, "payroll.csv")
+        with open(csv_file, "w") as stream:
+            stream.write("card_id,amount,currency\n1234LOBO,10.50,EUR\n2000LOBO,5,USD\n"
+                "2000LOBO,1,USD\n1234LOBO,3,USD\n3000LOBO,abc,EUR\n3000LOBO\n")
+        jsonl_file = os.path.join(folder, "payroll.jsonl")
+        with open(jsonl_file, "w") as stream:
+            stream.write('{"card_id": "1234LOBO", "amount": "1.00", "currency": "EUR"}\nnot json\n')
+        out = StringIO()
+        call_command("load_money", "--file", csv_file, "--file", jsonl_file,
+            "--chunk-size", "2", stdout=out)
+        self.assertIn("6 rows, funded 2 accounts, created 1, rejected 3", out.getvalue())
+        self.assertEqual(Account.objects.get(card_id="1234LOBO").balance, Decimal("111.50"))
+        self.assertEqual(Account.objects.get(card_id="2000LOBO").balance, Decimal("6"))
+        self.assertEqual(Account.objects.get(card_id="2000LOBO").currency, "USD")
+        with open(csv_file + ".rejects") as stream:
+            self.assertEqual(
+                [json.loads(line)["line"] for line in stream],
+                [5, 6, 7]
+            )
+        with open(jsonl_file + ".rejects") as stream:
+            self.assertEqual(json.loads(stream.read())["error"], "Expected fields: card_id, amount, currency")
+
+    def test_rebalance_stripes(self):
+        """Test for rebalance_stripes command"""
+        call_command("rebalance_stripes", "--card", "1234LOBO", "--stripes", "3", stdout=StringIO())
+        account = Account.objects.get(card_id="1234LOBO")
+        self.assertEqual(account.stripe_count, 3)
+        self.assertEqual(account.balance, Decimal("0.01"))
+        call_command("load_money", "1234LOBO", "30", "EUR", stdout=StringIO())
+        call_command("rebalance_stripes", stdout=StringIO())
+        self.assertEqual(
+            sorted(account.stripes.values_list("balance", flat=True)),
+            [Decimal("43.33")] * 3
+        )
+        self.assertEqual(account.avaliable_balance(), Decimal("130"))
+
+    @override_settings(ISSUER_ROLLUP_LAG=0)
+    def test_rollup_transactions(self):
+        """Test for rollup_transactions command"""
+        Transaction.objects.create(**self.authorize_data)
+        with override_settings(ISSUER_ROLLUP_LAG=60):
+            call_command("rollup_transactions", stdout=StringIO())
+        self.assertEqual(VolumeRollup.objects.count(), 0)
+        call_command("rollup_transactions", stdout=StringIO())
+        Transaction.objects.create(**self.presentment_data)
+        call_command("rollup_transactions", "--chunk-size", "1", stdout=StringIO())
+        self.assertEqual(
+            sorted(VolumeRollup.objects.filter(period="day").values_list("type", "count", "billing_amount")),
+            [("authorisation", 1, Decimal("9")), ("presentment", 1, Decimal("9"))]
+        )
+        self.assertEqual(VolumeRollup.objects.filter(period="hour").count(), 2)
+
+    def test_reconcile(self):
+        """Test for reconcile command with sorted and unsorted files"""
+        for transaction_id in ["1237ZORRO", "1238ZORRO", "1239ZORRO"]:
+            self.authorize_data["transaction_id"] = self.presentment_data["transaction_id"] = transaction_id
+            Transaction.objects.create(**self.authorize_data)
+            Transaction.objects.create(**self.presentment_data)
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        clearing = os.path.join(folder, "clearing.csv")
+        with open(clearing, "w") as stream:
+            stream.write("transaction_id,card_id,amount,currency\n1240ZORRO,1234LOBO,1.00,EUR\n"
+                "1239ZORRO,1234LOBO,8.95,EUR\n1237ZORRO,1234LOBO,8.90,EUR\n1237ZORRO,1234LOBO\n")
+        out = StringIO()
+        call_command("reconcile", clearing, "--run-size", "2", "--chunk-size", "2", stdout=out)
+        self.assertIn("missing: 1, written to {}.missing.jsonl".format(clearing), out.getvalue())
+        reports = {}
+        for name in ["matched", "missing", "extra", "mismatch", "rejects"]:
+            with open("{}.{}.jsonl".format(clearing, name)) as stream:
+                reports[name] = [json.loads(line) for line in stream]
+        self.assertEqual([item["transaction_id"] for item in reports["matched"]], ["1239ZORRO"])
+        self.assertEqual([item["transaction_id"] for item in reports["missing"]], ["1238ZORRO"])
+        self.assertEqual([item["transaction_id"] for item in reports["extra"]], ["1240ZORRO"])
+        self.assertEqual(
+            [(item["amount"], item["settlement_amount"]) for item in reports["mismatch"]],
+            [("8.90", "8.95")]
+        )
+        self.assertEqual([item["line"] for item in reports["rejects"]], [5])
+        with self.assertRaises(CommandError):
+            call_command("reconcile", clearing, "--sorted", stdout=StringIO())
+
+    def test_reconcile_presentments_order(self):
+        """Reconciliation fails if database orders ids not as strings"""
+        reconciliation = Reconciliation(lambda name, record: None)
+        reconciliation.presentments = lambda start, end: iter([
+            ("1238ZORRO", "1234LOBO", Decimal("8.95"), "EUR"),
+            ("1237ZORRO", "1234LOBO", Decimal("8.95"), "EUR"),
+        ])
+        with self.assertRaises(ValueError):
+            reconciliation.run([], is_sorted=True)
+
+    def test_reconcile_partial_presentments(self):
+        """Partial presentments are matched in any order of amounts"""
+        reports = []
+        reconciliation = Reconciliation(lambda name, record: reports.append((name, record["amount"])))
+        reconciliation.presentments = lambda start, end: iter([
+            ("1237ZORRO", "1234LOBO", Decimal("5.00"), "EUR"),
+            ("1237ZORRO", "1234LOBO", Decimal("4.00"), "EUR"),
+        ])
+        records = [(1, {"transaction_id": "1237ZORRO", "card_id": "1234LOBO", "amount": amount, "currency": "EUR"})
+            for amount in ["5.00", "4.00", "3.00"]]
+        counts = reconciliation.run(records)
+        self.assertEqual((counts["matched"], counts["mismatch"], counts["extra"]), (2, 0, 1))
+        self.assertIn(("extra", "3.00"), reports)
 
+    @override_settings(ISSUER_HOLD_LIFETIME=3600)
+    def test_expire_holds(self):
+        """Test for expire_holds command"""
+        Transaction.objects.create(**self.authorize_data)
+        self.authorize_data["transaction_id"] = "1238ZORRO"
+        Transaction.objects.create(**self.authorize_data)
+        self.authorize_data["transaction_id"] = "1239ZORRO"
+        Transaction.objects.create(**self.authorize_data)
+        self.presentment_data["billing_amount"] = "4.00"
+        Transaction.objects.create(**self.presentment_data)
+        Transaction.objects.exclude(transaction_id="1239ZORRO").update(date=datetime(2017, 1, 1, tzinfo=utc))
+        self.assertEqual(Account.objects.get(card_id="1234LOBO").on_hold, Decimal("23.00"))
+        out = StringIO()
+        call_command("expire_holds", "--chunk-size", "1", stdout=out)
+        self.assertIn("Expired 2 authorisations", out.getvalue())
+        self.assertEqual(Account.objects.get(card_id="1234LOBO").on_hold, Decimal("9.00"))
+        self.assertEqual(
+            sorted(Transaction.objects.filter(expired__isnull=False).values_list("transaction_id", flat=True)),
+            ["1237ZORRO", "1238ZORRO"]
+        )
+        Transaction.objects.create(**dict(self.presentment_data, transaction_id="1238ZORRO", billing_amount="5.00"))
+        account = Account.objects.get(card_id="1234LOBO")
+        self.assertEqual((account.balance, account.on_hold), (Decimal("91.00"), Decimal("9.00")))
+        call_command("expire_holds", stdout=out)
+        self.assertIn("Expired 0 authorisations", out.getvalue())
+
+    def test_export_transactions(self):
+        """Test for export_transactions command in every format"""
+        Transaction.objects.create(**self.authorize_data)
+        Transaction.objects.create(**self.presentment_data)
+        self.authorize_data["transaction_id"] = "1238ZORRO"
+        Transaction.objects.create(**self.authorize_data)
+        Transaction.objects.filter(type="authorisation").update(date=datetime(2017, 1, 1, 23, tzinfo=utc))
+        Transaction.objects.filter(type="presentment").update(date=datetime(2017, 1, 2, tzinfo=utc))
+        Transfer.objects.update(date=datetime(2017, 1, 2, tzinfo=utc))
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        timeframe = ["--start", "2017-01-01T00:00:00Z", "--end", "2017-01-02T00:00:00Z"]
+        out = StringIO()
+        call_command("export_transactions", folder, "--chunk-size", "1", *timeframe, stdout=out)
+        self.assertIn("Exported 3 transactions", out.getvalue())
+        with gzip.open(os.path.join(folder, "transactions", "date=2017-01-01.csv.gz")) as stream:
+            rows = list(csv.reader(line.decode("utf-8") for line in stream))
+        self.assertEqual(rows[0][:3], ["id", "transaction_id", "type"])
+        self.assertEqual([row[1] for row in rows[1:]], ["1237ZORRO", "1238ZORRO"])
+        with gzip.open(os.path.join(folder, "transactions", "date=2017-01-02.csv.gz")) as stream:
+            self.assertEqual(len(stream.read().splitlines()), 2)
+
+        call_command("export_transactions", folder, "--format", "jsonl", "--partition", "card",
+            *timeframe, stdout=StringIO())
+        with gzip.open(os.path.join(folder, "transactions", "date=2017-01-02", "card_id=1234LOBO.jsonl.gz")) as stream:
+            row = json.loads(stream.read().decode("utf-8"))
+        self.assertEqual((row["type"], row["settlement_amount"]), ("presentment", "8.95"))
+
+        call_command("export_transactions", folder, "--format", "columns", "--table", "transfers",
+            *timeframe, stdout=StringIO())
+        with gzip.open(os.path.join(folder, "transfers", "date=2017-01-02", "credit.jsonl.gz")) as stream:
+            self.assertEqual([json.loads(line.decode("utf-8")) for line in stream], ["8.95"])
+        self.assertFalse(os.path.exists(os.path.join(folder, "transfers", "date=2017-01-01")))
+        with self.assertRaises(CommandError):
+            call_command("export_transactions", folder, "--table", "transfers", "--partition", "card",
+                *timeframe, stdout=StringIO())
+
+        out = StringIO()
+        call_command("export_transactions", folder, "--start", "2017-01-02", stdout=out)
+        self.assertIn("Exported 1 transactions", out.getvalue())
+
+    @override_settings(ISSUER_ARCHIVE_CUTOFF_TTL=0)
+    def test_archive_transactions(self):
+        """Test for archive_transactions command and reads of archive"""
+        Transaction.objects.create(**self.authorize_data)
+        Transaction.objects.create(**self.presentment_data)
+        self.authorize_data["transaction_id"] = "1238ZORRO"
+        Transaction.objects.create(**self.authorize_data)
+        call_command("calculate", stdout=StringIO())
+        Transaction.objects.update(date=datetime(2017, 1, 1, tzinfo=utc))
+        Transfer.objects.update(date=datetime(2017, 1, 1, tzinfo=utc))
+        Transaction.objects.filter(transaction_id="1238ZORRO").update(date=datetime(2017, 1, 2, tzinfo=utc))
+        call_command("archive_transactions", "--before", "2018-01-01T00:00:00Z", "--chunk-size", "1",
+            stdout=StringIO())
+        self.assertEqual(list(Transaction.objects.values_list("transaction_id", flat=True)), ["1238ZORRO"])
+        self.assertEqual(ArchivedTransaction.objects.count(), 2)
+        self.assertEqual(ArchivedTransfer.objects.count(), 1)
+        self.assertEqual(Transfer.objects.count(), 0)
+        account = Account.objects.get(card_id="1234LOBO")
+        self.assertEqual(len(account.transactions.get_in_timeframe(start="2017-01-01T00:00:00Z")), 3)
+        self.assertEqual(len(account.transactions.get_in_timeframe(start="2017-01-02T00:00:00Z")), 1)
+        self.assertEqual(
+            [(tr.transaction_id, tr.type) for tr in
+                account.transactions.get_in_timeframe().order_by("-date", "-id")],
+            [("1238ZORRO", "authorisation"), ("1237ZORRO", "presentment"), ("1237ZORRO", "authorisation")]
+        )
+        self.assertEqual(
+            account.get_balance_in_time("2016-12-31T00:00:00Z"),
+            {"balance": Decimal("100"), "ledger_balance": Decimal("100")}
+        )
+        response = self.client.get("/accounts/1234LOBO/transactions", {"page_size": 1})
+        self.assertEqual(response.data["results"][0]["transaction_id"], "1237ZORRO")
+        self.assertEqual(response.data["results"][0]["authorisation"],
+            ArchivedTransaction.objects.get(type="authorisation").id)
+        self.assertEqual(BalanceCheckpoint.objects.get().last_transaction,
+            Transaction.objects.get().id)
+        with self.assertRaises(CommandError):
+            call_command("archive_transactions", "--before", "2017-06-01T00:00:00Z", stdout=StringIO())
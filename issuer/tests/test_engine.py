@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import io
+import json
+import os
+import shutil
+import tempfile
+from decimal import Decimal
+from rest_framework.test import APIClient
+from rest_framework import status
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, override_settings
+from issuer.engine import AuthorisationEngine, get_engine
+from issuer.models import Account, EngineCheckpoint, InsufficientFunds, Transaction
+
+
+class AuthorisationEngineTests(TestCase):
+    """Tests for in-memory authorisation engine"""
+    @classmethod
+    def setUpTestData(cls):
+        Account.objects.create(card_id="1234LOBO", balance=100, currency="EUR")
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "engine.log")
+        self.engines = []
+
+    def tearDown(self):
+        for engine in self.engines:
+            engine.close()
+        shutil.rmtree(self.dir)
+
+    def get_engine(self):
+        engine = AuthorisationEngine(self.path).load()
+        self.engines.append(engine)
+        return engine
+
+    def authorisation(self, transaction_id, amount="9.00", card_id="1234LOBO"):
+        return {"card_id": card_id,
+            "transaction_id": transaction_id,
+            "billing_amount": Decimal(amount),
+            "billing_currency": "EUR",
+            "transaction_amount": Decimal("10.00"),
+            "transaction_currency": "USD"}
+
+    def test_authorize_in_memory(self):
+        engine = self.get_engine()
+        with self.assertNumQueries(0):
+            self.assertTrue(engine.authorize(self.authorisation("1")))
+            self.assertFalse(engine.authorize(self.authorisation("1")))
+        with io.open(self.path, "rb") as log:
+            entries = [json.loads(line.decode("utf-8")) for line in log]
+        self.assertEqual([(entry["seq"], entry["data"]["billing_amount"]) for entry in entries], [(1, "9.00")])
+        self.assertEqual(engine.synced, 1)
+        with self.assertRaises(InsufficientFunds):
+            engine.authorize(self.authorisation("2", amount="91.01"))
+        with self.assertRaises(Account.DoesNotExist):
+            engine.authorize(self.authorisation("3", card_id="NOBODY"))
+
+    def test_flush(self):
+        engine = self.get_engine()
+        engine.authorize(self.authorisation("1"))
+        engine.authorize(self.authorisation("2", amount="1.50"))
+        self.assertEqual(Account.objects.get(card_id="1234LOBO").on_hold, Decimal(0))
+        self.assertEqual(engine.flush(), 2)
+        self.assertEqual(engine.flush(), 0)
+        self.assertEqual(Account.objects.get(card_id="1234LOBO").on_hold, Decimal("10.50"))
+        self.assertEqual(Transaction.objects.filter(card_id="1234LOBO").count(), 2)
+        self.assertEqual(EngineCheckpoint.objects.get(name="default").sequence, 2)
+        self.assertFalse(os.path.exists(engine.flushing_path))
+
+    def test_funds_changed_by_others(self):
+        engine = self.get_engine()
+        Account.objects.filter(card_id="1234LOBO").update(balance=200)
+        self.assertTrue(engine.authorize(self.authorisation("1", amount="150.00")))
+
+    def test_recovery(self):
+        engine = self.get_engine()
+        engine.authorize(self.authorisation("1"))
+        engine.flush()
+        engine.authorize(self.authorisation("2"))
+        engine.authorize(self.authorisation("3"))
+        with self.assertRaises(ImproperlyConfigured):
+            self.get_engine()
+        engine.close()
+        restarted = self.get_engine()
+        self.assertEqual(
+            sorted(Transaction.objects.values_list("transaction_id", flat=True)), ["1", "2", "3"])
+        self.assertEqual(Account.objects.get(card_id="1234LOBO").on_hold, Decimal("27.00"))
+        self.assertEqual(restarted.sequence, 3)
+        with self.assertRaises(InsufficientFunds):
+            restarted.authorize(self.authorisation("4", amount="73.01"))
+
+    def test_saved_authorisation_dropped(self):
+        engine = self.get_engine()
+        engine.authorize(self.authorisation("1"))
+        Transaction.objects.create(**dict(self.authorisation("1"), card_id=Account.objects.get(card_id="1234LOBO")))
+        engine.flush()
+        self.assertEqual(Transaction.objects.count(), 1)
+        self.assertEqual(Account.objects.get(card_id="1234LOBO").on_hold, Decimal("9.00"))
+        self.assertEqual(engine.on_hold[engine.slots["1234LOBO"]], 900)
+
+    def test_views(self):
+        client = APIClient()
+        data = dict(self.authorisation("1"), billing_amount="9.00", transaction_amount="10.00")
+        with override_settings(ISSUER_AUTH_ENGINE={"LOG": self.path}):
+            r = client.post('/', data=data)
+            self.assertEqual(r.status_code, status.HTTP_200_OK)
+            r = client.post('/', data=dict(data, transaction_id="2", billing_amount="91.01"))
+            self.assertEqual(r.status_code, status.HTTP_403_FORBIDDEN)
+            self.assertFalse(Transaction.objects.exists())
+            r = client.post('/', data=dict(data, type="presentment",
+                settlement_amount="8.95", settlement_currency="EUR"))
+            self.assertEqual(r.status_code, status.HTTP_200_OK)
+            engine = get_engine()
+            self.engines.append(engine)
+            self.assertEqual(engine.balance[engine.slots["1234LOBO"]], 9100)
+            self.assertEqual(engine.on_hold[engine.slots["1234LOBO"]], 0)
+            r = client.post('/queue', data=data)
+            self.assertEqual(r.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            r = client.post('/', data=[dict(data, transaction_id="3"), dict(data, transaction_id="4",
+                billing_amount="82.01"), dict(data, transaction_id="3", type="presentment",
+                settlement_amount="8.95", settlement_currency="EUR")], format="json")
+            self.assertEqual([i["status"] for i in r.data], [200, 403, 200])
+            self.assertEqual(engine.balance[engine.slots["1234LOBO"]], 8200)
+            self.assertEqual(engine.on_hold[engine.slots["1234LOBO"]], 0)
+        acc = Account.objects.get(card_id="1234LOBO")
+        self.assertEqual((acc.balance, acc.on_hold), (Decimal("82.00"), Decimal("0")))
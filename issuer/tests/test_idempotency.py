@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import time
+from decimal import Decimal
+from rest_framework.test import APIClient
+from rest_framework import status
+from django.test import TestCase, SimpleTestCase, override_settings
+from issuer import idempotency
+from issuer.idempotency import IdempotencyFilter, get_key
+from issuer.models import Account
+
+
+class IdempotencyFilterTests(SimpleTestCase):
+    """Tests for in-memory part of idempotency filter"""
+
+    def test_key(self):
+        self.assertEqual(
+            get_key({"transaction_id": "1237ZORRO", "card_id": "1234LOBO"}),
+            ("1237ZORRO", "authorisation", "1234LOBO", 0)
+        )
+        self.assertEqual(
+            get_key({"transaction_id": "1237ZORRO", "type": "presentment", "card_id": "1234LOBO", "sequence": "1"}),
+            ("1237ZORRO", "presentment", "1234LOBO", 1)
+        )
+        self.assertIsNone(get_key({"transaction_id": "1237ZORRO"}))
+        self.assertIsNone(get_key({"transaction_id": ["1237ZORRO"], "card_id": "1234LOBO"}))
+
+    def test_retention(self):
+        repeats = IdempotencyFilter(max_entries=1, retention=0.01)
+        repeats.remember(("1", "authorisation", "1234LOBO"))
+        self.assertTrue(repeats.seen(("1", "authorisation", "1234LOBO")))
+        repeats.remember(("2", "authorisation", "1234LOBO"))
+        self.assertFalse(repeats.seen(("1", "authorisation", "1234LOBO")))
+        time.sleep(0.02)
+        self.assertFalse(repeats.seen(("2", "authorisation", "1234LOBO")))
+        self.assertEqual(repeats.stats(), {"hits": 1, "index_hits": 0, "misses": 0})
+
+
+@override_settings(ISSUER_IDEMPOTENCY={"MAX_ENTRIES": 10, "RETENTION": 60})
+class RepeatedTransactionTests(TestCase):
+    """Tests for repeated transactions"""
+    @classmethod
+    def setUpTestData(cls):
+        Account.objects.create(card_id="1234LOBO", balance=100, currency="EUR")
+
+    def setUp(self):
+        self.client = APIClient()
+        self.authorisation = {"type": "authorisation",
+            "card_id": "1234LOBO",
+            "transaction_id": "1237ZORRO",
+            "billing_amount": "9.00",
+            "billing_currency": "EUR",
+            "transaction_amount": "10.00",
+            "transaction_currency": "USD"}
+        self.presentment = dict(self.authorisation, type="presentment",
+            settlement_amount="8.95", settlement_currency="EUR")
+
+    def test_repeated_transactions(self):
+        for data in [self.authorisation, self.authorisation, self.presentment, self.presentment]:
+            r = self.client.post('/', data=data)
+            self.assertEqual(r.status_code, status.HTTP_200_OK)
+        acc = Account.objects.get(card_id="1234LOBO")
+        self.assertEqual((acc.balance, acc.on_hold), (Decimal("91"), Decimal("0")))
+        self.assertEqual(idempotency.get_filter().stats()["index_hits"], 2)
+        r = self.client.post('/', data=dict(self.presentment, transaction_id="1238ZORRO"))
+        self.assertEqual(r.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(idempotency.get_filter().stats()["misses"], 1)
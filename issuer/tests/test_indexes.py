@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from datetime import datetime
+from unittest import skipUnless
+from django.db import connection
+from django.test import TestCase
+from issuer.models import Account, BalanceCheckpoint, Transaction, Transfer, AUTHORISATION
+
+
+def query_plan(queryset):
+    """Steps of SQLite query plan of queryset"""
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+@skipUnless(connection.vendor == "sqlite", "Query plans are checked on SQLite")
+class QueryPlanTests(TestCase):
+    """Hot queries should be answered by index, not by table scan"""
+    @classmethod
+    def setUpTestData(cls):
+        cls.account = Account.objects.create(card_id="1234LOBO", balance=100)
+
+    def assertUsesIndex(self, queryset, index):
+        plan = query_plan(queryset)
+        self.assertTrue(
+            any(index in step and step.startswith(("SEARCH", "SCAN")) for step in plan),
+            "{} is not used in {}".format(index, plan)
+        )
+        self.assertFalse(
+            any(step.startswith("SCAN") and "INDEX" not in step for step in plan),
+            "Table is scanned in {}".format(plan)
+        )
+
+    def test_timeframe(self):
+        self.assertUsesIndex(
+            self.account.transactions.get_in_timeframe("2018-01-01T00:00:00Z", "2018-02-01T00:00:00Z"),
+            "issuer_tr_card_date"
+        )
+
+    def test_history(self):
+        self.assertUsesIndex(
+            self.account.transactions.\
+                get_in_timeframe("2018-01-01T00:00:00Z", "2018-02-01T00:00:00Z").\
+                filter(type__exact="presentment").order_by("date", "id"),
+            "issuer_tr_card_type_date"
+        )
+
+    def test_authorisation(self):
+        self.assertUsesIndex(
+            Transaction.objects.filter(transaction_id="1237ZORRO", type=AUTHORISATION, card_id=self.account),
+            "transaction_id_type_card_id"
+        )
+
+    def test_batch_prefetch(self):
+        self.assertUsesIndex(
+            Transaction.objects.filter(transaction_id__in=["1237ZORRO", "1238ZORRO"]),
+            "transaction_id_type_card_id"
+        )
+
+    def test_authorisations_by_date(self):
+        self.assertUsesIndex(
+            Transaction.objects.filter(type=AUTHORISATION, date__lt=datetime(2018, 1, 1)).order_by("date", "id"),
+            "issuer_tr_type_date"
+        )
+
+    def test_unhandled_transfers(self):
+        self.assertUsesIndex(
+            Transfer.objects.get_unhandled().filter(id__gt=10, id__lte=20),
+            "issuer_transfer_unfulfilled"
+        )
+
+    def test_checkpoint(self):
+        self.assertUsesIndex(
+            self.account.checkpoints.filter(date__gte=datetime(2018, 1, 1)).order_by("date", "id"),
+            "issuer_checkpoint_date"
+        )
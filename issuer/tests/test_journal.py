@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+from decimal import Decimal
+from rest_framework.test import APIClient
+from rest_framework import status
+from django.core.management import call_command
+from django.test import TestCase, SimpleTestCase, override_settings
+from issuer.journal import IngestJournal, PENDING, DONE
+from issuer.models import Account
+
+class IngestJournalTests(SimpleTestCase):
+    """Tests for ingest journal"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "journal.sqlite3")
+        self.journal = IngestJournal(self.path, 4)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_claim(self):
+        ids = self.journal.append([{"card_id": "A", "n": 1}, {"card_id": "B", "n": 2},
+            {"card_id": "A", "n": 3}])
+        self.assertEqual(self.journal.get(ids[0])["status"], PENDING)
+        partition = IngestJournal(self.path, 4).claim(range(4), 10)
+        self.assertEqual([item["n"] for _, item, _ in partition], [1, 2, 3])
+        self.journal.complete([(ids[0], {"status": 200})])
+        self.assertEqual(self.journal.get(ids[0]),
+            {"id": ids[0], "status": DONE, "result": {"status": 200}})
+        recovered = self.journal.claim(range(4), 10)
+        self.assertEqual([(pk, flag) for pk, _, flag in recovered],
+            [(ids[1], True), (ids[2], True)])
+        self.assertIsNone(self.journal.get(100))
+
+
+class IngestQueueTests(TestCase):
+    """Tests for asynchronous ingest"""
+    @classmethod
+    def setUpTestData(cls):
+        Account.objects.create(card_id="1234LOBO",
+            balance=100,
+            on_hold=0,
+            currency="EUR"
+        )
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        journal = override_settings(
+            ISSUER_INGEST_JOURNAL=os.path.join(self.directory, "ingest.sqlite3"))
+        journal.enable()
+        self.addCleanup(journal.disable)
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.client = APIClient()
+        self.test_data = {"type":   "authorisation", \
+            "card_id":   "1234LOBO", \
+            "transaction_id":   "1237ZORRO", \
+            "billing_amount":   "9.00", \
+            "billing_currency":   "EUR", \
+            "transaction_amount":   "10.00", \
+            "transaction_currency":   "USD"}
+
+    def test_queue(self):
+        r = self.client.post('/queue', data=self.test_data)
+        self.assertEqual(r.status_code, status.HTTP_202_ACCEPTED)
+        first = r.data["id"]
+        r = self.client.post('/queue', data=[self.test_data, {"type": "authorisation"}],
+            format="json")
+        self.assertEqual(r.status_code, status.HTTP_202_ACCEPTED)
+        second = r.data[0]["id"]
+        self.assertEqual(r.data[1]["status"], status.HTTP_403_FORBIDDEN)
+        r = self.client.get('/queue/{}'.format(first))
+        self.assertEqual(r.data["status"], PENDING)
+
+        call_command("ingest_worker", "--once")
+        r = self.client.get('/queue/{}'.format(first))
+        self.assertEqual(r.data["status"], DONE)
+        self.assertEqual(r.data["result"]["status"], status.HTTP_200_OK)
+        # Repeated transaction is accepted, but held once
+        r = self.client.get('/queue/{}'.format(second))
+        self.assertEqual(r.data["result"]["status"], status.HTTP_200_OK)
+        self.assertEqual(Account.objects.get(card_id="1234LOBO").on_hold,
+            Decimal("9.00"))
+        r = self.client.get('/queue/100')
+        self.assertEqual(r.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_queue_numeric_card_id(self):
+        Account.objects.create(card_id="1234", balance=100, on_hold=0, currency="EUR")
+        self.test_data["card_id"] = 1234
+        r = self.client.post('/queue', data=self.test_data, format="json")
+        self.assertEqual(r.status_code, status.HTTP_202_ACCEPTED)
+        call_command("ingest_worker", "--once")
+        r = self.client.get('/queue/{}'.format(r.data["id"]))
+        self.assertEqual(r.data["result"]["status"], status.HTTP_200_OK)
+        self.assertEqual(Account.objects.get(card_id="1234").on_hold, Decimal("9.00"))
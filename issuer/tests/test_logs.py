@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+import logging
+import threading
+from django.test import SimpleTestCase
+from issuer.logs import BackgroundHandler, JsonFormatter, Lazy, SamplingFilter
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+class LogsTests(SimpleTestCase):
+    """Tests for logging pipeline"""
+
+    def record(self, level=logging.INFO, msg="Saved %s", args=("1237ZORRO",), **extra):
+        record = logging.LogRecord("fintech.issuer.views", level, __file__, 1, msg, args, None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_background_handler(self):
+        handler = BackgroundHandler("issuer.tests.test_logs.ListHandler")
+        handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+        calls = []
+        handler.handle(self.record(args=(Lazy(
+            lambda: calls.append(threading.current_thread().name) or "1237ZORRO"),)))
+        handler.close()
+        self.assertEqual(handler.target.lines, ["INFO Saved 1237ZORRO"])
+        self.assertEqual(calls, ["log-writer"])
+
+    def test_lazy(self):
+        logger = logging.getLogger("fintech.issuer.tests")
+        calls = []
+        logger.debug("Not formatted %s", Lazy(lambda: calls.append(1)))
+        self.assertEqual(calls, [])
+
+    def test_sampling(self):
+        sampling = SamplingFilter(rate=0)
+        self.assertFalse(sampling.filter(self.record()))
+        self.assertTrue(sampling.filter(self.record(level=logging.WARNING)))
+        self.assertTrue(SamplingFilter(rate=1).filter(self.record()))
+
+    def test_json(self):
+        data = json.loads(JsonFormatter().format(self.record(card_id="1234LOBO")))
+        self.assertEqual(data["message"], "Saved 1237ZORRO")
+        self.assertEqual(data["level"], "INFO")
+        self.assertEqual(data["logger"], "fintech.issuer.views")
+        self.assertEqual(data["card_id"], "1234LOBO")
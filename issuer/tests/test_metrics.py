@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import logging
+from rest_framework.test import APIClient
+from rest_framework import status
+from django.db import connection
+from django.test import TestCase, override_settings
+from issuer.metrics import Registry
+from issuer.middleware import MetricsMiddleware, QueryRecorder, record_queries
+from issuer.models import Account
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class MetricsTests(TestCase):
+    """Tests for request metrics"""
+    @classmethod
+    def setUpTestData(cls):
+        Account.objects.create(card_id="1234LOBO",
+            balance=100,
+            on_hold=0,
+            currency="EUR"
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_metrics(self):
+        self.client.get('/accounts/1234LOBO/transactions')
+        r = self.client.get('/metrics')
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        text = r.content.decode("utf-8")
+        self.assertIn('issuer_http_requests_total{status="200",view="AccountTransactions"}', text)
+        self.assertIn('issuer_http_request_duration_seconds_bucket{le="+Inf",view="AccountTransactions"}', text)
+        self.assertIn('issuer_db_queries_total{view="AccountTransactions"}', text)
+        self.assertIn("issuer_balance_cache_hits_total", text)
+
+    def test_registry(self):
+        registry = Registry()
+        registry.observe("View", 200, 0.02, 3, 0.01, 10)
+        registry.observe("View", 403, 2, 1, 0.01, 0)
+        text = registry.render()
+        self.assertIn('issuer_http_request_duration_seconds_bucket{le="0.025",view="View"} 1', text)
+        self.assertIn('issuer_http_request_duration_seconds_bucket{le="+Inf",view="View"} 2', text)
+        self.assertIn('issuer_db_queries_total{view="View"} 4', text)
+        self.assertIn('issuer_http_response_bytes_total{view="View"} 10', text)
+
+    @override_settings(ISSUER_SLOW_REQUEST_MS=0)
+    def test_slow_request_log(self):
+        handler = ListHandler()
+        logger = logging.getLogger('fintech.issuer.slow')
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        self.client.get('/accounts/1234LOBO/transactions')
+        messages = [record.getMessage() for record in handler.records]
+        self.assertTrue(messages[0].startswith("Slow request GET /accounts/1234LOBO/transactions"))
+        self.assertIn("issuer_account", messages[1])
+
+    def test_record_queries(self):
+        """Queries of cursors opened before recording are recorded"""
+        MetricsMiddleware(None)
+        cursor = connection.cursor()
+        cursor.execute("SELECT 1")
+        recorder = QueryRecorder()
+        with record_queries(recorder):
+            cursor.execute("SELECT 2")
+            Account.objects.count()
+        cursor.execute("SELECT 3")
+        self.assertEqual([sql for sql, _ in recorder.queries][0], "SELECT 2")
+        self.assertEqual(len(recorder.queries), 2)
@@ -4,7 +4,7 @@ from datetime import datetime
 from decimal import Decimal
 import time
 from django.test import TestCase
-from issuer.models import Account, Transaction, Transfer
+from issuer.models import Account, BalanceCheckpoint, Transaction, Transfer, InsufficientFunds
 
 
 class IssuerModelsTests(TestCase):
@@ -48,6 +48,19 @@ class IssuerModelsTests(TestCase):
         acc = Account.objects.get(card_id="1234LOBO")
         self.assertEqual(acc.on_hold, Decimal("9.00"))
 
+    def test_transaction_insufficient_funds(self):
+        """Test that authorisation over avaliable funds is declined"""
+        Transaction.objects.create(**self.authorize_data)
+        self.authorize_data["transaction_id"] = "1238ZORRO"
+        self.authorize_data["billing_amount"] = "91.01"
+        with self.assertRaises(InsufficientFunds):
+            Transaction.objects.create(**self.authorize_data)
+        self.assertEqual(Transaction.objects.count(), 1)
+        acc = Account.objects.get(card_id="1234LOBO")
+        self.assertEqual((acc.balance, acc.on_hold), (Decimal("100"), Decimal("9")))
+        self.assertTrue(Account.objects.hold("1234LOBO", Decimal("91")))
+        self.assertFalse(Account.objects.hold("1234LOBO", Decimal("0.01")))
+
     def test_transfers(self):
         """Test transfer creation"""
         Transaction.objects.create(**self.authorize_data)
@@ -60,6 +73,18 @@ class IssuerModelsTests(TestCase):
         self.assertEqual(transfers[0].debit, Decimal("9.00"))
         self.assertEqual(transfers[0].credit, Decimal("8.95"))
 
+    def test_partial_presentment(self):
+        """Test that presentment releases only its part of authorisation"""
+        auth = Transaction.objects.create(**self.authorize_data)
+        self.presentment_data["billing_amount"] = "5.00"
+        presentment = Transaction.objects.create(**self.presentment_data)
+        self.assertEqual(presentment.authorisation, auth)
+        auth.refresh_from_db()
+        self.assertEqual(auth.settled_amount, Decimal("5.00"))
+        self.assertEqual(list(auth.presentments.all()), [presentment])
+        acc = Account.objects.get(card_id="1234LOBO")
+        self.assertEqual((acc.balance, acc.on_hold), (Decimal("95"), Decimal("4")))
+
     def test_transactions_in_timeframe(self):
         """Test of extruction transactions for account in specific timeframe"""
         t_start = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
@@ -93,4 +118,77 @@ class IssuerModelsTests(TestCase):
             acc.get_balance_in_time(),
             {"balance": Decimal("91"),
             "ledger_balance": Decimal("91")}
-        )
\ No newline at end of file
+        )
+
+    def test_balance_in_time_checkpoint(self):
+        """Test that balance in time is replayed from the nearest checkpoint"""
+        Transaction.objects.create(**self.authorize_data)
+        t_first = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        Transaction.objects.create(**self.presentment_data)
+        acc = Account.objects.get(card_id="1234LOBO")
+        BalanceCheckpoint.objects.take(acc)
+        self.authorize_data["transaction_id"] = "1238ZORRO"
+        self.authorize_data["card_id"] = acc
+        Transaction.objects.create(**self.authorize_data)
+        checkpoint = BalanceCheckpoint.objects.get()
+        self.assertEqual(
+            (checkpoint.balance, checkpoint.on_hold),
+            (Decimal("91"), Decimal("0"))
+        )
+        self.assertEqual(
+            acc.get_balance_in_time(t_first),
+            {"balance": Decimal("100"),
+            "ledger_balance": Decimal("91")}
+        )
+        self.assertEqual(
+            Account.objects.get(card_id="1234LOBO").get_balance_in_time(),
+            {"balance": Decimal("91"),
+            "ledger_balance": Decimal("82")}
+        )
+
+    def test_striped_account(self):
+        """Test authorisation and settlement on striped account"""
+        account = Account.objects.get(card_id="1234LOBO")
+        account.rebalance(4)
+        account.refresh_from_db()
+        self.assertEqual(
+            sorted(account.stripes.values_list("balance", flat=True)),
+            [Decimal("25")] * 4
+        )
+        self.assertEqual((account.balance, account.on_hold), (Decimal("0"), Decimal("0")))
+        auth = Transaction.objects.create(**self.authorize_data)
+        self.assertIsNotNone(auth.stripe)
+        self.assertEqual(account.stripes.get(number=auth.stripe).on_hold, Decimal("9"))
+        presentment = Transaction.objects.create(**self.presentment_data)
+        self.assertEqual(presentment.stripe, auth.stripe)
+        self.assertEqual(account.funds(), (Decimal("91"), Decimal("0")))
+        self.assertEqual(
+            Account.objects.get_balance("1234LOBO"),
+            {"balance": Decimal("91"), "ledger_balance": Decimal("91")}
+        )
+        self.authorize_data["transaction_id"] = "1238ZORRO"
+        self.authorize_data["billing_amount"] = "30.00"
+        with self.assertRaises(InsufficientFunds):
+            Transaction.objects.create(**self.authorize_data)
+        account.rebalance(0)
+        account.refresh_from_db()
+        self.assertEqual(account.stripes.count(), 0)
+        self.assertEqual((account.balance, account.on_hold), (Decimal("91"), Decimal("0")))
+        Transaction.objects.create(**self.authorize_data)
+
+    def test_rebalance_moves_holds_of_removed_stripes(self):
+        """Authorisation of removed stripe is settled on account, not on new stripe of its number"""
+        account = Account.objects.get(card_id="1234LOBO")
+        account.rebalance(1)
+        auth = Transaction.objects.create(**self.authorize_data)
+        self.assertEqual(auth.stripe, 0)
+        account.rebalance(0)
+        self.assertIsNone(Transaction.objects.get(pk=auth.pk).stripe)
+        account.rebalance(1)
+        account.refresh_from_db()
+        self.assertEqual(account.on_hold, Decimal("9"))
+        self.assertEqual(account.stripes.get().on_hold, Decimal("0"))
+        Transaction.objects.create(**self.presentment_data)
+        account.refresh_from_db()
+        self.assertEqual((account.on_hold, account.stripes.get().on_hold), (Decimal("0"), Decimal("0")))
+        self.assertEqual(account.funds(), (Decimal("91"), Decimal("0")))
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+from rest_framework.test import APIClient
+from rest_framework import status
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connections
+from django.test import SimpleTestCase, TestCase, override_settings
+from issuer import routers
+from issuer.models import Account, Transaction
+from issuer.routers import ReplicaRouter, note_write, recent_writes, use_replica, replica_iterator
+
+
+def shared_cache(test):
+    """Default cache in files of temporary folder, shared by processes"""
+    folder = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, folder)
+    settings = test.settings(CACHES={"default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": folder}})
+    settings.enable()
+    test.addCleanup(settings.disable)
+
+
+@override_settings(ISSUER_REPLICA_DATABASE="replica", ISSUER_READ_YOUR_WRITES=60)
+class ReplicaRouterTests(SimpleTestCase):
+    """Tests for routing of reads to replica"""
+
+    def setUp(self):
+        shared_cache(self)
+        self.router = ReplicaRouter()
+
+    def test_reads(self):
+        self.assertIsNone(self.router.db_for_read(Transaction))
+        with use_replica("1234LOBO"):
+            self.assertEqual(self.router.db_for_read(Transaction), "replica")
+            with use_replica():
+                self.assertEqual(self.router.db_for_read(Transaction), "replica")
+        self.assertIsNone(self.router.db_for_read(Transaction))
+        self.assertIsNone(self.router.db_for_write(Transaction))
+
+    def test_read_your_writes(self):
+        note_write("1234LOBO")
+        with use_replica("1234LOBO", "5678LOBO"):
+            self.assertIsNone(self.router.db_for_read(Transaction))
+        with use_replica("5678LOBO"):
+            self.assertEqual(self.router.db_for_read(Transaction), "replica")
+        with override_settings(ISSUER_READ_YOUR_WRITES=0):
+            note_write("5678LOBO")
+            with use_replica("5678LOBO"):
+                self.assertEqual(self.router.db_for_read(Transaction), "replica")
+
+    def test_local_cache(self):
+        with override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}):
+            with self.assertRaises(ImproperlyConfigured):
+                recent_writes()
+
+    def test_iterator(self):
+        items = replica_iterator((self.router.db_for_read(Transaction) for i in range(2)), "5678LOBO")
+        self.assertEqual(list(items), ["replica", "replica"])
+
+    def test_migrate(self):
+        self.assertTrue(self.router.allow_migrate("default", "issuer"))
+        self.assertFalse(self.router.allow_migrate("replica", "issuer"))
+
+    @override_settings(ISSUER_REPLICA_DATABASE=None)
+    def test_without_replica(self):
+        with use_replica("1234LOBO"):
+            self.assertIsNone(self.router.db_for_read(Transaction))
+
+
+class ReplicaDatabaseTests(TestCase):
+    """Tests for reads of primary and replica SQLite files"""
+    @classmethod
+    def setUpTestData(cls):
+        Account.objects.create(card_id="1234LOBO", balance=100, currency="EUR")
+
+    def setUp(self):
+        shared_cache(self)
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        connections.databases["replica"] = {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.path.join(folder, "replica.sqlite3"),
+        }
+        self.addCleanup(self.remove_replica)
+        with override_settings(ISSUER_REPLICA_DATABASE=None):
+            call_command("migrate", database="replica", verbosity=0)
+        settings = self.settings(ISSUER_REPLICA_DATABASE="replica", ISSUER_READ_YOUR_WRITES=60)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.client = APIClient()
+
+    def remove_replica(self):
+        connections["replica"].close()
+        if hasattr(connections._connections, "replica"):
+            delattr(connections._connections, "replica")
+        del connections.databases["replica"]
+
+    def test_read_your_writes(self):
+        """Replica without writes of primary is read after window of writer"""
+        r = self.client.post('/', data={"type": "authorisation",
+            "card_id": "1234LOBO",
+            "transaction_id": "1237ZORRO",
+            "billing_amount": "9.00",
+            "billing_currency": "EUR",
+            "transaction_amount": "10.00",
+            "transaction_currency": "USD"})
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        r = self.client.get('/accounts/1234LOBO/transactions', data={"type": "authorisation"})
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        # Window is seen by other processes through shared cache
+        routers.reset()
+        self.assertTrue(recent_writes().get("1234LOBO"))
+        recent_writes().delete("1234LOBO")
+        r = self.client.get('/accounts/1234LOBO/transactions', data={"type": "authorisation"})
+        self.assertEqual(r.status_code, status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from decimal import Decimal
+from rest_framework.test import APIClient
+from rest_framework import status
+from django.test import TestCase, SimpleTestCase, override_settings
+from issuer import velocity
+from issuer.models import Account, Transaction
+from issuer.velocity import VelocityChecker, VelocityLimitExceeded
+
+
+class VelocityCheckerTests(SimpleTestCase):
+    """Tests for in-memory velocity windows"""
+
+    def test_count_limit(self):
+        checker = VelocityChecker({"minute": {"COUNT": 2}}, max_cards=10)
+        for now in [1000, 1005]:
+            checker.check("1234LOBO", "1.00", now)
+        with self.assertRaises(VelocityLimitExceeded):
+            checker.check("1234LOBO", "1.00", 1055)
+        checker.check("1235LOBO", "1.00", 1055)
+        checker.check("1234LOBO", "1.00", 1060)
+
+    def test_amount_limit(self):
+        checker = VelocityChecker({"hour": {"AMOUNT": "10.00"}, "day": {"AMOUNT": "15.00"}}, max_cards=10)
+        checker.record("1234LOBO", "9.00", 0)
+        with self.assertRaisesRegexp(VelocityLimitExceeded, "limit of 10.00 authorised per hour"):
+            checker.check("1234LOBO", "1.01", 3599)
+        checker.check("1234LOBO", "6.00", 3600)
+        with self.assertRaisesRegexp(VelocityLimitExceeded, "per day"):
+            checker.check("1234LOBO", "0.01", 7200)
+        checker.check("1234LOBO", "9.00", 86400)
+
+    def test_release(self):
+        checker = VelocityChecker({"minute": {"COUNT": 1}}, max_cards=10)
+        now = checker.check("1234LOBO", "1.00", 1000)
+        with self.assertRaises(VelocityLimitExceeded):
+            checker.check("1234LOBO", "1.00", 1001)
+        checker.release("1234LOBO", "1.00", now)
+        checker.check("1234LOBO", "1.00", 1002)
+
+    def test_idle_cards_evicted(self):
+        checker = VelocityChecker({"minute": {"COUNT": 1}}, max_cards=1)
+        checker.record("1234LOBO", "1.00")
+        checker.record("1235LOBO", "1.00")
+        checker.check("1234LOBO", "1.00")
+        with self.assertRaises(VelocityLimitExceeded):
+            checker.check("1234LOBO", "1.00")
+
+
+@override_settings(ISSUER_VELOCITY={"LIMITS": {"day": {"COUNT": 2}}})
+class VelocityLimitTests(TestCase):
+    """Tests for velocity limits of authorisations"""
+    @classmethod
+    def setUpTestData(cls):
+        Account.objects.create(card_id="1234LOBO", balance=100, currency="EUR")
+
+    def setUp(self):
+        self.client = APIClient()
+        self.authorisation = {"type": "authorisation",
+            "card_id": "1234LOBO",
+            "billing_amount": "9.00",
+            "billing_currency": "EUR",
+            "transaction_amount": "10.00",
+            "transaction_currency": "USD"}
+
+    def test_limit(self):
+        Transaction.objects.create(**dict(self.authorisation, transaction_id="1",
+            card_id=Account.objects.get(card_id="1234LOBO")))
+        velocity.reset()
+        r = self.client.post('/', data=dict(self.authorisation, transaction_id="2"))
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        r = self.client.post('/', data=dict(self.authorisation, transaction_id="3"))
+        self.assertEqual(r.status_code, status.HTTP_403_FORBIDDEN)
+        r = self.client.post('/', data=[dict(self.authorisation, transaction_id="4")], format="json")
+        self.assertEqual(r.data[0]["errors"], {"non_field_errors": ["Card exceeds limit of 2 authorisations per day"]})
+        self.assertEqual(Account.objects.get(card_id="1234LOBO").on_hold, Decimal("18.00"))
+
+    def test_declined_not_counted(self):
+        velocity.reset()
+        r = self.client.post('/', data=dict(self.authorisation, transaction_id="1", billing_amount="200.00"))
+        self.assertEqual(r.status_code, status.HTTP_403_FORBIDDEN)
+        r = self.client.post('/', data=[dict(self.authorisation, transaction_id="2", billing_amount="200.00")],
+            format="json")
+        self.assertEqual(r.data[0]["errors"], {"non_field_errors": ["No sufficient funds"]})
+        for transaction_id in ["3", "4"]:
+            r = self.client.post('/', data=dict(self.authorisation, transaction_id=transaction_id))
+            self.assertEqual(r.status_code, status.HTTP_200_OK)
@@ -1,12 +1,14 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import json
 from datetime import datetime
 from decimal import Decimal
 from rest_framework.test import APIClient
 from rest_framework import status
-from django.test import TestCase
-from issuer.models import Account
+from django.test import TestCase, override_settings
+from issuer import batch
+from issuer.models import Account, Transaction, Transfer
 
 
 class TransactionTests(TestCase):
@@ -71,6 +73,24 @@ class TransactionTests(TestCase):
         self.assertEqual(r.status_code, status.HTTP_200_OK)
         self.assertEqual(len(r.data), 1)
 
+    def test_partial_presentments(self):
+        """Authorisation is settled by two presentments with different sequence numbers"""
+        self.client.post('/', data=self.test_data)
+        self.test_data_presentment["billing_amount"] = "5.00"
+        r = self.client.post('/', data=self.test_data_presentment)
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        self.test_data_presentment["billing_amount"] = "4.00"
+        self.test_data_presentment["sequence"] = 1
+        r = self.client.post('/', data=self.test_data_presentment)
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        r = self.client.post('/', data=self.test_data_presentment)
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        account = Account.objects.get(card_id="1234LOBO")
+        self.assertEqual(account.balance, Decimal("91.00"))
+        self.assertEqual(account.on_hold, Decimal("0.00"))
+        self.assertEqual(Transaction.objects.get(type="authorisation").settled_amount, Decimal("9.00"))
+        self.assertEqual(Transaction.objects.filter(type="presentment").count(), 2)
+
     def test_auth_transactions_negative(self):
         r = self.client.post('/', data=self.test_data_wrong)
         self.assertEqual(r.status_code, status.HTTP_403_FORBIDDEN)
@@ -102,4 +122,348 @@ class TransactionTests(TestCase):
             "ledger_balance": "91.00"}
         )
 
+    def test_get_balance_history(self):
+        before = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        r = self.client.post('/', data=self.test_data)
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        first = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        r = self.client.post('/', data=self.test_data_presentment)
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        second = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        r = self.client.get('/accounts/1234LOBO/balance/history',
+            data={"time": [second, before, first]})
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(p["balance"], p["ledger_balance"]) for p in r.data],
+            [("100.00", "100.00"), ("100.00", "91.00"), ("91.00", "91.00")]
+        )
+        r = self.client.get('/accounts/1234LOBO/balance/history',
+            data={"start": "2018-01-01T00:00:00Z", "end": "2018-01-03T00:00:00Z", "step": "1 00:00:00"})
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [p["time"] for p in r.data],
+            ["2018-01-01T00:00:00Z", "2018-01-02T00:00:00Z", "2018-01-03T00:00:00Z"]
+        )
+        self.assertEqual(r.data[0]["balance"], "100.00")
+        r = self.client.get('/accounts/1234LOBO/balance/history',
+            data={"start": "2018-01-01T00:00:00Z", "end": "2018-01-03T00:00:00Z"})
+        self.assertEqual(r.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_balance_history_partial_presentments(self):
+        before = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        r = self.client.post('/', data=self.test_data)
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        first = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        r = self.client.post('/', data=dict(self.test_data_presentment, billing_amount="5.00", sequence=1))
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        second = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        r = self.client.post('/', data=dict(self.test_data_presentment, billing_amount="4.00", sequence=2))
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        r = self.client.get('/accounts/1234LOBO/balance/history',
+            data={"time": [before, first, second]})
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(p["balance"], p["ledger_balance"]) for p in r.data],
+            [("100.00", "100.00"), ("100.00", "91.00"), ("95.00", "91.00")]
+        )
+        r = self.client.post('/accounts/balances',
+            data=json.dumps({"card_ids": ["1234LOBO"], "time": before}),
+            content_type="application/json")
+        self.assertEqual(r.data["balances"]["1234LOBO"], {"balance": "100.00", "ledger_balance": "100.00"})
+
+    def test_get_balance_history_expired(self):
+        before = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        r = self.client.post('/', data=self.test_data)
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        first = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        Transaction.objects.expire_holds([Transaction.objects.get().pk])
+        r = self.client.get('/accounts/1234LOBO/balance/history',
+            data={"time": [before, first]})
+        self.assertEqual(
+            [(p["balance"], p["ledger_balance"]) for p in r.data],
+            [("100.00", "100.00"), ("100.00", "91.00")]
+        )
+        r = self.client.post('/accounts/balances',
+            data=json.dumps({"card_ids": ["1234LOBO"], "time": first}),
+            content_type="application/json")
+        self.assertEqual(r.data["balances"]["1234LOBO"], {"balance": "100.00", "ledger_balance": "91.00"})
+
+    @override_settings(ISSUER_ARCHIVE_CUTOFF_TTL=60)
+    def test_get_balances(self):
+        Account.objects.create(card_id="5678LOBO", balance=50, currency="EUR")
+        r = self.client.post('/', data=self.test_data)
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        first = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        r = self.client.post('/', data=self.test_data_presentment)
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(1):
+            r = self.client.get('/accounts/balances',
+                data={"card_id": ["1234LOBO", "5678LOBO", "4321LOBO"]})
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        self.assertEqual(r.data["missing"], ["4321LOBO"])
+        self.assertEqual(r.data["balances"]["1234LOBO"], {"balance": "91.00", "ledger_balance": "91.00"})
+        self.assertEqual(r.data["balances"]["5678LOBO"], {"balance": "50.00", "ledger_balance": "50.00"})
+        with self.assertNumQueries(3):
+            r = self.client.post('/accounts/balances',
+                data=json.dumps({"card_ids": ["1234LOBO", "5678LOBO"], "time": first}),
+                content_type="application/json")
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        self.assertEqual(r.data["missing"], [])
+        self.assertEqual(r.data["balances"]["1234LOBO"], {"balance": "100.00", "ledger_balance": "91.00"})
+        r = self.client.get('/accounts/balances')
+        self.assertEqual(r.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BatchTransactionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Account.objects.create(card_id="1234LOBO",
+            balance=100,
+            on_hold=0,
+            currency="EUR"
+        )
+        Account.objects.create(card_id="4321LOBO",
+            balance=10,
+            on_hold=0,
+            currency="EUR"
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def transaction(self, tr_type, card_id, transaction_id, amount):
+        data = {"type": tr_type,
+            "card_id": card_id,
+            "transaction_id": transaction_id,
+            "billing_amount": amount,
+            "billing_currency": "EUR",
+            "transaction_amount": amount,
+            "transaction_currency": "EUR"}
+        if tr_type == "presentment":
+            data["settlement_amount"] = amount
+            data["settlement_currency"] = "EUR"
+        return data
+
+    def test_batch(self):
+        data = [
+            self.transaction("authorisation", "1234LOBO", "1", "9.00"),
+            self.transaction("presentment", "1234LOBO", "1", "9.00"),
+            self.transaction("authorisation", "4321LOBO", "2", "8.00"),
+            self.transaction("authorisation", "4321LOBO", "3", "8.00"),
+            self.transaction("authorisation", "1234LOBO", "1", "9.00"),
+            self.transaction("presentment", "1234LOBO", "4", "9.00"),
+            self.transaction("authorisation", "5555LOBO", "5", "1.00"),
+            {"type": "authorisation"},
+        ]
+        r = self.client.post('/', data=data, format="json")
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        self.assertEqual([i["status"] for i in r.data],
+            [200, 200, 200, 403, 200, 403, 403, 403])
+        self.assertEqual(r.data[3]["errors"],
+            {"non_field_errors": ["No sufficient funds"]})
+        acc = Account.objects.get(card_id="1234LOBO")
+        self.assertEqual((acc.balance, acc.on_hold),
+            (Decimal("91.00"), Decimal("0.00")))
+        acc = Account.objects.get(card_id="4321LOBO")
+        self.assertEqual((acc.balance, acc.on_hold),
+            (Decimal("10.00"), Decimal("8.00")))
+        self.assertEqual(Transaction.objects.count(), 3)
+        self.assertEqual(Transfer.objects.count(), 1)
+        presentment = Transaction.objects.get(type="presentment")
+        self.assertEqual(presentment.authorisation.transaction_id, "1")
+        self.assertEqual(presentment.authorisation.settled_amount, Decimal("9.00"))
+
+    def test_batch_presentment_of_saved_authorisation(self):
+        r = self.client.post('/', data=[
+            self.transaction("authorisation", "1234LOBO", "1", "9.00")
+        ], format="json")
+        r = self.client.post('/', data=[
+            self.transaction("presentment", "1234LOBO", "1", "6.00")
+        ], format="json")
+        self.assertEqual([i["status"] for i in r.data], [200])
+        auth = Transaction.objects.get(type="authorisation")
+        self.assertEqual(auth.settled_amount, Decimal("6.00"))
+        self.assertEqual(auth.presentments.get().billing_amount, Decimal("6.00"))
+        acc = Account.objects.get(card_id="1234LOBO")
+        self.assertEqual((acc.balance, acc.on_hold),
+            (Decimal("94.00"), Decimal("3.00")))
+
+    def test_batch_presentment_of_expired_authorisation(self):
+        """Hold released by expiry is not released again by presentment"""
+        self.client.post('/', data=[
+            self.transaction("authorisation", "1234LOBO", "1", "9.00"),
+            self.transaction("authorisation", "1234LOBO", "2", "5.00"),
+        ], format="json")
+        Transaction.objects.expire_holds([Transaction.objects.get(transaction_id="1").pk])
+        r = self.client.post('/', data=[
+            self.transaction("presentment", "1234LOBO", "1", "9.00")
+        ], format="json")
+        self.assertEqual([i["status"] for i in r.data], [200])
+        acc = Account.objects.get(card_id="1234LOBO")
+        self.assertEqual((acc.balance, acc.on_hold), (Decimal("91.00"), Decimal("5.00")))
+
+    def test_link_presentments_of_inserted_ids(self):
+        """Authorisation inserted with id, as on PostgreSQL, is not settled twice"""
+        fields = dict(self.transaction("authorisation", "1234LOBO", "1", "9.00"),
+            card_id=Account.objects.get(card_id="1234LOBO"))
+        auth = Transaction(settled_amount=Decimal("9.00"), **fields)
+        Transaction.objects.bulk_create([auth])
+        auth.pk = Transaction.objects.get().pk
+        presentment = Transaction(**dict(fields, type="presentment"))
+        batch.link_presentments([(presentment, auth)], [auth])
+        self.assertEqual(presentment.authorisation_id, auth.pk)
+        self.assertEqual(Transaction.objects.get().settled_amount, Decimal("9.00"))
+
+    def test_batch_retry(self):
+        """Retried batch is accepted without applying its transactions again"""
+        data = [
+            self.transaction("authorisation", "1234LOBO", "1", "9.00"),
+            self.transaction("presentment", "1234LOBO", "1", "9.00"),
+        ]
+        self.client.post('/', data=data, format="json")
+        r = self.client.post('/', data=data, format="json")
+        self.assertEqual([i["status"] for i in r.data], [200, 200])
+        self.assertEqual(Transaction.objects.count(), 2)
+        acc = Account.objects.get(card_id="1234LOBO")
+        self.assertEqual((acc.balance, acc.on_hold), (Decimal("91.00"), Decimal("0.00")))
+
+    def test_batch_striped_account(self):
+        """Authorisations are held on stripes, presentment settles stripe of its authorisation"""
+        account = Account.objects.get(card_id="1234LOBO")
+        account.rebalance(2)
+        r = self.client.post('/', data=[
+            self.transaction("authorisation", "1234LOBO", "1", "30.00"),
+            self.transaction("authorisation", "1234LOBO", "2", "30.00"),
+            self.transaction("authorisation", "1234LOBO", "3", "30.00"),
+            self.transaction("presentment", "1234LOBO", "1", "30.00"),
+        ], format="json")
+        self.assertEqual([i["status"] for i in r.data], [200, 200, 403, 200])
+        first = Transaction.objects.get(transaction_id="1", type="authorisation")
+        second = Transaction.objects.get(transaction_id="2", type="authorisation")
+        self.assertEqual(set([first.stripe, second.stripe]), set([0, 1]))
+        self.assertEqual(Transaction.objects.get(type="presentment").stripe, first.stripe)
+        stripe = account.stripes.get(number=first.stripe)
+        self.assertEqual((stripe.balance, stripe.on_hold), (Decimal("20.00"), Decimal("0.00")))
+        stripe = account.stripes.get(number=second.stripe)
+        self.assertEqual((stripe.balance, stripe.on_hold), (Decimal("50.00"), Decimal("30.00")))
+        account.refresh_from_db()
+        self.assertEqual((account.balance, account.on_hold), (Decimal("0.00"), Decimal("0.00")))
+
+    def test_batch_queries(self):
+        """Number of queries depends on number of cards, not transactions"""
+        data = [self.transaction("authorisation", "1234LOBO", str(i), "1.00")
+            for i in range(50)]
+        with self.assertNumQueries(6):
+            r = self.client.post('/', data=data, format="json")
+        self.assertEqual([i["status"] for i in r.data], [200] * 50)
+        self.assertEqual(Account.objects.get(card_id="1234LOBO").on_hold,
+            Decimal("50.00"))
+
+    def test_batch_json_lines(self):
+        data = "\n".join(json.dumps(i) for i in [
+            self.transaction("authorisation", "1234LOBO", "1", "9.00"),
+            self.transaction("presentment", "1234LOBO", "1", "9.00")])
+        r = self.client.post('/', data=data,
+            content_type="application/x-ndjson")
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        self.assertEqual([i["status"] for i in r.data], [200, 200])
+        self.assertEqual(Account.objects.get(card_id="1234LOBO").balance,
+            Decimal("91.00"))
+
+
+class TransactionHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Account.objects.create(card_id="1234LOBO",
+            balance=100,
+            on_hold=0,
+            currency="EUR"
+        )
+        for i in range(5):
+            for tr_type in ["authorisation", "presentment"]:
+                Transaction.objects.create(
+                    type=tr_type,
+                    card_id=Account.objects.get(card_id="1234LOBO"),
+                    transaction_id=str(i),
+                    billing_amount="1.00",
+                    billing_currency="EUR",
+                    transaction_amount="1.00",
+                    transaction_currency="EUR"
+                )
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_pages(self):
+        ids = []
+        params = {"page_size": 2}
+        while True:
+            r = self.client.get('/accounts/1234LOBO/transactions', data=params)
+            self.assertEqual(r.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(r.data["results"]), 2)
+            ids.extend(i["transaction_id"] for i in r.data["results"])
+            if not r.data["next"]:
+                break
+            params = {"page_size": 2, "cursor": r.data["next"]}
+        self.assertEqual(ids, ["0", "1", "2", "3", "4"])
+
+    def test_invalid_cursor(self):
+        r = self.client.get('/accounts/1234LOBO/transactions',
+            data={"cursor": "wrong"})
+        self.assertEqual(r.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_stream(self):
+        r = self.client.get('/accounts/1234LOBO/transactions',
+            data={"stream": 1})
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        data = json.loads(b"".join(r.streaming_content).decode("utf-8"))
+        self.assertEqual([i["transaction_id"] for i in data],
+            ["0", "1", "2", "3", "4"])
+        self.assertEqual(data[0]["type"], "presentment")
+
+    def test_stream_false(self):
+        for value in ["0", "false"]:
+            r = self.client.get('/accounts/1234LOBO/transactions',
+                data={"stream": value})
+            self.assertEqual(r.status_code, status.HTTP_200_OK)
+            self.assertFalse(r.streaming)
+            self.assertEqual(len(r.data), 5)
+        r = self.client.get('/accounts/1234LOBO/transactions',
+            data={"stream": "maybe"})
+        self.assertEqual(r.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(ISSUER_ROLLUP_ON_SAVE=True)
+class VolumeReportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Account.objects.create(card_id="1234LOBO", balance=100, currency="EUR")
+
+    def setUp(self):
+        self.client = APIClient()
+        self.test_data = {"type": "authorisation",
+            "card_id": "1234LOBO",
+            "transaction_id": "1237ZORRO",
+            "billing_amount": "9.00",
+            "billing_currency": "EUR",
+            "transaction_amount": "10.00",
+            "transaction_currency": "USD"}
 
+    def test_volumes(self):
+        start = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        self.client.post('/', data=self.test_data)
+        self.client.post('/', data=dict(self.test_data, type="presentment",
+            settlement_amount="8.95", settlement_currency="EUR"))
+        self.client.post('/', data=json.dumps([dict(self.test_data, transaction_id="1238ZORRO")]),
+            content_type="application/json")
+        for period in ["hour", "day"]:
+            r = self.client.get('/reports/volumes', data={"period": period, "start": start})
+            self.assertEqual(r.status_code, status.HTTP_200_OK)
+            self.assertEqual(
+                [(v["type"], v["count"], v["billing_amount"], v["settlement_amount"]) for v in r.data["totals"]],
+                [("authorisation", 2, "18.00", "0.00"), ("presentment", 1, "9.00", "8.95")]
+            )
+        r = self.client.get('/reports/volumes', data={"card_id": "4321LOBO"})
+        self.assertEqual(r.data["totals"], [])
+        r = self.client.get('/reports/volumes', data={"period": "week"})
+        self.assertEqual(r.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import calendar
+import logging
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.utils import timezone
+from issuer.cache import LocMemBackend
+from issuer.models import Transaction, AUTHORISATION
+
+logger = logging.getLogger('fintech.issuer.velocity')
+
+# Length of window and of its bucket in seconds, windows slide by buckets
+WINDOWS = OrderedDict([
+    ("minute", (60, 10)),
+    ("hour", (3600, 300)),
+    ("day", (86400, 3600)),
+])
+
+CENT = Decimal("0.01")
+
+
+class VelocityLimitExceeded(Exception):
+    pass
+
+
+def to_timestamp(date):
+    return calendar.timegm(date.utctimetuple()) + date.microsecond / 1e6
+
+
+class Window(object):
+    """
+    Number and amount in cents of authorisations
+    in ring of buckets, 'head' is number of the latest bucket
+    """
+    __slots__ = ("size", "head", "counts", "amounts", "count", "amount")
+
+    def __init__(self, buckets, size):
+        self.size = size
+        self.head = 0
+        self.counts = array(str("l"), [0]) * buckets
+        self.amounts = array(str("l"), [0]) * buckets
+        self.count = 0
+        self.amount = 0
+
+    def advance(self, now):
+        """Drop buckets which left the window at 'now', returns bucket of 'now'"""
+        bucket = int(now // self.size)
+        if bucket <= self.head:
+            return bucket
+        if bucket - self.head >= len(self.counts):
+            for slot in range(len(self.counts)):
+                self.counts[slot] = self.amounts[slot] = 0
+            self.count = self.amount = 0
+        else:
+            for number in range(self.head + 1, bucket + 1):
+                slot = number % len(self.counts)
+                self.count -= self.counts[slot]
+                self.amount -= self.amounts[slot]
+                self.counts[slot] = self.amounts[slot] = 0
+        self.head = bucket
+        return bucket
+
+    def add(self, now, amount):
+        bucket = self.advance(now)
+        if self.head - bucket < len(self.counts):
+            slot = bucket % len(self.counts)
+            self.counts[slot] += 1
+            self.amounts[slot] += amount
+            self.count += 1
+            self.amount += amount
+
+    def remove(self, now, amount):
+        """Take back authorisation added at 'now' unless it left the window"""
+        bucket = int(now // self.size)
+        if self.head - bucket < len(self.counts):
+            slot = bucket % len(self.counts)
+            self.counts[slot] -= 1
+            self.amounts[slot] -= amount
+            self.count -= 1
+            self.amount -= amount
+
+
+class VelocityChecker(object):
+    """
+    Limits number and amount of authorisations of card per window.
+    Windows of cards are kept in memory of process, at most 'max_cards'
+    recently used, idle cards are dropped when their windows are empty.
+    """
+
+    def __init__(self, limits, max_cards):
+        self.limits = [(name, WINDOWS[name], config.get("COUNT"),
+            int(Decimal(config["AMOUNT"]) / CENT) if config.get("AMOUNT") is not None else None)
+            for name, config in limits.items()]
+        self.cards = LocMemBackend(
+            timeout=max(length for _, (length, _), _, _ in self.limits),
+            max_entries=max_cards
+        )
+        self.lock = threading.Lock()
+
+    def get_windows(self, card_id):
+        windows = self.cards.get(card_id)
+        if windows is None:
+            windows = [Window(length // size, size) for _, (length, size), _, _ in self.limits]
+        return windows
+
+    def check(self, card_id, amount, now=None):
+        """
+        Raise VelocityLimitExceeded if one more authorisation
+        of 'amount' would exceed some limit of card, otherwise
+        count it in windows of card at once, so concurrent checks
+        do not pass together. Returns 'now' to release it with.
+        """
+        now = time.time() if now is None else now
+        cents = int(Decimal(amount) / CENT)
+        with self.lock:
+            windows = self.get_windows(card_id)
+            for (name, _, count, total), window in zip(self.limits, windows):
+                window.advance(now)
+                if count is not None and window.count + 1 > count:
+                    raise VelocityLimitExceeded(
+                        "Card exceeds limit of {} authorisations per {}".format(count, name))
+                if total is not None and window.amount + cents > total:
+                    raise VelocityLimitExceeded(
+                        "Card exceeds limit of {} authorised per {}".format(total * CENT, name))
+            for window in windows:
+                window.add(now, cents)
+            self.cards.set(card_id, windows)
+        return now
+
+    def release(self, card_id, amount, now):
+        """Take back authorisation checked at 'now' which was not saved"""
+        cents = int(Decimal(amount) / CENT)
+        with self.lock:
+            windows = self.cards.get(card_id)
+            if windows is not None:
+                for window in windows:
+                    window.remove(now, cents)
+
+    def record(self, card_id, amount, now=None):
+        """Add saved authorisation to windows of card without checking limits"""
+        now = time.time() if now is None else now
+        amount = int(Decimal(amount) / CENT)
+        with self.lock:
+            windows = self.get_windows(card_id)
+            for window in windows:
+                window.add(now, amount)
+            self.cards.set(card_id, windows)
+
+    def rebuild(self):
+        """
+        Fill windows with authorisations saved during the longest
+        window, read from default database, as replica may lag.
+        Returns their number.
+        """
+        since = timezone.now() - timedelta(seconds=self.cards.timeout)
+        authorisations = Transaction.objects.filter(type=AUTHORISATION, date__gte=since).\
+            order_by("date").values_list("card_id", "billing_amount", "date")
+        number = 0
+        for card_id, amount, date in authorisations.iterator():
+            self.record(card_id, amount, to_timestamp(date))
+            number += 1
+        logger.info("Rebuilt velocity windows from %s authorisations", number)
+        return number
+
+
+_checker = None
+_checker_lock = threading.Lock()
+
+
+def get_checker():
+    """
+    Get velocity checker configured by ISSUER_VELOCITY setting,
+    None if there are no limits. Windows are rebuilt when checker
+    is created, WSGI application does it at startup (see fintech.wsgi).
+    """
+    global _checker
+    config = settings.ISSUER_VELOCITY
+    if not config or not config.get("LIMITS"):
+        return None
+    with _checker_lock:
+        if _checker is None:
+            checker = VelocityChecker(config["LIMITS"], config.get("MAX_CARDS", 100000))
+            checker.rebuild()
+            _checker = checker
+    return _checker
+
+
+def check(card_id, amount):
+    """
+    Check and count authorisation in limits of ISSUER_VELOCITY, if any.
+    Returns reservation to release if authorisation is not saved.
+    """
+    checker = get_checker()
+    if checker is None:
+        return None
+    return (checker, card_id, amount, checker.check(card_id, amount))
+
+
+def release(reservation):
+    """Take back authorisation counted by 'check' which was not saved"""
+    if reservation is not None:
+        checker, card_id, amount, now = reservation
+        checker.release(card_id, amount, now)
+
+
+def reset(**kwargs):
+    global _checker
+    if kwargs.get("setting", "ISSUER_VELOCITY") == "ISSUER_VELOCITY":
+        _checker = None
+
+
+setting_changed.connect(reset)
@@ -2,17 +2,36 @@
 from __future__ import unicode_literals
 
 from django.shortcuts import render
-from django.http import Http404
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from rest_framework.decorators import api_view
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import mixins
 from rest_framework import generics
+from rest_framework import serializers
+from rest_framework.settings import api_settings
+from rest_framework.utils import encoders
+from django.conf import settings
+from django.core import exceptions
+from django.db import IntegrityError, models
+from django.utils import six
+from django.utils.dateparse import parse_duration
 import datetime
+import json
 import logging
-from issuer.models import Account, Transaction
-from issuer.serializers import TransactionSerializer, BalanceSerializer
+from issuer import batch, idempotency, routers, velocity
+from issuer.models import Account, Transaction, VolumeRollup, InsufficientFunds, \
+    AUTHORISATION, PERIOD_CHOICES, get_bucket
+from issuer.engine import get_engine
+from issuer.journal import get_journal
+from issuer.logs import Lazy
+from issuer.metrics import registry
+from issuer.pagination import KeysetPagination
+from issuer.parsers import JSONLinesParser
+from issuer.serializers import TransactionSerializer, BatchTransactionSerializer, BalanceSerializer, \
+    BalancePointSerializer, BalancesRequestSerializer, VolumeSerializer
 
 logger = logging.getLogger('fintech.issuer.views')
 
@@ -22,16 +41,197 @@ class TransactionHandler(APIView):
     post:
     Handle & save transaction in json format
     Mandatory fields: transaction_id, type, card_id, billing_amount, billing_currency, transaction_amount, transaction_currency
+    Batch of transactions can be sent as json array or json lines,
+    response contains status of each transaction in the same order.
+    Repeated transaction is not applied again and gets status of saved one
     """
+    parser_classes = list(api_settings.DEFAULT_PARSER_CLASSES) + [JSONLinesParser]
+
     def post(self, request, format=None):
-        logger.info('Recived transaction: {}'.format(str(request.data)))
+        if isinstance(request.data, list):
+            return self.post_batch(request)
+        logger.info("Recived transaction: %s", request.data)
+        key = idempotency.get_key(request.data)
+        repeats = idempotency.get_filter()
+        if key and repeats.seen(key):
+            logger.info("Repeated transaction %s", key)
+            return Response(status=status.HTTP_200_OK)
+        engine = get_engine()
+        if engine is not None:
+            if request.data.get("type", AUTHORISATION) == AUTHORISATION:
+                return self.post_to_engine(engine, request.data)
+            engine.flush()
         serializer = TransactionSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
-            logger.info("Save transaction {}".format(str(serializer.data)))
+            try:
+                serializer.save()
+            except InsufficientFunds as exc:
+                velocity.release(serializer.reservation)
+                logger.info("Declined transaction: %s", exc)
+                return Response(status=status.HTTP_403_FORBIDDEN)
+            except IntegrityError:
+                velocity.release(serializer.reservation)
+                if not (key and repeats.exists(key)):
+                    raise
+                logger.info("Repeated transaction %s", key)
+                return Response(status=status.HTTP_200_OK)
+            except Exception:
+                velocity.release(serializer.reservation)
+                raise
+            if key:
+                repeats.remember(key)
+            if engine is not None:
+                engine.refresh([serializer.validated_data["card_id"].card_id])
+            logger.info("Save transaction %s", Lazy(lambda: serializer.data))
+            return Response(status=status.HTTP_200_OK)
+        if key and repeats.exists(key):
+            logger.info("Repeated transaction %s", key)
             return Response(status=status.HTTP_200_OK)
         return Response(status=status.HTTP_403_FORBIDDEN)
 
+    def post_to_engine(self, engine, data):
+        """Authorise transaction in memory of authorisation engine"""
+        return Response(status=self.authorize_on_engine(engine, data)["status"])
+
+    def authorize_on_engine(self, engine, item):
+        """
+        Authorise in memory of authorisation engine,
+        only fields of transaction are checked in database.
+        Returns result of transaction as batch does.
+        """
+        serializer = BatchTransactionSerializer(data=item)
+        if not serializer.is_valid():
+            return batch.rejected(item, serializer.errors)
+        data = serializer.validated_data
+        try:
+            reservation = velocity.check(data["card_id"], data["billing_amount"])
+        except velocity.VelocityLimitExceeded as exc:
+            logger.info("Declined transaction: %s", exc)
+            return batch.rejected(data, {"non_field_errors": ["{}".format(exc)]})
+        try:
+            authorized = engine.authorize(data)
+        except (InsufficientFunds, Account.DoesNotExist) as exc:
+            velocity.release(reservation)
+            logger.info("Declined transaction: %s", exc)
+            return batch.rejected(data, {"non_field_errors": ["{}".format(exc)]})
+        if not authorized:
+            velocity.release(reservation)
+        return batch.accepted(data)
+
+    def post_batch(self, request):
+        logger.info("Recived batch of %s transactions", len(request.data))
+        if len(request.data) > settings.ISSUER_MAX_BATCH_SIZE:
+            return Response(
+                {"detail": "Batch is limited to {} transactions".format(settings.ISSUER_MAX_BATCH_SIZE)},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+        engine = get_engine()
+        if engine is not None:
+            return Response(self.post_batch_to_engine(engine, request.data), status=status.HTTP_200_OK)
+        return Response(batch.ingest(request.data), status=status.HTTP_200_OK)
+
+    def post_batch_to_engine(self, engine, items):
+        """
+        Authorisations of batch are decided by authorisation engine,
+        which stays the only writer of holds, the other transactions
+        are ingested as batch after authorisations are flushed
+        """
+        results = [None] * len(items)
+        others = []
+        for index, item in enumerate(items):
+            if isinstance(item, dict) and item.get("type", AUTHORISATION) == AUTHORISATION:
+                results[index] = self.authorize_on_engine(engine, item)
+            else:
+                others.append(index)
+        if others:
+            engine.flush()
+            for index, result in zip(others, batch.ingest([items[index] for index in others])):
+                results[index] = result
+            engine.refresh(set(items[index]["card_id"] for index in others
+                if isinstance(items[index], dict) and isinstance(items[index].get("card_id"), six.string_types)))
+        return results
+
+
+class IngestQueueHandler(APIView):
+    """
+    post:
+    Check transaction or batch of transactions and put it in ingest journal.
+    Transactions are applied by 'ingest_worker' command, response contains
+    tracking id of every accepted transaction. Queue is disabled while
+    authorisation engine is enabled, as worker would bypass it.
+    """
+    parser_classes = list(api_settings.DEFAULT_PARSER_CLASSES) + [JSONLinesParser]
+
+    def post(self, request, format=None):
+        if settings.ISSUER_AUTH_ENGINE:
+            return Response(
+                {"detail": "Ingest queue is disabled with authorisation engine"},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        items = request.data if isinstance(request.data, list) else [request.data]
+        if len(items) > settings.ISSUER_MAX_BATCH_SIZE:
+            return Response(
+                {"detail": "Batch is limited to {} transactions".format(settings.ISSUER_MAX_BATCH_SIZE)},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+        results = []
+        valid = []
+        for item in items:
+            if hasattr(item, "dict"):
+                item = item.dict()
+            serializer = BatchTransactionSerializer(data=item)
+            if serializer.is_valid():
+                # Fields as validated, card id of number is queued as string
+                valid.append(dict((name, serializer.fields[name].to_representation(value))
+                    for name, value in serializer.validated_data.items()))
+                results.append(None)
+            else:
+                results.append(batch.rejected(item, serializer.errors))
+        ids = iter(get_journal().append(valid))
+        results = [result or {"id": next(ids), "status": status.HTTP_202_ACCEPTED} for result in results]
+        logger.info("Queued %s of %s transactions", len(valid), len(items))
+        if isinstance(request.data, list):
+            return Response(results, status=status.HTTP_202_ACCEPTED)
+        return Response(results[0], status=results[0]["status"])
+
+
+class IngestStatus(APIView):
+    """
+    get:
+    Status and result of transaction put in ingest journal
+    """
+
+    def get(self, request, pk, format=None):
+        entry = get_journal().get(int(pk))
+        if entry is None:
+            raise Http404
+        return Response(entry)
+
+
+def stream_json(queryset, serializer_class):
+    """
+    Serialize queryset into json array item by item,
+    rows are fetched from database in chunks
+    """
+    yield "["
+    for number, obj in enumerate(queryset.iterator()):
+        if number:
+            yield ","
+        yield json.dumps(serializer_class(obj).data, cls=encoders.JSONEncoder)
+    yield "]"
+
+
+class ReplicaReadMixin(object):
+    """
+    Reads of view go to replica database, except reads of card
+    ('name' in url or 'card_id' parameters) which was just written
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        cards = [kwargs["name"]] if "name" in kwargs else request.GET.getlist("card_id")
+        with routers.use_replica(*cards):
+            return super(ReplicaReadMixin, self).dispatch(request, *args, **kwargs)
+
 
 class AccountMixin:
     """Mixin for getting account object"""
@@ -43,26 +243,40 @@ class AccountMixin:
             raise Http404
 
 
-class AccountTransactions(AccountMixin, APIView):
+class AccountTransactions(ReplicaReadMixin, AccountMixin, APIView):
     """
     get:
     Select presentment transaction history for selected account in selected timeframe
+    With 'page_size' or 'cursor' returns page of history and cursor of the next page,
+    with 'stream=1' streams whole history as json array
     """
 
     def get(self, request, name, format=None):
         start_t = request.query_params.get("start")
         end_t = request.query_params.get("end")
         acc = self.get_object(name)
-        logger.info("Requested transaction for %s from %s till %s" % \
-            (acc, start_t, end_t))
+        logger.info("Requested transaction for %s from %s till %s",
+            name, start_t, end_t)
         transactions = acc.transactions.\
             get_in_timeframe(start_t, end_t).\
             filter(type__exact="presentment")
-        logger.info("Found transactions for time: {}".format(transactions))
+        stream = serializers.BooleanField().run_validation(request.query_params.get("stream", False))
+        if stream:
+            return StreamingHttpResponse(
+                routers.replica_iterator(
+                    stream_json(transactions.order_by("date", "id"), TransactionSerializer), name),
+                content_type="application/json"
+            )
+        paginator = KeysetPagination()
+        if set(request.query_params) & set([paginator.cursor_query_param, paginator.page_size_query_param]):
+            page = paginator.paginate_queryset(transactions, request)
+            serializer = TransactionSerializer(page, many=True)
+            return paginator.get_paginated_response(serializer.data)
+        logger.debug("Found transactions for time: %s", transactions)
         serializer = TransactionSerializer(transactions, many=True)
         return Response(serializer.data)
 
-class AccountBalance(AccountMixin, APIView):
+class AccountBalance(ReplicaReadMixin, AccountMixin, APIView):
     """
     get:
     Select account balance and avaliable ('ledger_balance') history for particular time
@@ -70,8 +284,139 @@ class AccountBalance(AccountMixin, APIView):
 
     def get(self, request, name, format=None):
         t_point = request.query_params.get("time")
+        if not t_point:
+            balances = Account.objects.get_balance(name)
+            if balances is None:
+                raise Http404
+            return Response(BalanceSerializer(balances).data)
         acc = self.get_object(name)
         balances = acc.get_balance_in_time(t_point)
         serializer = BalanceSerializer(balances)
         return Response(serializer.data)
 
+
+class AccountBalances(APIView):
+    """
+    get:
+    Select balances of several accounts given by repeated 'card_id' parameter,
+    at point of time 'time' if it is given.
+    Returns {"balances": {card_id: balance}, "missing": [card ids without account]}
+
+    post:
+    The same with json body {"card_ids": [...], "time": ...}
+    """
+
+    def get(self, request, format=None):
+        data = {"card_ids": request.query_params.getlist("card_id")}
+        if request.query_params.get("time"):
+            data["time"] = request.query_params.get("time")
+        return self.balances(data)
+
+    def post(self, request, format=None):
+        return self.balances(request.data)
+
+    def balances(self, data):
+        serializer = BalancesRequestSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        card_ids = serializer.validated_data["card_ids"]
+        with routers.use_replica(*card_ids):
+            balances = Account.objects.get_balances(card_ids, serializer.validated_data.get("time"))
+        return Response({
+            "balances": dict((card_id, BalanceSerializer(balance).data)
+                for card_id, balance in balances.items()),
+            "missing": sorted(set(card_ids) - set(balances)),
+        })
+
+
+class AccountBalanceHistory(ReplicaReadMixin, AccountMixin, APIView):
+    """
+    get:
+    Select account balance and avaliable ('ledger_balance') at several points of time,
+    given as repeated 'time' parameter or as series from 'start' to 'end' with 'step'
+    (seconds or duration like '1 00:00:00')
+    """
+
+    def get(self, request, name, format=None):
+        acc = self.get_object(name)
+        points = self.get_points(request.query_params)
+        if len(points) > settings.ISSUER_MAX_BALANCE_POINTS:
+            raise ValidationError("At most {} points are allowed".format(settings.ISSUER_MAX_BALANCE_POINTS))
+        serializer = BalancePointSerializer(acc.get_balance_series(points), many=True)
+        return Response(serializer.data)
+
+    def get_points(self, params):
+        """List of requested points of time"""
+        try:
+            if params.getlist("time"):
+                return [parse_time(t) for t in params.getlist("time")]
+            start = parse_time(params.get("start"))
+            end = parse_time(params.get("end"))
+        except exceptions.ValidationError as error:
+            raise ValidationError(error.messages)
+        step = parse_duration(params.get("step") or "")
+        if step is None or step <= datetime.timedelta(0):
+            raise ValidationError("Positive 'step' is required with 'start' and 'end'")
+        if end < start:
+            raise ValidationError("'end' is earlier than 'start'")
+        count = int((end - start).total_seconds() // step.total_seconds()) + 1
+        if count > settings.ISSUER_MAX_BALANCE_POINTS:
+            raise ValidationError("At most {} points are allowed".format(settings.ISSUER_MAX_BALANCE_POINTS))
+        return [start + step * i for i in range(count)]
+
+
+def parse_time(value):
+    """Parse required point of time"""
+    point = models.DateTimeField().to_python(value)
+    if point is None:
+        raise exceptions.ValidationError("Time is required")
+    return point
+
+
+class VolumeReport(ReplicaReadMixin, APIView):
+    """
+    get:
+    Number and amounts of transactions per hourly or daily bucket ('period'),
+    type and billing currency from 'start' to 'end', together with totals.
+    Optional filters: 'card_id', 'type', 'currency'.
+    Answered from rollups, which are up to date as of the last 'rollup_transactions'
+    run unless ISSUER_ROLLUP_ON_SAVE is set
+    """
+
+    def get(self, request, format=None):
+        params = request.query_params
+        period = params.get("period", "day")
+        if period not in dict(PERIOD_CHOICES):
+            raise ValidationError("'period' should be one of: {}".format(", ".join(dict(PERIOD_CHOICES))))
+        try:
+            start = models.DateTimeField().to_python(params.get("start"))
+            end = models.DateTimeField().to_python(params.get("end"))
+        except exceptions.ValidationError as error:
+            raise ValidationError(error.messages)
+        rollups = VolumeRollup.objects.filter(period=period)
+        if start:
+            rollups = rollups.filter(bucket__gte=get_bucket(start, period))
+        if end:
+            rollups = rollups.filter(bucket__lte=end)
+        for param, lookup in [("card_id", "card"), ("type", "type"), ("currency", "currency")]:
+            if params.get(param):
+                rollups = rollups.filter(**{lookup: params.get(param)})
+        sums = dict(
+            count=models.Sum("count"),
+            billing_amount=models.Sum("billing_amount"),
+            settlement_amount=models.Sum("settlement_amount")
+        )
+        buckets = rollups.values("bucket", "type", "currency").annotate(**sums).\
+            order_by("bucket", "type", "currency")
+        totals = rollups.values("type", "currency").annotate(**sums).order_by("type", "currency")
+        return Response({
+            "period": period,
+            "buckets": VolumeSerializer(buckets, many=True).data,
+            "totals": VolumeSerializer(totals, many=True).data,
+        })
+
+
+def metrics(request):
+    """
+    Request metrics of this process in Prometheus text format
+    """
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4")